@@ -0,0 +1,98 @@
+# backend/auth_cache.py
+# Process-wide caches for the auth dependencies: verified access tokens
+# (token -> user id) and user records (id -> detached User). A token entry never
+# outlives the token's own exp. User entries are dropped by ORM events whenever
+# a user row is updated or deleted through SQLAlchemy in this process, along
+# with the tokens issued to that user; other processes catch up within
+# AUTH_USER_CACHE_TTL_SECONDS. Least recently used entries are evicted past the
+# size caps.
+import os, threading, time
+from collections import OrderedDict
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from backend.models import User
+
+AUTH_CACHE_ENABLED = os.getenv("AUTH_CACHE_ENABLED", "true").lower() == "true"
+AUTH_TOKEN_CACHE_TTL_SECONDS = int(os.getenv("AUTH_TOKEN_CACHE_TTL_SECONDS", "300"))
+AUTH_USER_CACHE_TTL_SECONDS = int(os.getenv("AUTH_USER_CACHE_TTL_SECONDS", "60"))
+AUTH_CACHE_MAX_ENTRIES = int(os.getenv("AUTH_CACHE_MAX_ENTRIES", "10000"))
+
+
+class TTLCache:
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> (expires_at, value), wall-clock expiry
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value, expires_at: float):
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def discard(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def discard_values(self, value):
+        with self._lock:
+            for key in [k for k, (_, v) in self._entries.items() if v == value]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+tokens = TTLCache(AUTH_CACHE_MAX_ENTRIES)
+users = TTLCache(AUTH_CACHE_MAX_ENTRIES)
+
+
+def cached_token(token: str):
+    return tokens.get(token) if AUTH_CACHE_ENABLED else None
+
+
+def remember_token(token: str, user_id: int, exp: float):
+    if AUTH_CACHE_ENABLED:
+        tokens.set(token, user_id, min(exp, time.time() + AUTH_TOKEN_CACHE_TTL_SECONDS))
+
+
+def cached_user(user_id: int):
+    return users.get(user_id) if AUTH_CACHE_ENABLED else None
+
+
+def remember_user(user: User):
+    if AUTH_CACHE_ENABLED:
+        users.set(user.id, user, time.time() + AUTH_USER_CACHE_TTL_SECONDS)
+
+
+def invalidate_user(user_id: int):
+    users.discard(user_id)
+    tokens.discard_values(user_id)
+
+
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def _user_changed(mapper, connection, target):
+    invalidate_user(target.id)
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _bulk_user_change(state):
+    # query(User).update()/delete() and update(User)/delete(User) skip the mapper
+    # events and don't say which rows they hit
+    if (state.is_update or state.is_delete) and state.bind_mapper is not None and state.bind_mapper.class_ is User:
+        users.clear()
+        tokens.clear()
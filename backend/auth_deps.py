@@ -1,9 +1,14 @@
 # backend/auth_deps.py
+import hmac, os
 from fastapi import Depends, HTTPException, Header, Request
-from sqlalchemy.orm import Session
-from backend.database import SessionLocal
-from backend.jwt_utils import verify_access_token
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import make_transient_to_detached
+from backend.database import SessionLocal, AsyncSessionLocal, ReadAsyncSessionLocal
+from backend.jwt_utils import decode_access_token
 from backend.models import User
+from backend import auth_cache
+
+OPS_TOKEN = os.getenv("OPS_TOKEN", "")
 
 def get_db():
     db = SessionLocal()
@@ -12,7 +17,17 @@ def get_db():
     finally:
         db.close()
 
-def get_current_user_id(request: Request, authorization: str = Header(None)) -> int:
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+async def get_read_db():
+    # Read replica when DATABASE_REPLICA_URL is set; only for endpoints that never write
+    async with ReadAsyncSessionLocal() as db:
+        yield db
+
+# async although it never awaits: FastAPI then runs it inline instead of via the threadpool
+async def get_current_user_id(request: Request, authorization: str = Header(None)) -> int:
     token = None
 
     # 1. Prefer Authorization header
@@ -26,13 +41,34 @@ def get_current_user_id(request: Request, authorization: str = Header(None)) ->
     if not token:
         raise HTTPException(status_code=401, detail="Authorization token missing")
 
+    # Verified tokens are remembered until their exp, so the HS256 check runs once per token
+    user_id = auth_cache.cached_token(token)
+    if user_id is not None:
+        return user_id
     try:
-        return verify_access_token(token)
+        user_id, exp = decode_access_token(token)
     except Exception:
         raise HTTPException(401, "Invalid or expired token")
+    auth_cache.remember_token(token, user_id, exp)
+    return user_id
+
+async def require_ops_token(x_ops_token: str = Header(None)):
+    # /ops/* expose every tenant's job stats and process internals: operators only
+    if not OPS_TOKEN:
+        raise HTTPException(403, "Ops endpoints are disabled; set OPS_TOKEN")
+    if not x_ops_token or not hmac.compare_digest(x_ops_token, OPS_TOKEN):
+        raise HTTPException(401, "Invalid ops token")
 
-def get_current_user(db: Session = Depends(get_db), user_id: int = Depends(get_current_user_id)) -> User:
-    user = db.query(User).get(user_id)
+async def get_current_user(db: AsyncSession = Depends(get_async_db), user_id: int = Depends(get_current_user_id)) -> User:
+    cached = auth_cache.cached_user(user_id)
+    if cached is not None:
+        # Attach a copy to this request's session without a SELECT
+        return await db.merge(cached, load=False)
+    user = await db.get(User, user_id)
     if not user:
         raise HTTPException(401, "User not found")
+    # Detached copy for the cache: column attributes only, never tied to a session
+    snapshot = User(**{c.key: getattr(user, c.key) for c in User.__table__.columns})
+    make_transient_to_detached(snapshot)
+    auth_cache.remember_user(snapshot)
     return user
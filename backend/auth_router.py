@@ -11,6 +11,7 @@ from backend.database import SessionLocal
 from backend.models import User, CloudCredential
 from backend.jwt_utils import issue_access_token, verify_access_token
 from backend.auth_deps import get_current_user
+from backend.client_cache import clients as client_cache
 
 load_dotenv()
 
@@ -187,6 +188,7 @@ async def azure_callback(code: str, db: Session = Depends(get_db), current_user=
             extra_json_enc=encrypt_text(json.dumps(extra_payload)),
         ))
     db.commit()
+    client_cache.invalidate((current_user.id, "azure"))
 
     return RedirectResponse(f"{FRONTEND_BASE_URL}/choose-cloud?azure=connected")
 
@@ -0,0 +1,294 @@
+# backend/bench.py
+# Latency regression benchmarks against a real database. Each benchmark seeds a
+# throwaway user, grows its history through the given sizes, times the code under
+# test at every size and removes the user again. Exits 1 when latency at the
+# largest size is more than --max-growth times that at the smallest.
+#
+#   python -m backend.bench insights [--sizes 30000,100000,300000] [--repeat 15]
+#
+# The load test instead starts one uvicorn worker serving the same query from a
+# sync (threadpool) and an async (asyncpg) handler, and reports the throughput
+# each sustains under concurrent clients. --db-latency-ms adds a server-side
+# sleep per request to stand in for a remote database.
+#
+#   python -m backend.bench load [--concurrency 200] [--seconds 10] [--db-latency-ms 10]
+#
+# The auth benchmark times the auth dependency chain in-process (ASGI, no
+# sockets) with the token/user caches off and on.
+#
+#   python -m backend.bench auth [--repeat 2000]
+import argparse, asyncio, datetime, os, socket, statistics, subprocess, sys, time, uuid
+from sqlalchemy import text
+from backend.database import SessionLocal, AsyncSessionLocal
+from backend.models import User, CloudMetric
+from backend.metric_writer import write_metrics
+
+BENCH_VMS = 100
+PERIOD = datetime.timedelta(minutes=5)
+
+
+def _seed(db, user_id: int, start: int, stop: int, anchor: datetime.datetime):
+    # History grows backwards from anchor, so the newest day is the same at every size
+    def rows():
+        for k in range(start, stop):
+            ts = anchor - PERIOD * (k // BENCH_VMS)
+            yield {
+                "user_id": user_id, "provider": ("aws", "gcp", "azure")[k % 3], "vm_id": f"vm-{k % BENCH_VMS}",
+                "timestamp": ts.isoformat(), "ts": ts, "cpu_usage": float(k % 37), "memory_usage": float(k % 23),
+                "network_traffic": float(k % 1000),
+            }
+    write_metrics(db, rows(), label="bench")
+
+
+def _time(fn, repeat: int) -> float:
+    fn()  # warm caches and the connection
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    return statistics.median(samples) * 1000
+
+
+def _bench_user(db) -> int:
+    user = User(email=f"bench-{uuid.uuid4().hex[:12]}@cloud9.invalid", provider="local")
+    db.add(user)
+    db.commit()
+    return user.id
+
+
+def _drop_user(db, user_id: int):
+    db.query(CloudMetric).filter(CloudMetric.user_id == user_id).delete(synchronize_session=False)
+    db.query(User).filter(User.id == user_id).delete(synchronize_session=False)  # rollups cascade
+    db.commit()
+
+
+def run(cases: dict, sizes, repeat: int, max_growth: float) -> bool:
+    anchor = datetime.datetime.now(datetime.timezone.utc).replace(second=0, microsecond=0)
+    results = {name: [] for name in cases}
+    with SessionLocal() as db:
+        user_id = _bench_user(db)
+        try:
+            seeded = 0
+            for size in sizes:
+                _seed(db, user_id, seeded, size, anchor)
+                seeded = size
+                for name, case in cases.items():
+                    results[name].append(_time(lambda: case(db, user_id, anchor), repeat))
+        finally:
+            db.rollback()
+            _drop_user(db, user_id)
+
+    ok = True
+    print(f"\n{'case':<28}" + "".join(f"{n:>12,}" for n in sizes) + f"{'growth':>10}")
+    for name, ms in results.items():
+        growth = ms[-1] / ms[0] if ms[0] else float("inf")
+        flag = "" if growth <= max_growth else "  REGRESSION"
+        ok = ok and not flag
+        print(f"{name:<28}" + "".join(f"{v:>10.2f}ms" for v in ms) + f"{growth:>9.2f}x{flag}")
+    return ok
+
+
+def insights_cases() -> dict:
+    # The statement /users/me/insights awaits, run on the sync session
+    from backend.rollups import totals
+    day = datetime.timedelta(days=1)
+
+    def midnight(ts):
+        return ts.replace(hour=0, minute=0)
+
+    return {
+        "all time (daily rollups)": lambda db, uid, now: totals(db, uid),
+        "aws, last 7 days (daily)": lambda db, uid, now: totals(db, uid, "aws", midnight(now) - 7 * day),
+        "last 6 hours (hourly)": lambda db, uid, now: totals(db, uid, since=now.replace(minute=0) - datetime.timedelta(hours=6)),
+        "last 90 minutes (raw SQL)": lambda db, uid, now: totals(db, uid, since=now - datetime.timedelta(minutes=90)),
+    }
+
+
+BENCHMARKS = {"insights": insights_cases}
+
+
+# ---------------------- Load test ----------------------
+def _make_load_app():
+    from fastapi import FastAPI
+    from backend.main import _latest
+
+    app = FastAPI()
+    user_id = int(os.getenv("BENCH_USER_ID", "0"))
+    latency = float(os.getenv("BENCH_DB_LATENCY_MS", "0")) / 1000
+
+    @app.get("/sync")
+    def sync_handler():
+        with SessionLocal() as db:
+            if latency:
+                db.execute(text("SELECT pg_sleep(:s)"), {"s": latency})
+            return len(db.execute(_latest(user_id, 50)).scalars().all())
+
+    @app.get("/async")
+    async def async_handler():
+        async with AsyncSessionLocal() as db:
+            if latency:
+                await db.execute(text("SELECT pg_sleep(:s)"), {"s": latency})
+            return len((await db.execute(_latest(user_id, 50))).scalars().all())
+
+    @app.get("/ready")
+    def ready():
+        return "ok"
+
+    return app
+
+
+if os.getenv("BENCH_USER_ID"):
+    load_app = _make_load_app()  # imported by the uvicorn worker the load test starts
+
+
+async def _hammer(url: str, concurrency: int, seconds: float) -> dict:
+    import httpx
+    latencies, errors = [], 0
+    deadline = time.perf_counter() + seconds
+
+    async def client(http):
+        nonlocal errors
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            try:
+                r = await http.get(url)
+                r.raise_for_status()
+                latencies.append(time.perf_counter() - started)
+            except Exception:
+                errors += 1
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(limits=limits, timeout=60) as http:
+        started = time.perf_counter()
+        await asyncio.gather(*(client(http) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+    latencies.sort()
+    pick = lambda q: latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000 if latencies else 0.0
+    return {"rps": len(latencies) / elapsed, "p50": pick(0.5), "p99": pick(0.99), "errors": errors}
+
+
+def load_test(concurrency: int, seconds: float, db_latency_ms: float) -> bool:
+    import httpx
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    with SessionLocal() as db:
+        user_id = _bench_user(db)
+        _seed(db, user_id, 0, 5000, datetime.datetime.now(datetime.timezone.utc))
+    env = dict(os.environ, BENCH_USER_ID=str(user_id), BENCH_DB_LATENCY_MS=str(db_latency_ms))
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "backend.bench:load_app", "--port", str(port), "--workers", "1", "--log-level", "warning"],
+        env=env,
+    )
+    base = f"http://127.0.0.1:{port}"
+    try:
+        for _ in range(100):
+            try:
+                if httpx.get(f"{base}/ready").status_code == 200:
+                    break
+            except httpx.TransportError:
+                time.sleep(0.1)
+        results = {}
+        for name in ("sync", "async"):
+            asyncio.run(_hammer(f"{base}/{name}", min(concurrency, 20), 1))  # warm-up
+            results[name] = asyncio.run(_hammer(f"{base}/{name}", concurrency, seconds))
+    finally:
+        server.terminate()
+        server.wait()
+        with SessionLocal() as db:
+            _drop_user(db, user_id)
+
+    print(f"\n{concurrency} concurrent clients, {seconds:g}s each, {db_latency_ms:g} ms simulated DB latency, 1 worker")
+    print(f"{'handler':<8}{'req/s':>10}{'p50':>10}{'p99':>10}{'errors':>8}")
+    for name, r in results.items():
+        print(f"{name:<8}{r['rps']:>10.1f}{r['p50']:>8.1f}ms{r['p99']:>8.1f}ms{r['errors']:>8}")
+    return results["async"]["rps"] >= results["sync"]["rps"]
+
+
+# ---------------------- Auth dependencies ----------------------
+def auth_bench(repeat: int) -> bool:
+    import httpx
+    from fastapi import Depends, FastAPI
+    from backend import auth_cache
+    from backend.auth_deps import get_current_user, get_current_user_id
+    from backend.jwt_utils import issue_access_token
+
+    app = FastAPI()
+
+    @app.get("/none")
+    async def no_auth():
+        return 0
+
+    @app.get("/user-id")
+    async def user_id_only(user_id: int = Depends(get_current_user_id)):
+        return user_id
+
+    @app.get("/user")
+    async def full_user(user=Depends(get_current_user)):
+        return user.id
+
+    async def timed(http, path) -> float:
+        for _ in range(50):  # warm-up, and fills the caches when they are on
+            await http.get(path)
+        samples = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            r = await http.get(path)
+            samples.append(time.perf_counter() - started)
+            r.raise_for_status()
+        return statistics.median(samples) * 1e6
+
+    async def measure() -> dict:
+        headers = {"Authorization": f"Bearer {issue_access_token(user_id)}"}
+        out = {}
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench", headers=headers) as http:
+            out["no auth"] = (await timed(http, "/none"),) * 2
+            for label, path in (("get_current_user_id", "/user-id"), ("get_current_user", "/user")):
+                timings = []
+                for enabled in (False, True):
+                    auth_cache.AUTH_CACHE_ENABLED = enabled
+                    auth_cache.tokens.clear()
+                    auth_cache.users.clear()
+                    timings.append(await timed(http, path))
+                out[label] = tuple(timings)
+        return out
+
+    with SessionLocal() as db:
+        user_id = _bench_user(db)
+    try:
+        results = asyncio.run(measure())
+    finally:
+        with SessionLocal() as db:
+            _drop_user(db, user_id)
+
+    print(f"\nmedian per request over {repeat} requests (in-process ASGI)")
+    print(f"{'endpoint dependency':<24}{'cache off':>12}{'cache on':>12}")
+    for name, (off, on) in results.items():
+        print(f"{name:<24}{off:>10.0f}us{on:>10.0f}us")
+    return all(on <= off for off, on in results.values())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Latency regression benchmarks and load test")
+    parser.add_argument("benchmark", choices=sorted(BENCHMARKS) + ["auth", "load"])
+    parser.add_argument("--sizes", default="30000,100000,300000", help="comma separated row counts")
+    parser.add_argument("--repeat", type=int, help="timed runs per case; default 15, auth 2000")
+    parser.add_argument("--max-growth", type=float, default=3.0, help="allowed latency ratio largest/smallest")
+    parser.add_argument("--concurrency", type=int, default=200, help="load: concurrent clients")
+    parser.add_argument("--seconds", type=float, default=10, help="load: duration per handler")
+    parser.add_argument("--db-latency-ms", type=float, default=10, help="load: simulated database latency")
+    args = parser.parse_args()
+    if args.benchmark == "load":
+        ok = load_test(args.concurrency, args.seconds, args.db_latency_ms)
+    elif args.benchmark == "auth":
+        ok = auth_bench(args.repeat or 2000)
+    else:
+        sizes = sorted(int(s) for s in args.sizes.split(","))
+        ok = run(BENCHMARKS[args.benchmark](), sizes, args.repeat or 15, args.max_growth)
+    if not ok:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
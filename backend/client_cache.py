@@ -0,0 +1,73 @@
+# backend/client_cache.py
+# Process-wide cache of cloud SDK clients and credentials, one entry per
+# (user_id, provider). Entries carry a fingerprint of the stored (encrypted)
+# secret, so a changed credential row misses on the next lookup in every
+# process; credentials_router also drops the local entry eagerly. Entries expire
+# after a TTL and the least recently used ones are evicted past the size cap.
+import hashlib, os, threading, time
+from collections import OrderedDict
+
+CLIENT_CACHE_TTL_SECONDS = int(os.getenv("CLIENT_CACHE_TTL_SECONDS", "3600"))
+CLIENT_CACHE_MAX_ENTRIES = int(os.getenv("CLIENT_CACHE_MAX_ENTRIES", "256"))
+
+
+def fingerprint(cred) -> str:
+    # Hash of the ciphertext: cheap, and needs no decrypt_text to compare
+    h = hashlib.sha256()
+    for part in (cred.provider, cred.access_key_enc, cred.secret_key_enc, cred.extra_json_enc):
+        h.update((part or "").encode())
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+class ClientCache:
+    def __init__(self, max_entries: int = CLIENT_CACHE_MAX_ENTRIES, ttl: int = CLIENT_CACHE_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()  # owner -> (fingerprint, expires_at, value)
+        self._build_locks = {}
+        self._lock = threading.Lock()
+
+    def get(self, owner, fp: str, factory):
+        """Cached value for ``owner`` if it was built from the same secret, else ``factory()``."""
+        hit = self._lookup(owner, fp)
+        if hit is not None:
+            return hit
+        with self._lock:
+            build_lock = self._build_locks.setdefault(owner, threading.Lock())
+        # One build per owner at a time; concurrent callers wait and reuse it
+        with build_lock:
+            hit = self._lookup(owner, fp)
+            if hit is not None:
+                return hit
+            value = factory()
+            with self._lock:
+                self._entries[owner] = (fp, time.monotonic() + self.ttl, value)
+                self._entries.move_to_end(owner)
+                while len(self._entries) > self.max_entries:
+                    evicted, _ = self._entries.popitem(last=False)
+                    self._build_locks.pop(evicted, None)
+            return value
+
+    def _lookup(self, owner, fp):
+        with self._lock:
+            entry = self._entries.get(owner)
+            if entry is None:
+                return None
+            entry_fp, expires_at, value = entry
+            if entry_fp != fp or expires_at <= time.monotonic():
+                del self._entries[owner]
+                return None
+            self._entries.move_to_end(owner)
+            return value
+
+    def invalidate(self, owner):
+        with self._lock:
+            self._entries.pop(owner, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+clients = ClientCache()
@@ -1,15 +1,51 @@
 # backend/cloud_ingestors.py
 from sqlalchemy.orm import Session
-from backend.models import CloudCredential, CloudMetric
-import json, datetime
+from backend.models import CloudCredential
+import json, os, threading, time
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
 from backend.crypto_utils import decrypt_text
+from backend import watermarks
+from backend.metric_writer import write_metrics
+from backend.client_cache import clients as client_cache, fingerprint
+
+
+def _fan_out(pool, calls, timeout, label):
+    """Run {key: callable} on ``pool`` under one shared deadline.
+
+    Returns {key: result} for the calls that finished in time; failures and
+    timeouts are logged and left out so the caller can carry on without them.
+    """
+    deadline = time.monotonic() + timeout
+    futures = {key: pool.submit(call) for key, call in calls.items()}
+    results = {}
+    for key, future in futures.items():
+        try:
+            results[key] = future.result(timeout=max(0.0, deadline - time.monotonic()))
+        except FutureTimeout:
+            future.cancel()
+            print(f"{label} {key} timed out after {timeout:.0f}s, skipping")
+        except Exception as e:
+            print(f"{label} {key} error: {e}")
+    return results
+
+
+def _write_chunk(db: Session, user_id: int, provider: str, metrics, resource_ids, w_end):
+    # Watermarks only move once every sample below them is committed
+    written = write_metrics(db, metrics, label=provider.upper())["rows"]
+    watermarks.advance(db, user_id, provider, resource_ids, w_end)
+    db.commit()
+    return written
 
 
 # ---------- AWS ----------
+AWS_REGION_CONCURRENCY = int(os.getenv("AWS_REGION_CONCURRENCY", "8"))  # per account
+AWS_REGION_TIMEOUT = float(os.getenv("AWS_REGION_TIMEOUT", "120"))  # seconds per region and step
+
+
 def ingest_aws(db: Session, user_id: int):
     try:
         import boto3
-        from botocore.exceptions import ClientError
     except ImportError:
         print("[ingest] boto3 not installed, skipping AWS")
         return 0
@@ -20,148 +56,196 @@ def ingest_aws(db: Session, user_id: int):
         .first()
     )
     if not cred or not cred.access_key_enc or not cred.secret_key_enc:
+        client_cache.invalidate((user_id, "aws"))
         return 0
 
-    access = decrypt_text(cred.access_key_enc)
-    secret = decrypt_text(cred.secret_key_enc)
-
     try:
-        # Initialize AWS clients
-        session = boto3.Session(
-            aws_access_key_id=access,
-            aws_secret_access_key=secret,
-            region_name='us-east-1'  # Default region
-        )
-        
-        ec2 = session.client('ec2')
-        cloudwatch = session.client('cloudwatch')
-        s3 = session.client('s3')
-        
-        end = datetime.datetime.utcnow()
-        start = end - datetime.timedelta(hours=1)
+        aws = client_cache.get((user_id, "aws"), fingerprint(cred), partial(_aws_build_clients, cred))
+
+        # Only regions enabled for this account (opt-in regions excluded unless opted in)
+        regions = [region['RegionName'] for region in aws.client('ec2').describe_regions()['Regions']]
+        clients = {region: (aws.client('ec2', region), aws.client('cloudwatch', region)) for region in regions}
+
         rows = 0
+        pool = ThreadPoolExecutor(max_workers=max(1, AWS_REGION_CONCURRENCY), thread_name_prefix=f"aws-{user_id}")
+        try:
+            # Regions run concurrently and share one deadline per step
+            instances = _fan_out(
+                pool, {region: partial(_aws_list_instances, ec2c) for region, (ec2c, _) in clients.items()},
+                AWS_REGION_TIMEOUT, "[AWS] Region",
+            )
+            marks = watermarks.load(db, user_id, "aws")
+            end = watermarks.ingest_end()
+            starts = {
+                instance['InstanceId']: watermarks.start_for(marks, instance['InstanceId'], end)
+                for found in instances.values() for instance in found
+            }
 
-        # Get all running instances across all regions
-        regions = [region['RegionName'] for region in ec2.describe_regions()['Regions']]
-        
-        for region in regions[:3]:  # Limit to 3 regions for performance
-            try:
-                regional_ec2 = boto3.client(
-                    'ec2',
-                    aws_access_key_id=access,
-                    aws_secret_access_key=secret,
-                    region_name=region
+            for w_start, w_end in watermarks.windows(starts.values(), end):
+                due = {
+                    region: [i for i in found if starts[i['InstanceId']] < w_end]
+                    for region, found in instances.items()
+                }
+                series = _fan_out(
+                    pool,
+                    {
+                        region: partial(_aws_fetch_instance_metrics, clients[region][1],
+                                        [i['InstanceId'] for i in found], w_start, w_end)
+                        for region, found in due.items() if found
+                    },
+                    AWS_REGION_TIMEOUT, "[AWS] Region",
                 )
-                
-                # Get running instances
-                response = regional_ec2.describe_instances(
-                    Filters=[{'Name': 'instance-state-name', 'Values': ['running', 'stopped']}]
-                )
-                
-                for reservation in response.get('Reservations', []):
-                    for instance in reservation.get('Instances', []):
+                metrics, covered = [], []
+                for region, stats in series.items():
+                    for instance in due[region]:
                         instance_id = instance['InstanceId']
-                        instance_type = instance.get('InstanceType', 'unknown')
-                        state = instance['State']['Name']
-                        
-                        # Get CPU utilization from CloudWatch
-                        cpu_usage = _aws_get_metric_average(
-                            cloudwatch, region, 'AWS/EC2', 'CPUUtilization',
-                            'InstanceId', instance_id, start, end
-                        ) or 0.0
-                        
-                        # Get network metrics
-                        network_in = _aws_get_metric_sum(
-                            cloudwatch, region, 'AWS/EC2', 'NetworkIn',
-                            'InstanceId', instance_id, start, end
-                        ) or 0.0
-                        
-                        network_out = _aws_get_metric_sum(
-                            cloudwatch, region, 'AWS/EC2', 'NetworkOut', 
-                            'InstanceId', instance_id, start, end
-                        ) or 0.0
-
-                        # Create metric record
-                        metric = CloudMetric(
-                            provider="aws",
-                            vm_id=instance_id,
-                            vm_name=instance_id,  # AWS doesn't have friendly names by default
-                            timestamp=end.isoformat() + "Z",
-                            cpu_usage=cpu_usage,
-                            memory_usage=0.0,  # Requires CloudWatch agent
-                            network_traffic=float(network_in + network_out),
-                            power_consumption=0.0,
-                            execution_time=0.0,
-                            task_type=instance_type,
-                            region=region,
-                            instance_state=state,
-                            user_id=user_id,
-                        )
-                        db.add(metric)
-                        rows += 1
-                        
-            except ClientError as e:
-                print(f"[AWS] Error in region {region}: {e}")
-                continue
-
-        db.commit()
-        print(f"[AWS] Ingested {rows} instance metrics for user {user_id}")
+                        covered.append(instance_id)
+                        for ts, values in sorted(stats.get(instance_id, {}).items()):
+                            if ts >= starts[instance_id]:
+                                metrics.append(_aws_metric(user_id, region, instance, ts, values))
+                rows += _write_chunk(db, user_id, "aws", metrics, covered, w_end)
+        finally:
+            # Don't block the run on regions that blew their budget
+            pool.shutdown(wait=False, cancel_futures=True)
+
+        print(f"[AWS] Ingested {rows} instance samples across {len(regions)} regions for user {user_id}")
         return rows
-        
+
     except Exception as e:
         print(f"[AWS] General error: {e}")
         db.rollback()
         return 0
 
 
-def _aws_get_metric_average(cw, region, namespace, metric_name, dimension_name, dimension_value, start, end):
-    try:
-        response = cw.get_metric_statistics(
-            Namespace=namespace,
-            MetricName=metric_name,
-            Dimensions=[{'Name': dimension_name, 'Value': dimension_value}],
-            StartTime=start,
-            EndTime=end,
-            Period=300,
-            Statistics=['Average'],
-            Unit='Percent'
-        )
-        datapoints = response.get('Datapoints', [])
-        if datapoints:
-            # Get the most recent datapoint
-            datapoints.sort(key=lambda x: x['Timestamp'])
-            return float(datapoints[-1]['Average'])
-    except Exception as e:
-        print(f"[AWS] Metric error for {metric_name}: {e}")
-    return None
+class _AwsClients:
+    # Sessions are not thread-safe, clients are: creation is serialised on the
+    # session and the clients themselves are shared by the region workers.
+    def __init__(self, session, config):
+        self._session = session
+        self._config = config
+        self._clients = {}
+        self._lock = threading.Lock()
 
+    def client(self, service, region='us-east-1'):
+        with self._lock:
+            key = (service, region)
+            if key not in self._clients:
+                self._clients[key] = self._session.client(service, region_name=region, config=self._config)
+            return self._clients[key]
 
-def _aws_get_metric_sum(cw, region, namespace, metric_name, dimension_name, dimension_value, start, end):
-    try:
-        response = cw.get_metric_statistics(
-            Namespace=namespace,
-            MetricName=metric_name,
-            Dimensions=[{'Name': dimension_name, 'Value': dimension_value}],
+
+def _aws_build_clients(cred):
+    import boto3
+    from botocore.config import Config
+
+    session = boto3.Session(
+        aws_access_key_id=decrypt_text(cred.access_key_enc),
+        aws_secret_access_key=decrypt_text(cred.secret_key_enc),
+        region_name='us-east-1'  # Default region
+    )
+    return _AwsClients(session, Config(
+        connect_timeout=10,
+        read_timeout=min(60, AWS_REGION_TIMEOUT),
+        retries={'max_attempts': 3, 'mode': 'adaptive'},
+        max_pool_connections=max(10, AWS_REGION_CONCURRENCY),
+    ))
+
+
+def _aws_list_instances(regional_ec2):
+    instances = []
+    paginator = regional_ec2.get_paginator('describe_instances')
+    pages = paginator.paginate(
+        Filters=[{'Name': 'instance-state-name', 'Values': ['running', 'stopped']}]
+    )
+    for response in pages:
+        for reservation in response.get('Reservations', []):
+            instances.extend(reservation.get('Instances', []))
+    return instances
+
+
+def _aws_metric(user_id, region, instance, ts, values):
+    return dict(
+        provider="aws",
+        vm_id=instance['InstanceId'],
+        vm_name=instance['InstanceId'],  # AWS doesn't have friendly names by default
+        timestamp=watermarks.iso(ts),
+        cpu_usage=values.get('CPUUtilization', 0.0),
+        memory_usage=0.0,  # Requires CloudWatch agent
+        network_traffic=float(values.get('NetworkIn', 0.0) + values.get('NetworkOut', 0.0)),
+        power_consumption=0.0,
+        execution_time=0.0,
+        task_type=instance.get('InstanceType', 'unknown'),
+        region=region,
+        instance_state=instance['State']['Name'],
+        user_id=user_id,
+    )
+
+
+# (metric name, statistic, unit) fetched for every instance
+AWS_INSTANCE_METRICS = [
+    ('CPUUtilization', 'Average', 'Percent'),
+    ('NetworkIn', 'Sum', 'Bytes'),
+    ('NetworkOut', 'Sum', 'Bytes'),
+]
+AWS_MAX_METRIC_QUERIES = 500  # GetMetricData hard limit per request
+
+
+def _aws_fetch_instance_metrics(cw, instance_ids, start, end):
+    """Every 5 minute datapoint of the AWS_INSTANCE_METRICS series in [start, end).
+
+    Returns {instance_id: {timestamp: {metric_name: value}}} with naive UTC
+    timestamps; API errors propagate so the caller doesn't advance watermarks.
+    """
+    queries, lookup = [], {}
+    for i, instance_id in enumerate(instance_ids):
+        for j, (metric_name, stat, unit) in enumerate(AWS_INSTANCE_METRICS):
+            query_id = f"m{i}_{j}"  # ids must start with a lowercase letter
+            lookup[query_id] = (instance_id, metric_name)
+            queries.append({
+                'Id': query_id,
+                'MetricStat': {
+                    'Metric': {
+                        'Namespace': 'AWS/EC2',
+                        'MetricName': metric_name,
+                        'Dimensions': [{'Name': 'InstanceId', 'Value': instance_id}],
+                    },
+                    'Period': watermarks.PERIOD_SECONDS,
+                    'Stat': stat,
+                    'Unit': unit,
+                },
+                'ReturnData': True,
+            })
+
+    results = {}
+    for offset in range(0, len(queries), AWS_MAX_METRIC_QUERIES):
+        kwargs = dict(
+            MetricDataQueries=queries[offset:offset + AWS_MAX_METRIC_QUERIES],
             StartTime=start,
             EndTime=end,
-            Period=300,
-            Statistics=['Sum'],
-            Unit='Bytes'
+            ScanBy='TimestampAscending',
         )
-        datapoints = response.get('Datapoints', [])
-        if datapoints:
-            datapoints.sort(key=lambda x: x['Timestamp'])
-            return float(datapoints[-1]['Sum'])
-    except Exception as e:
-        print(f"[AWS] Metric error for {metric_name}: {e}")
-    return None
+        while True:
+            response = cw.get_metric_data(**kwargs)
+            for item in response.get('MetricDataResults', []):
+                if item['Id'] not in lookup:
+                    continue
+                instance_id, metric_name = lookup[item['Id']]
+                points = results.setdefault(instance_id, {})
+                for ts, value in zip(item.get('Timestamps', []), item.get('Values', [])):
+                    ts = watermarks.naive_utc(ts)
+                    if ts < end:
+                        points.setdefault(ts, {})[metric_name] = float(value)
+            token = response.get('NextToken')
+            if not token:
+                break
+            kwargs['NextToken'] = token
+    return results
 
 
 # ---------- GCP ----------
 def ingest_gcp(db: Session, user_id: int):
     try:
         from google.cloud import monitoring_v3, compute_v1
-        from google.oauth2 import service_account
         from google.api_core.exceptions import GoogleAPIError
     except ImportError:
         print("[ingest] google-cloud-monitoring not installed, skipping GCP")
@@ -173,120 +257,153 @@ def ingest_gcp(db: Session, user_id: int):
         .first()
     )
     if not cred or not cred.extra_json_enc:
+        client_cache.invalidate((user_id, "gcp"))
         return 0
 
     try:
-        sa_json = decrypt_text(cred.extra_json_enc)
-        info = json.loads(sa_json)
-        project_id = info.get("project_id")
+        project_id, monitoring_client, compute_client = client_cache.get(
+            (user_id, "gcp"), fingerprint(cred), partial(_gcp_build_clients, cred)
+        )
         if not project_id:
             return 0
 
-        credentials = service_account.Credentials.from_service_account_info(info)
-        
-        # Initialize clients
-        monitoring_client = monitoring_v3.MetricServiceClient(credentials=credentials)
-        compute_client = compute_v1.InstancesClient(credentials=credentials)
-        
-        end = datetime.datetime.utcnow()
-        start = end - datetime.timedelta(hours=1)
-        rows = 0
+        # Every zone in one paginated call
+        instances = []
+        for zone_key, scoped in compute_client.aggregated_list(request={"project": project_id}):
+            for instance in scoped.instances:
+                instances.append((zone_key.split('/')[-1], instance))
 
-        # Get all zones and instances
-        zones_client = compute_v1.ZonesClient(credentials=credentials)
-        zones = [zone.name for zone in zones_client.list(project=project_id)]
-        
-        for zone in zones[:3]:  # Limit to 3 zones for performance
+        marks = watermarks.load(db, user_id, "gcp")
+        end = watermarks.ingest_end()
+        starts = {str(instance.id): watermarks.start_for(marks, str(instance.id), end) for _, instance in instances}
+
+        rows = 0
+        for w_start, w_end in watermarks.windows(starts.values(), end):
+            # One list_time_series per metric type for the whole project
             try:
-                # List instances in this zone
-                instances = compute_client.list(project=project_id, zone=zone)
-                
-                for instance in instances:
-                    instance_id = str(instance.id)
-                    instance_name = instance.name
-                    machine_type = instance.machine_type.split('/')[-1]
-                    status = instance.status.lower()
-                    
-                    # Get CPU utilization
-                    cpu_usage = _gcp_get_metric(
-                        monitoring_client, project_id,
-                        'compute.googleapis.com/instance/cpu/utilization',
-                        instance_id, start, end
-                    ) or 0.0
-                    
-                    # Get network traffic
-                    network_usage = _gcp_get_metric(
-                        monitoring_client, project_id,
-                        'compute.googleapis.com/instance/network/received_bytes_count', 
-                        instance_id, start, end
-                    ) or 0.0
-
-                    metric = CloudMetric(
+                series = {
+                    key: _gcp_fetch_series(monitoring_client, project_id, metric_type, aligner, w_start, w_end)
+                    for key, (metric_type, aligner) in GCP_INSTANCE_METRICS.items()
+                }
+            except GoogleAPIError as e:
+                print(f"[GCP] Metric error for {w_start.isoformat()}..{w_end.isoformat()}: {e}")
+                break  # watermarks stay put; the next run retries from here
+
+            metrics, covered = [], []
+            for zone, instance in instances:
+                instance_id = str(instance.id)
+                if starts[instance_id] >= w_end:
+                    continue
+                covered.append(instance_id)
+                cpu = series["cpu"].get(instance_id, {})
+                network = series["network"].get(instance_id, {})
+                for ts in sorted(set(cpu) | set(network)):
+                    if ts < starts[instance_id]:
+                        continue
+                    metrics.append(dict(
                         provider="gcp",
                         vm_id=instance_id,
-                        vm_name=instance_name,
-                        timestamp=end.isoformat() + "Z",
-                        cpu_usage=cpu_usage * 100,  # Convert to percentage
+                        vm_name=instance.name,
+                        timestamp=watermarks.iso(ts),
+                        cpu_usage=cpu.get(ts, 0.0) * 100,  # Convert to percentage
                         memory_usage=0.0,
-                        network_traffic=float(network_usage),
+                        network_traffic=float(network.get(ts, 0.0)),
                         power_consumption=0.0,
                         execution_time=0.0,
-                        task_type=machine_type,
+                        task_type=instance.machine_type.split('/')[-1],
                         region=zone,
-                        instance_state=status,
+                        instance_state=instance.status.lower(),
                         user_id=user_id,
-                    )
-                    db.add(metric)
-                    rows += 1
-                    
-            except GoogleAPIError as e:
-                print(f"[GCP] Error in zone {zone}: {e}")
-                continue
+                    ))
+            rows += _write_chunk(db, user_id, "gcp", metrics, covered, w_end)
 
-        db.commit()
-        print(f"[GCP] Ingested {rows} instance metrics for user {user_id}")
+        print(f"[GCP] Ingested {rows} instance samples for user {user_id}")
         return rows
-        
+
     except Exception as e:
         print(f"[GCP] General error: {e}")
         db.rollback()
         return 0
 
 
-def _gcp_get_metric(client, project_id, metric_type, instance_id, start, end):
-    try:
-        interval = monitoring_v3.TimeInterval({
-            "end_time": {"seconds": int(end.timestamp())},
-            "start_time": {"seconds": int(start.timestamp())},
-        })
-        
-        results = client.list_time_series(
-            request={
-                "name": f"projects/{project_id}",
-                "filter": f'metric.type = "{metric_type}" AND metric.labels.instance_id = "{instance_id}"',
-                "interval": interval,
-                "view": monitoring_v3.ListTimeSeriesRequest.TimeSeriesView.FULL,
-            }
-        )
-        
-        for series in results:
-            if series.points:
-                # Get the most recent point
-                return float(series.points[0].value.double_value)
-                
-    except Exception as e:
-        print(f"[GCP] Metric error for {metric_type}: {e}")
-    return None
+def _gcp_build_clients(cred):
+    # The credentials object refreshes and caches its own access token
+    from google.cloud import monitoring_v3, compute_v1
+    from google.oauth2 import service_account
+
+    info = json.loads(decrypt_text(cred.extra_json_enc))
+    project_id = info.get("project_id")
+    if not project_id:
+        return None, None, None
+    credentials = service_account.Credentials.from_service_account_info(info)
+    return (
+        project_id,
+        monitoring_v3.MetricServiceClient(credentials=credentials),
+        compute_v1.InstancesClient(credentials=credentials),
+    )
+
+
+# key -> (metric type, server-side aligner applied per 5 minute period)
+GCP_INSTANCE_METRICS = {
+    "cpu": ("compute.googleapis.com/instance/cpu/utilization", "ALIGN_MEAN"),
+    "network": ("compute.googleapis.com/instance/network/received_bytes_count", "ALIGN_SUM"),
+}
+
+
+def _gcp_fetch_series(client, project_id, metric_type, aligner, start, end):
+    """Aligned points of ``metric_type`` for every gce_instance in the project.
+
+    Returns {instance_id: {timestamp: value}}, demultiplexed from the
+    project-wide series by the ``instance_id`` resource label.
+    """
+    from google.cloud import monitoring_v3
+
+    interval = monitoring_v3.TimeInterval({
+        "end_time": {"seconds": int(end.timestamp())},
+        "start_time": {"seconds": int(start.timestamp())},
+    })
+    aggregation = monitoring_v3.Aggregation({
+        "alignment_period": {"seconds": watermarks.PERIOD_SECONDS},
+        "per_series_aligner": getattr(monitoring_v3.Aggregation.Aligner, aligner),
+    })
+
+    results = client.list_time_series(
+        request={
+            "name": f"projects/{project_id}",
+            "filter": f'metric.type = "{metric_type}" AND resource.type = "gce_instance"',
+            "interval": interval,
+            "aggregation": aggregation,
+            "view": monitoring_v3.ListTimeSeriesRequest.TimeSeriesView.FULL,
+        }
+    )
+
+    points = {}
+    for series in results:
+        instance_id = series.resource.labels.get("instance_id")
+        if not instance_id:
+            continue
+        by_ts = points.setdefault(instance_id, {})
+        for point in series.points:
+            ts = watermarks.naive_utc(point.interval.end_time)
+            if not start <= ts < end:
+                continue
+            # ALIGN_SUM over an int64 counter stays int64. Some metrics split an
+            # instance across label values (e.g. loadbalanced), so those series
+            # are summed back together.
+            value = point.value
+            by_ts[ts] = by_ts.get(ts, 0.0) + float(value.double_value or value.int64_value)
+    return points
 
 
 # ---------- Azure ----------
+AZURE_SUBSCRIPTION_CONCURRENCY = int(os.getenv("AZURE_SUBSCRIPTION_CONCURRENCY", "4"))
+AZURE_METRIC_CONCURRENCY = int(os.getenv("AZURE_METRIC_CONCURRENCY", "16"))  # per subscription
+AZURE_SUBSCRIPTION_TIMEOUT = float(os.getenv("AZURE_SUBSCRIPTION_TIMEOUT", "300"))  # seconds per step
+
+
 def ingest_azure(db: Session, user_id: int):
     try:
-        from azure.identity import ClientSecretCredential
-        from azure.mgmt.compute import ComputeManagementClient
-        from azure.mgmt.monitor import MonitorManagementClient
-        from azure.mgmt.subscription import SubscriptionClient
-        from azure.core.exceptions import ResourceNotFoundError
+        import azure.identity, azure.mgmt.compute, azure.mgmt.monitor
     except ImportError:
         print("[ingest] azure-mgmt packages not installed, skipping Azure")
         return 0
@@ -297,105 +414,147 @@ def ingest_azure(db: Session, user_id: int):
         .first()
     )
     if not cred or not cred.extra_json_enc:
+        client_cache.invalidate((user_id, "azure"))
         return 0
 
     try:
-        info = json.loads(decrypt_text(cred.extra_json_enc) or "{}")
-        tenant_id = info.get("tenant_id")
-        client_id = info.get("client_id") 
-        client_secret = info.get("client_secret")
-        subscription_id = info.get("subscription_id")
-
-        if not all([tenant_id, client_id, client_secret, subscription_id]):
+        subscription_ids, clients = client_cache.get(
+            (user_id, "azure"), fingerprint(cred), partial(_azure_build_clients, cred)
+        )
+        if not subscription_ids:
             return 0
 
-        credential = ClientSecretCredential(
-            tenant_id=tenant_id, 
-            client_id=client_id, 
-            client_secret=client_secret
-        )
-        
-        # Initialize clients
-        compute_client = ComputeManagementClient(credential, subscription_id)
-        monitor_client = MonitorManagementClient(credential, subscription_id)
-        
-        end = datetime.datetime.utcnow()
-        start = end - datetime.timedelta(hours=1)
         rows = 0
-
-        # Get all virtual machines
-        vms = compute_client.virtual_machines.list_all()
-        
-        for vm in vms:
-            try:
-                vm_name = vm.name
-                vm_id = vm.id
-                location = vm.location
-                vm_size = vm.hardware_profile.vm_size if vm.hardware_profile else "unknown"
-                
-                # Get power state
-                power_state = "unknown"
-                instance_view = compute_client.virtual_machines.instance_view(
-                    resource_group_name=vm.id.split('/')[4],  # Extract resource group
-                    vm_name=vm_name
-                )
-                for status in instance_view.statuses:
-                    if status.code.startswith('PowerState/'):
-                        power_state = status.code.split('/')[-1]
-                        break
-                
-                # Get CPU metrics
-                cpu_usage = _azure_get_metric(
-                    monitor_client, vm_id, 'Percentage CPU', start, end
-                ) or 0.0
-
-                metric = CloudMetric(
-                    provider="azure",
-                    vm_id=vm_id,
-                    vm_name=vm_name,
-                    timestamp=end.isoformat() + "Z",
-                    cpu_usage=cpu_usage,
-                    memory_usage=0.0,  # Azure doesn't provide memory by default
-                    network_traffic=0.0,
-                    power_consumption=0.0,
-                    execution_time=0.0,
-                    task_type=vm_size,
-                    region=location,
-                    instance_state=power_state,
-                    user_id=user_id,
+        # Subscriptions are independent: a slow or failing one doesn't hold up the rest
+        pool = ThreadPoolExecutor(max_workers=max(1, AZURE_SUBSCRIPTION_CONCURRENCY), thread_name_prefix=f"azure-{user_id}")
+        try:
+            vms = _fan_out(
+                pool, {sub: partial(_azure_list_vms, compute) for sub, (compute, _) in clients.items()},
+                AZURE_SUBSCRIPTION_TIMEOUT, "[Azure] Subscription",
+            )
+            marks = watermarks.load(db, user_id, "azure")
+            end = watermarks.ingest_end()
+            starts = {vm.id: watermarks.start_for(marks, vm.id, end) for found in vms.values() for vm in found}
+
+            for w_start, w_end in watermarks.windows(starts.values(), end):
+                due = {sub: [vm for vm in found if starts[vm.id] < w_end] for sub, found in vms.items()}
+                series = _fan_out(
+                    pool,
+                    {
+                        sub: partial(_azure_fetch_cpu, clients[sub][1], found, w_start, w_end)
+                        for sub, found in due.items() if found
+                    },
+                    AZURE_SUBSCRIPTION_TIMEOUT, "[Azure] Subscription",
                 )
-                db.add(metric)
-                rows += 1
-                
-            except (ResourceNotFoundError, Exception) as e:
-                print(f"[Azure] Error processing VM {vm.name}: {e}")
-                continue
-
-        db.commit()
-        print(f"[Azure] Ingested {rows} VM metrics for user {user_id}")
+                metrics, covered = [], []
+                for sub, cpu in series.items():
+                    for vm in due[sub]:
+                        if vm.id not in cpu:
+                            continue
+                        covered.append(vm.id)
+                        for ts, cpu_usage in sorted(cpu[vm.id].items()):
+                            if ts < starts[vm.id]:
+                                continue
+                            metrics.append(dict(
+                                provider="azure",
+                                vm_id=vm.id,
+                                vm_name=vm.name,
+                                timestamp=watermarks.iso(ts),
+                                cpu_usage=cpu_usage,
+                                memory_usage=0.0,  # Azure doesn't provide memory by default
+                                network_traffic=0.0,
+                                power_consumption=0.0,
+                                execution_time=0.0,
+                                task_type=vm.hardware_profile.vm_size if vm.hardware_profile else "unknown",
+                                region=vm.location,
+                                instance_state=_azure_power_state(vm.instance_view),
+                                user_id=user_id,
+                            ))
+                rows += _write_chunk(db, user_id, "azure", metrics, covered, w_end)
+        finally:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+        print(f"[Azure] Ingested {rows} VM samples across {len(subscription_ids)} subscriptions for user {user_id}")
         return rows
-        
+
     except Exception as e:
         print(f"[Azure] General error: {e}")
         db.rollback()
         return 0
 
 
-def _azure_get_metric(monitor_client, resource_uri, metric_name, start, end):
-    try:
-        metrics_data = monitor_client.metrics.list(
-            resource_uri=resource_uri,
-            timespan=f"{start.isoformat()}Z/{end.isoformat()}Z",
-            interval="PT1H",
-            metricnames=metric_name,
-            aggregation="Average"
+def _azure_build_clients(cred):
+    from azure.identity import ClientSecretCredential
+    from azure.mgmt.compute import ComputeManagementClient
+    from azure.mgmt.monitor import MonitorManagementClient
+
+    info = json.loads(decrypt_text(cred.extra_json_enc) or "{}")
+    tenant_id = info.get("tenant_id")
+    client_id = info.get("client_id")
+    client_secret = info.get("client_secret")
+    subscription_ids = info.get("subscription_ids") or [info.get("subscription_id")]
+    subscription_ids = [s for s in subscription_ids if s]
+
+    if not all([tenant_id, client_id, client_secret, subscription_ids]):
+        return [], {}
+
+    # The credential caches its token and is shared by every subscription
+    credential = ClientSecretCredential(
+        tenant_id=tenant_id,
+        client_id=client_id,
+        client_secret=client_secret
+    )
+    return subscription_ids, {
+        subscription_id: (
+            ComputeManagementClient(credential, subscription_id),
+            MonitorManagementClient(credential, subscription_id),
         )
-        
-        for item in metrics_data.value:
-            if item.timeseries:
-                for data in item.timeseries[0].data:
-                    if data.average is not None:
-                        return float(data.average)
-    except Exception as e:
-        print(f"[Azure] Metric error for {metric_name}: {e}")
-    return None
\ No newline at end of file
+        for subscription_id in subscription_ids
+    }
+
+
+def _azure_list_vms(compute_client):
+    # Power state comes back with the listing, no per-VM instance_view call
+    return list(compute_client.virtual_machines.list_all(expand="instanceView"))
+
+
+def _azure_fetch_cpu(monitor_client, vms, start, end):
+    # azure-mgmt-monitor has no multi-resource metrics call, so fan the
+    # per-VM requests out over a bounded pool instead. VMs whose request fails
+    # are left out so only their watermarks stay behind.
+    with ThreadPoolExecutor(max_workers=max(1, AZURE_METRIC_CONCURRENCY)) as pool:
+        futures = {vm.id: pool.submit(_azure_get_metric, monitor_client, vm.id, 'Percentage CPU', start, end) for vm in vms}
+        series = {}
+        for vm_id, future in futures.items():
+            try:
+                series[vm_id] = future.result()
+            except Exception as e:
+                print(f"[Azure] Metric error for {vm_id}: {e}")
+        return series
+
+
+def _azure_power_state(instance_view):
+    for status in (instance_view.statuses if instance_view else None) or []:
+        if status.code and status.code.startswith('PowerState/'):
+            return status.code.split('/')[-1]
+    return "unknown"
+
+
+def _azure_get_metric(monitor_client, resource_uri, metric_name, start, end):
+    """5 minute averages of ``metric_name`` in [start, end) as {timestamp: value}."""
+    metrics_data = monitor_client.metrics.list(
+        resource_uri=resource_uri,
+        timespan=f"{start.isoformat()}Z/{end.isoformat()}Z",
+        interval="PT5M",
+        metricnames=metric_name,
+        aggregation="Average"
+    )
+
+    points = {}
+    for item in metrics_data.value:
+        for series in item.timeseries or []:
+            for data in series.data:
+                ts = watermarks.naive_utc(data.time_stamp)
+                if data.average is not None and start <= ts < end:
+                    points[ts] = float(data.average)
+    return points
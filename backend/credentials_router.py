@@ -1,37 +1,34 @@
 from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List
 
-from backend.database import SessionLocal
 from backend.models import CloudCredential
 from backend.schemas import CloudCredentialIn, CloudCredentialOut
 from backend.crypto_utils import encrypt_text
-from backend.auth_deps import get_current_user
+from backend.auth_deps import get_async_db, get_current_user
+from backend.client_cache import clients as client_cache
 
 router = APIRouter(prefix="/credentials", tags=["credentials"])
 
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+
+async def _find(db: AsyncSession, user_id: int, provider: str):
+    result = await db.execute(
+        select(CloudCredential).where(CloudCredential.user_id == user_id, CloudCredential.provider == provider)
+    )
+    return result.scalars().first()
 
 
 @router.post("", response_model=CloudCredentialOut, status_code=status.HTTP_201_CREATED)
-def upsert_credentials(
+async def upsert_credentials(
     payload: CloudCredentialIn,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     user = Depends(get_current_user),
 ):
     if payload.provider not in {"aws", "azure", "gcp"}:
         raise HTTPException(status_code=400, detail="provider must be aws|azure|gcp")
 
-    cred = (
-        db.query(CloudCredential)
-        .filter(CloudCredential.user_id == user.id, CloudCredential.provider == payload.provider)
-        .first()
-    )
+    cred = await _find(db, user.id, payload.provider)
     if not cred:
         cred = CloudCredential(provider=payload.provider, user_id=user.id)
         db.add(cred)
@@ -40,41 +37,36 @@ def upsert_credentials(
     cred.secret_key_enc = encrypt_text(payload.secret_key)
     cred.extra_json_enc = encrypt_text(payload.extra_json)
 
-    db.commit()
-    db.refresh(cred)
+    await db.commit()
+    await db.refresh(cred)
+    # Other processes notice the new secret by its fingerprint on next use
+    client_cache.invalidate((user.id, payload.provider))
     return cred
 
 
 @router.get("", response_model=List[CloudCredentialOut])
-def list_credentials(db: Session = Depends(get_db), user = Depends(get_current_user)):
-    creds = db.query(CloudCredential).filter(CloudCredential.user_id == user.id).all()
-    return creds
+async def list_credentials(db: AsyncSession = Depends(get_async_db), user = Depends(get_current_user)):
+    result = await db.execute(select(CloudCredential).where(CloudCredential.user_id == user.id))
+    return result.scalars().all()
 
 
 @router.get("/{provider}", response_model=CloudCredentialOut)
-def get_provider_credentials(provider: str, db: Session = Depends(get_db), user = Depends(get_current_user)):
+async def get_provider_credentials(provider: str, db: AsyncSession = Depends(get_async_db), user = Depends(get_current_user)):
     if provider not in {"aws", "azure", "gcp"}:
         raise HTTPException(status_code=400, detail="provider must be aws|azure|gcp")
 
-    cred = (
-        db.query(CloudCredential)
-        .filter(CloudCredential.user_id == user.id, CloudCredential.provider == provider)
-        .first()
-    )
+    cred = await _find(db, user.id, provider)
     if not cred:
         raise HTTPException(status_code=404, detail="credentials not found")
     return cred
 
 
 @router.delete("/{provider}", status_code=status.HTTP_204_NO_CONTENT)
-def delete_provider_credentials(provider: str, db: Session = Depends(get_db), user = Depends(get_current_user)):
-    cred = (
-        db.query(CloudCredential)
-        .filter(CloudCredential.user_id == user.id, CloudCredential.provider == provider)
-        .first()
-    )
+async def delete_provider_credentials(provider: str, db: AsyncSession = Depends(get_async_db), user = Depends(get_current_user)):
+    cred = await _find(db, user.id, provider)
     if not cred:
         raise HTTPException(status_code=404, detail="credentials not found")
-    db.delete(cred)
-    db.commit()
+    await db.delete(cred)
+    await db.commit()
+    client_cache.invalidate((user.id, provider))
     return None
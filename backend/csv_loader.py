@@ -0,0 +1,203 @@
+# backend/csv_loader.py
+# Bulk loader for historical metric exports into cloud_metrics.
+#
+# The file is streamed in chunks of --chunk-rows records. Each chunk is parsed
+# and coerced with pandas (vectorized, no per-row Python), serialized as CSV and
+# COPYed in through metric_writer.copy_buffer, so memory is bounded by the chunk
+# size times the chunks in flight, never by the file size. With --workers > 1 the
+# file is split into line blocks that are parsed in worker processes while the
+# main process copies; records must then not contain embedded line breaks.
+#
+#   python -m backend.csv_loader vmCloud_data.csv [--provider aws] [--user-id N]
+#       [--mode append|replace] [--workers 4] [--chunk-rows 100000]
+#       [--on-conflict nothing|update|none]
+#
+# append commits per chunk, so an interrupted load keeps what it wrote and can
+# be re-run (with on_conflict=nothing re-sent samples are skipped, also for rows
+# loaded without --user-id, which have no owner). replace
+# deletes the target's (user_id, provider) rows and loads the file in a single
+# transaction: readers see the old data or the new, never a mix.
+import argparse, csv, io, os, time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+from backend.database import SessionLocal
+from backend.metric_writer import METRIC_COLUMNS, copy_buffer, has_sample_key
+from backend.models import MetricRollupHourly, MetricRollupDaily
+from backend import rollups, response_cache, model_registry
+
+CSV_LOAD_CHUNK_ROWS = int(os.getenv("CSV_LOAD_CHUNK_ROWS", "100000"))
+LOAD_MODES = ("append", "replace")
+
+REQUIRED = ["vm_id", "timestamp"]
+NUMERIC = ["cpu_usage", "memory_usage", "network_traffic", "power_consumption", "execution_time"]
+TEXT = ["vm_id", "vm_name", "region", "instance_state", "task_type", "timestamp"]
+SOURCE_COLUMNS = set(NUMERIC + TEXT)  # anything else in the file is ignored
+
+
+def _read_options():
+    # Everything stays text: numbers are validated but written back as they were
+    # read, which spares a float -> str round trip per value
+    return {"usecols": lambda c: c in SOURCE_COLUMNS, "dtype": str}
+
+
+def _prepare(df: pd.DataFrame, provider: str, user_id: int | None) -> tuple:
+    """Coerce one parsed chunk; returns (COPY csv payload, rollup keys, rows, rejected)."""
+    total = len(df)
+    ts = pd.to_datetime(df["timestamp"], utc=True, errors="coerce", format="ISO8601")
+    keep = ts.notna() & df["vm_id"].notna()
+    df, ts = df[keep], ts[keep]
+
+    out = pd.DataFrame(index=df.index)
+    for c in METRIC_COLUMNS:
+        if c == "user_id":
+            out[c] = user_id
+        elif c == "provider":
+            out[c] = provider
+        elif c == "ts":
+            out[c] = np.datetime_as_string(ts.dt.tz_localize(None).to_numpy(), unit="us", timezone="UTC")
+        elif c not in df:
+            out[c] = None
+        elif c in NUMERIC:
+            out[c] = df[c].where(pd.to_numeric(df[c], errors="coerce").notna())  # non-numbers become NULL
+        else:
+            out[c] = df[c]
+    # Unquoted empty fields are NULL in COPY csv format
+    payload = out.to_csv(header=False, index=False, na_rep="")
+
+    keys = set()
+    if user_id is not None:
+        keys = {(user_id, provider, rollups.hour_of(h)) for h in ts.dt.floor("h").unique().to_pydatetime()}
+    return payload, keys, len(out), total - len(out)
+
+
+def _parse_block(header: bytes, block: bytes, provider: str, user_id: int | None) -> tuple:
+    # Runs in a worker process
+    return _prepare(pd.read_csv(io.BytesIO(header + block), **_read_options()), provider, user_id)
+
+
+def _blocks(path: str, chunk_rows: int):
+    with open(path, "rb") as f:
+        header = f.readline()
+        while True:
+            lines = list(islice(f, chunk_rows))
+            if not lines:
+                return
+            yield header, b"".join(lines)
+
+
+def _prepared(path: str, provider: str, user_id: int | None, workers: int, chunk_rows: int):
+    if workers <= 1:
+        for df in pd.read_csv(path, chunksize=chunk_rows, **_read_options()):
+            yield _prepare(df, provider, user_id)
+        return
+    with ProcessPoolExecutor(workers) as pool:
+        # Bounded read-ahead: at most two blocks per worker in memory at once
+        pending = deque()
+        for header, block in _blocks(path, chunk_rows):
+            pending.append(pool.submit(_parse_block, header, block, provider, user_id))
+            if len(pending) >= workers * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def _check_header(path: str):
+    with open(path, newline="") as f:
+        header = next(csv.reader(f), [])
+    missing = [c for c in REQUIRED if c not in header]
+    if missing:
+        raise ValueError(f"{path}: missing required column(s) {', '.join(missing)}")
+
+
+def _clear(db, provider: str, user_id: int | None):
+    scope = "user_id IS NOT DISTINCT FROM :uid AND provider = :provider"
+    params = {"uid": user_id, "provider": provider}
+    deleted = db.execute(text(f"DELETE FROM cloud_metrics WHERE {scope}"), params).rowcount
+    # Hours that lose all their rows would otherwise keep stale rollups
+    for table in (MetricRollupHourly.__tablename__, MetricRollupDaily.__tablename__):
+        db.execute(text(f"DELETE FROM {table} WHERE {scope}"), params)
+    return deleted
+
+
+def load(path: str, provider: str = "aws", user_id: int | None = None, mode: str = "append",
+         workers: int = 1, chunk_rows: int | None = None, on_conflict: str | None = "nothing") -> dict:
+    """Load a metrics CSV; returns {"rows", "skipped", "rejected", "chunks", "seconds", "rows_per_second"}.
+
+    ``rows`` counts samples written, ``skipped`` duplicates left alone and
+    ``rejected`` records without a vm_id or a parseable timestamp.
+    """
+    if mode not in LOAD_MODES:
+        raise ValueError(f"mode must be one of {LOAD_MODES}")
+    chunk_rows = chunk_rows or CSV_LOAD_CHUNK_ROWS
+    _check_header(path)
+    written, seen, rejected, chunks, deleted = 0, 0, 0, 0, 0
+    started = time.perf_counter()
+    with SessionLocal() as db:
+        if on_conflict and not has_sample_key(db.get_bind()):
+            on_conflict = None  # table not de-duplicated yet; see backend.dedupe_metrics
+        try:
+            if mode == "replace":
+                deleted = _clear(db, provider, user_id)
+            touched = set()
+            for payload, keys, n, bad in _prepared(path, provider, user_id, workers, chunk_rows):
+                if n:
+                    copied = copy_buffer(db, io.StringIO(payload), on_conflict, "(FORMAT csv)")
+                    written += n if copied is None else copied
+                if mode == "append":
+                    rollups.refresh(db, keys)
+                    db.commit()
+                else:
+                    touched |= keys
+                seen += n
+                rejected += bad
+                chunks += 1
+                elapsed = time.perf_counter() - started
+                print(f"[csv_loader] {seen + rejected:,} records read, {written:,} written, "
+                      f"{rejected:,} rejected ({seen / elapsed:,.0f} rows/s)")
+            if mode == "replace":
+                rollups.refresh(db, touched)
+                db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            response_cache.bump([user_id])  # whatever was committed
+
+    seconds = time.perf_counter() - started
+    stats = {
+        "rows": written,
+        "skipped": seen - written,
+        "rejected": rejected,
+        "chunks": chunks,
+        "seconds": round(seconds, 4),
+        "rows_per_second": round(seen / seconds, 1) if seconds > 0 else 0.0,
+    }
+    replaced = f", replacing {deleted:,} rows" if mode == "replace" else ""
+    print(f"[csv_loader] loaded {written:,} rows from {path} in {seconds:.1f}s{replaced} "
+          f"({seen - written:,} duplicates, {rejected:,} rejected, {stats['rows_per_second']:,} rows/s)")
+    if user_id is not None and (written or mode == "replace"):
+        model_registry.refresh(user_id)
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk load a metrics CSV export into cloud_metrics")
+    parser.add_argument("path")
+    parser.add_argument("--provider", default="aws", help="provider recorded on every row")
+    parser.add_argument("--user-id", type=int, help="owner of the rows; default none")
+    parser.add_argument("--mode", choices=LOAD_MODES, default="append",
+                        help="replace swaps out the user's rows for this provider in one transaction")
+    parser.add_argument("--workers", type=int, default=1, help="parser processes")
+    parser.add_argument("--chunk-rows", type=int, default=CSV_LOAD_CHUNK_ROWS)
+    parser.add_argument("--on-conflict", choices=("nothing", "update", "none"), default="nothing")
+    args = parser.parse_args()
+    load(args.path, args.provider, args.user_id, args.mode, args.workers, args.chunk_rows,
+         None if args.on_conflict == "none" else args.on_conflict)
+
+
+if __name__ == "__main__":
+    main()
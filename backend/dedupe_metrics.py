@@ -0,0 +1,116 @@
+# backend/dedupe_metrics.py
+# One-off job: remove duplicate metric samples and install the natural-key
+# constraint the writers upsert against.
+#
+#   python -m backend.dedupe_metrics [--batch-size 50000] [--dry-run]
+#
+# Works in id ranges, one short transaction per batch, so only the duplicate
+# rows being deleted are ever locked. The oldest copy of each sample is kept.
+# The unique index is then built CONCURRENTLY and attached as a constraint,
+# which only needs a brief lock. Safe to re-run.
+import argparse, time
+from sqlalchemy import text
+from backend.database import engine
+from backend.models import METRIC_SAMPLE_KEY, METRIC_SAMPLE_KEY_COLUMNS
+
+TABLE = "cloud_metrics"
+KEY = ", ".join(METRIC_SAMPLE_KEY_COLUMNS)
+HELPER_INDEX = "ix_cloud_metrics_sample_lookup"
+
+DELETE_BATCH = text(f"""
+    DELETE FROM {TABLE} c USING (
+        SELECT id FROM (
+            SELECT id, row_number() OVER (PARTITION BY {KEY} ORDER BY id) AS rn
+            FROM {TABLE}
+            WHERE ({KEY}) IN (SELECT {KEY} FROM {TABLE} WHERE id >= :lo AND id < :hi)
+        ) ranked
+        WHERE rn > 1
+    ) dup
+    WHERE c.id = dup.id
+""")
+
+COUNT_BATCH = text(f"""
+    SELECT count(*) FROM (
+        SELECT id, row_number() OVER (PARTITION BY {KEY} ORDER BY id) AS rn
+        FROM {TABLE}
+        WHERE ({KEY}) IN (SELECT {KEY} FROM {TABLE} WHERE id >= :lo AND id < :hi)
+    ) ranked
+    WHERE rn > 1 AND id >= :lo AND id < :hi  -- each duplicate counted once, in its own batch
+""")
+
+
+def _autocommit():
+    # CREATE INDEX CONCURRENTLY can't run inside a transaction block
+    return engine.connect().execution_options(isolation_level="AUTOCOMMIT")
+
+
+def dedupe(batch_size: int, dry_run: bool = False) -> int:
+    with engine.connect() as conn:
+        lo, hi = conn.execute(text(f"SELECT min(id), max(id) FROM {TABLE}")).one()
+    if lo is None:
+        return 0
+    removed = 0
+    started = time.perf_counter()
+    for start in range(lo, hi + 1, batch_size):
+        params = {"lo": start, "hi": start + batch_size}
+        with engine.begin() as conn:
+            if dry_run:
+                n = conn.execute(COUNT_BATCH, params).scalar()
+            else:
+                n = conn.execute(DELETE_BATCH, params).rowcount
+        removed += n
+        print(f"[dedupe] ids {start}..{start + batch_size - 1}: {n} duplicates "
+              f"({removed} total, {time.perf_counter() - started:.1f}s)")
+    return removed
+
+
+def constraint_exists() -> bool:
+    with engine.connect() as conn:
+        return conn.execute(
+            text("SELECT 1 FROM pg_constraint WHERE conname = :name"), {"name": METRIC_SAMPLE_KEY}
+        ).first() is not None
+
+
+def install_constraint(batch_size: int, attempts: int = 3):
+    for attempt in range(1, attempts + 1):
+        with _autocommit() as conn:
+            # A failed earlier build leaves an INVALID index behind
+            conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {METRIC_SAMPLE_KEY}"))
+            try:
+                conn.execute(text(f"CREATE UNIQUE INDEX CONCURRENTLY {METRIC_SAMPLE_KEY} ON {TABLE} ({KEY})"))
+                conn.execute(text(
+                    f"ALTER TABLE {TABLE} ADD CONSTRAINT {METRIC_SAMPLE_KEY} UNIQUE USING INDEX {METRIC_SAMPLE_KEY}"
+                ))
+                return
+            except Exception as e:
+                # Writers without the constraint can still insert duplicates meanwhile
+                print(f"[dedupe] constraint attempt {attempt} failed: {e}")
+        dedupe(batch_size)
+    raise RuntimeError("could not install the sample key; is ingestion still writing duplicates?")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="De-duplicate cloud_metrics and add its natural key")
+    parser.add_argument("--batch-size", type=int, default=50000, help="id range per transaction")
+    parser.add_argument("--dry-run", action="store_true", help="count duplicates without deleting")
+    args = parser.parse_args()
+
+    if constraint_exists():
+        print(f"[dedupe] {METRIC_SAMPLE_KEY} already present; nothing to do")
+        return
+
+    with _autocommit() as conn:
+        # Makes each batch's key lookup an index probe instead of a table scan
+        conn.execute(text(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {HELPER_INDEX} ON {TABLE} ({KEY})"))
+
+    removed = dedupe(args.batch_size, args.dry_run)
+    print(f"[dedupe] {'found' if args.dry_run else 'removed'} {removed} duplicate samples")
+    if not args.dry_run:
+        install_constraint(args.batch_size)
+        with _autocommit() as conn:
+            conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {HELPER_INDEX}"))
+        print(f"[dedupe] {METRIC_SAMPLE_KEY} installed")
+
+
+if __name__ == "__main__":
+    main()
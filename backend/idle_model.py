@@ -0,0 +1,57 @@
+# backend/idle_model.py
+# Per-user IsolationForest behind /users/me/ai/idle-detection.
+#
+# Trained on the user's recent history and versioned through
+# backend.model_registry, which retrains it after ingestion when the data has
+# grown or drifted. The request path takes the live forest from the registry's
+# in-process cache and runs one vectorized decision_function over the latest
+# samples; it never trains one itself.
+import os
+import numpy as np
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from backend.models import CloudMetric
+from backend import model_registry, partitions
+
+IDLE_CONTAMINATION = float(os.getenv("IDLE_CONTAMINATION", "0.15"))
+IDLE_MIN_TRAIN_ROWS = 10
+FEATURES = model_registry.FEATURES  # cpu, memory, uptime (execution_time), network, power
+KIND = "idle"
+
+
+def fit(feats: np.ndarray):
+    from sklearn.ensemble import IsolationForest
+    return IsolationForest(contamination=IDLE_CONTAMINATION, random_state=42).fit(feats)
+
+
+def _train(db: Session, user_id: int):
+    feats = model_registry.training_matrix(db, user_id)
+    if len(feats) < IDLE_MIN_TRAIN_ROWS:
+        return None
+    return fit(feats), feats
+
+
+model_registry.register(KIND, _train)
+
+
+def get(db: Session, user_id: int):
+    """The user's live forest, or None while it is being trained or there is too little data."""
+    return model_registry.get(db, KIND, user_id)
+
+
+def training(user_id: int) -> bool:
+    return model_registry.training(KIND, user_id)
+
+
+def latest(db: Session, user_id: int, limit: int = 200):
+    """(vm_id, task_type, feature matrix) of the newest samples, without building ORM objects."""
+    columns = [CloudMetric.vm_id, CloudMetric.task_type] + [getattr(CloudMetric, c) for c in FEATURES]
+    for since in partitions.probe_windows():
+        query = select(*columns).where(CloudMetric.user_id == user_id)
+        if since is not None:
+            query = query.where(CloudMetric.ts >= since)
+        rows = db.execute(query.order_by(CloudMetric.ts.desc(), CloudMetric.id.desc()).limit(limit)).all()
+        if len(rows) >= limit:
+            break
+    feats = np.array([[v or 0.0 for v in r[2:]] for r in rows], dtype=np.float64).reshape(-1, len(FEATURES))
+    return [r[0] for r in rows], [r[1] for r in rows], feats
@@ -0,0 +1,186 @@
+# backend/ingest_scheduler.py
+# Fans (user, provider) ingestion jobs out to the Celery workers. The API process
+# only plans and enqueues a cycle; coordination state (per-provider slots, pending
+# markers, job costs, cycle counters) lives in the Redis instance Celery uses.
+import os, time, uuid
+from collections import defaultdict
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from backend.worker import CELERY_BROKER_URL
+
+PROVIDERS = ("aws", "gcp", "azure")
+INGEST_INTERVAL_MINUTES = int(os.getenv("INGEST_INTERVAL_MINUTES", "10"))
+PROVIDER_CONCURRENCY = {
+    p: int(os.getenv(f"INGEST_CONCURRENCY_{p.upper()}", "8" if p == "aws" else "4")) for p in PROVIDERS
+}
+JOB_TIME_BUDGET = {
+    p: int(os.getenv(f"INGEST_TIMEOUT_{p.upper()}", os.getenv("INGEST_JOB_TIMEOUT", "300"))) for p in PROVIDERS
+}
+SLOT_RETRY_SECONDS = int(os.getenv("INGEST_SLOT_RETRY_SECONDS", "5"))
+
+_KEY = "cloud9:ingest"
+_redis_client = None
+
+
+def get_redis():
+    global _redis_client
+    if _redis_client is None:
+        import redis
+        _redis_client = redis.Redis.from_url(CELERY_BROKER_URL, decode_responses=True)
+    return _redis_client
+
+
+# ---------------------- Planning ----------------------
+def plan_jobs(db: Session, costs: dict | None = None):
+    """Ordered (user_id, provider) jobs for one cycle.
+
+    Within a provider, tenants run cheapest-first by last observed duration
+    (unknown tenants count as cheap); providers are interleaved round-robin.
+    """
+    rows = db.execute(text(
+        "SELECT DISTINCT user_id, provider FROM cloud_credentials WHERE user_id IS NOT NULL"
+    )).all()
+    costs = costs or {}
+    per_provider = defaultdict(list)
+    for user_id, provider in rows:
+        if provider in PROVIDERS:
+            per_provider[provider].append(user_id)
+    for provider, users in per_provider.items():
+        users.sort(key=lambda uid: (float(costs.get(f"{uid}:{provider}", 0.0)), uid))
+
+    ordered = []
+    for i in range(max((len(u) for u in per_provider.values()), default=0)):
+        for provider in PROVIDERS:
+            users = per_provider.get(provider, [])
+            if i < len(users):
+                ordered.append((users[i], provider))
+    return ordered
+
+
+def dispatch_cycle(db: Session):
+    """Enqueue one ingestion cycle; jobs still pending from the last one are skipped."""
+    from backend.tasks import ingest_provider
+
+    r = get_redis()
+    jobs = plan_jobs(db, r.hgetall(f"{_KEY}:cost"))
+    cycle_id = uuid.uuid4().hex[:12]
+    expires = INGEST_INTERVAL_MINUTES * 60
+
+    # Claim pending markers first so the cycle counters exist before any job can finish
+    claimed = []
+    now = time.time()
+    for user_id, provider in jobs:
+        # Marker outlives the job's hard limit so a crashed worker can't wedge it forever
+        pending = f"{_KEY}:pending:{user_id}:{provider}"
+        marker, ttl = f"{cycle_id}:{now}", expires + JOB_TIME_BUDGET[provider]
+        if r.set(pending, marker, nx=True, ex=ttl) or (_expired_in_queue(r.get(pending), now, expires)
+                                                       and r.set(pending, marker, ex=ttl)):
+            claimed.append((user_id, provider))
+    dispatched, skipped = len(claimed), len(jobs) - len(claimed)
+
+    r.hset(f"{_KEY}:cycle", mapping={
+        "cycle_id": cycle_id,
+        "started_at": time.time(),
+        "finished_at": "" if claimed else time.time(),
+        "dispatched": dispatched,
+        "skipped": skipped,
+        "completed": 0,
+        "failed": 0,
+        "expired": 0,
+    })
+    for user_id, provider in claimed:
+        ingest_provider.apply_async(
+            args=(user_id, provider, cycle_id),
+            expires=expires,
+            soft_time_limit=JOB_TIME_BUDGET[provider],
+            time_limit=JOB_TIME_BUDGET[provider] + 30,
+        )
+    print(f"[ingest] cycle {cycle_id}: dispatched {dispatched} jobs, {skipped} still pending")
+    return dispatched
+
+
+def _expired_in_queue(marker: str | None, now: float, expires: int) -> bool:
+    # "<cycle>:<dispatched at>" of a job that never started within its expiry;
+    # Celery drops it, so nothing else would clear the marker before its TTL
+    if not marker or marker.startswith("running:"):
+        return False
+    try:
+        return now - float(marker.rsplit(":", 1)[1]) > expires
+    except (IndexError, ValueError):
+        return False
+
+
+# ---------------------- Worker-side coordination ----------------------
+def acquire_slot(provider: str, token: str) -> bool:
+    """Take one of the provider's concurrency slots; stale holders expire after the job budget."""
+    r = get_redis()
+    key = f"{_KEY}:slots:{provider}"
+    now = time.time()
+    pipe = r.pipeline()
+    pipe.zremrangebyscore(key, "-inf", now - JOB_TIME_BUDGET[provider] - 30)
+    pipe.zadd(key, {token: now})
+    pipe.zrank(key, token)
+    rank = pipe.execute()[-1]
+    if rank is not None and rank < PROVIDER_CONCURRENCY[provider]:
+        return True
+    r.zrem(key, token)
+    return False
+
+
+def release_slot(provider: str, token: str):
+    get_redis().zrem(f"{_KEY}:slots:{provider}", token)
+
+
+def mark_running(user_id: int, provider: str, cycle_id: str):
+    get_redis().set(f"{_KEY}:pending:{user_id}:{provider}", f"running:{cycle_id}", xx=True, keepttl=True)
+
+
+def record_job(user_id: int, provider: str, cycle_id: str, duration: float, ok: bool):
+    r = get_redis()
+    r.hset(f"{_KEY}:cost", f"{user_id}:{provider}", round(duration, 3))
+    r.delete(f"{_KEY}:pending:{user_id}:{provider}")
+    _count(r, cycle_id, "completed" if ok else "failed")
+
+
+def record_expired(user_id: int, provider: str, cycle_id: str):
+    """A job that expired or was revoked in the queue and never ran."""
+    r = get_redis()
+    r.delete(f"{_KEY}:pending:{user_id}:{provider}")
+    _count(r, cycle_id, "expired")
+
+
+def _count(r, cycle_id: str, outcome: str):
+    if r.hget(f"{_KEY}:cycle", "cycle_id") != cycle_id:
+        return  # a newer cycle has started; its counters are not ours
+    r.hincrby(f"{_KEY}:cycle", outcome, 1)
+    stats = r.hgetall(f"{_KEY}:cycle")
+    if int(stats["completed"]) + int(stats["failed"]) + int(stats.get("expired", 0)) >= int(stats["dispatched"]):
+        r.hset(f"{_KEY}:cycle", "finished_at", time.time())
+
+
+# ---------------------- Stats ----------------------
+def cycle_stats():
+    r = get_redis()
+    stats = r.hgetall(f"{_KEY}:cycle")
+    if not stats:
+        return {"cycle_id": None}
+    started = float(stats["started_at"])
+    finished = float(stats["finished_at"]) if stats.get("finished_at") else None
+    done = int(stats["completed"]) + int(stats["failed"]) + int(stats.get("expired", 0))
+    return {
+        "cycle_id": stats["cycle_id"],
+        "started_at": started,
+        "duration_seconds": round((finished or time.time()) - started, 3),
+        "finished": finished is not None,
+        "dispatched": int(stats["dispatched"]),
+        "skipped_pending": int(stats["skipped"]),
+        "completed": int(stats["completed"]),
+        "failed": int(stats["failed"]),
+        "expired": int(stats.get("expired", 0)),
+        "backlog": int(stats["dispatched"]) - done,
+        "queue_depth": r.llen("celery"),
+        "running": {p: r.zcard(f"{_KEY}:slots:{p}") for p in PROVIDERS},
+        "concurrency": PROVIDER_CONCURRENCY,
+        "interval_seconds": INGEST_INTERVAL_MINUTES * 60,
+    }
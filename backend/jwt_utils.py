@@ -15,5 +15,9 @@ def issue_access_token(user_id: int) -> str:
     return jwt.encode(payload, SECRET, algorithm="HS256")
 
 def verify_access_token(token: str) -> int:
-    payload = jwt.decode(token, SECRET, algorithms=["HS256"])
-    return int(payload["sub"])
+    return decode_access_token(token)[0]
+
+def decode_access_token(token: str) -> tuple:
+    """Verified (user_id, exp) of an access token."""
+    payload = jwt.decode(token, SECRET, algorithms=["HS256"], options={"require": ["exp"]})
+    return int(payload["sub"]), float(payload["exp"])
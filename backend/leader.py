@@ -0,0 +1,62 @@
+# backend/leader.py
+# Picks the one API process that runs the periodic jobs (partition maintenance,
+# rollup compaction, snapshot export, model refresh, ingest dispatch). Every
+# uvicorn worker starts a scheduler, but only the process holding a session-level
+# Postgres advisory lock adds those jobs. The lock lives on a connection kept
+# checked out for the life of the process; when that process exits the lock is
+# released, and the other workers, which retry every LEADER_RETRY_SECONDS, take
+# over.
+import os, threading
+from sqlalchemy import text
+
+LEADER_RETRY_SECONDS = int(os.getenv("LEADER_RETRY_SECONDS", "60"))
+_LOCK_KEY = "cloud9:scheduler"
+
+_conn = None  # connection holding the lock while this process leads
+_lock = threading.Lock()
+
+
+def acquire(engine) -> bool:
+    """Whether this process leads, taking the lock if it is free."""
+    global _conn
+    if engine.dialect.name != "postgresql":
+        return True  # no advisory locks; a single-process dev setup
+    with _lock:
+        if _conn is not None:
+            try:
+                _conn.execute(text("SELECT 1"))
+                _conn.commit()
+                return True
+            except Exception as e:
+                # The session (and its lock) is gone; another process may lead already
+                print(f"[leader] lost the scheduler lock: {e}")
+                _conn.invalidate()
+                _conn.close()
+                _conn = None
+        conn = engine.connect()
+        try:
+            taken = conn.execute(text("SELECT pg_try_advisory_lock(hashtext(:k))"), {"k": _LOCK_KEY}).scalar()
+            conn.commit()
+        except Exception:
+            conn.close()
+            raise
+        if not taken:
+            conn.close()
+            return False
+        _conn = conn
+        return True
+
+
+def release():
+    global _conn
+    with _lock:
+        if _conn is None:
+            return
+        try:
+            _conn.execute(text("SELECT pg_advisory_unlock(hashtext(:k))"), {"k": _LOCK_KEY})
+            _conn.commit()
+        except Exception as e:
+            print(f"[leader] unlock failed: {e}")
+            _conn.invalidate()  # don't hand a locked session back to the pool
+        _conn.close()
+        _conn = None
@@ -1,24 +1,28 @@
-from fastapi import FastAPI, Depends, HTTPException, Query, Request
+from fastapi import FastAPI, Depends, HTTPException, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
 from starlette.middleware.sessions import SessionMiddleware
-from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from datetime import datetime
 from typing import List, Optional
-import os, numpy as np, pandas as pd, joblib
+import os, zlib, numpy as np
+from starlette.concurrency import run_in_threadpool
 from apscheduler.schedulers.background import BackgroundScheduler
 
-from backend.database import SessionLocal, engine
-from backend.models import Base, CloudMetric
+from backend.database import SessionLocal, engine, read_engine, pool_stats
+from backend.models import Base, CloudMetric, MetricRollupDaily
 from backend import schemas
-from backend.auth_deps import get_current_user_id
+from backend.auth_deps import get_read_db, get_current_user_id, require_ops_token
 from backend.auth_router import router as auth_router
 from backend.credentials_router import router as cred_router
-from backend.cloud_ingestors import ingest_aws, ingest_gcp, ingest_azure
+from backend import ingest_scheduler
+from backend.metric_writer import write_metrics, upsert_metric
+from backend import stream_ingest
+from backend import partitions, rollups, metric_export, snapshots, response_cache, static_assets, idle_model, optimizer_model, model_registry, leader
 
-from datetime import timedelta
-from sqlalchemy import text
+from datetime import timedelta, timezone
+from sqlalchemy import func, select
 
 SESSION_SECRET_KEY = os.getenv("SESSION_SECRET_KEY", "super-secret-session-key")
 FRONTEND_BASE_URL = os.getenv("FRONTEND_BASE_URL", "http://localhost:3000")
@@ -35,6 +39,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "ETag"],
 )
 
 # Routers
@@ -53,67 +58,162 @@ def api_root():
     return {"message": "Cloud9 SaaS backend is running", "docs": "/docs", "status": "ok"}
 
 # ---------------------- Metrics Ingestion ----------------------
+# on_conflict decides what happens to a sample already stored under the same
+# (provider, vm_id, ts): "nothing" keeps the stored one, "update" overwrites it
+ON_CONFLICT = Query("nothing", pattern="^(nothing|update)$")
+
 @app.post("/metrics/ingest", response_model=int)
-def ingest_metric(payload: schemas.MetricIn, db: Session = Depends(get_db), user_id: int = Depends(get_current_user_id)):
-    row = CloudMetric(**payload.dict(), user_id=user_id)
-    db.add(row)
-    db.commit()
-    db.refresh(row)
-    return row.id
+def ingest_metric(payload: schemas.MetricIn, on_conflict: str = ON_CONFLICT, db: Session = Depends(get_db), user_id: int = Depends(get_current_user_id)):
+    return upsert_metric(db, dict(payload.dict(), user_id=user_id), on_conflict)
 
 @app.post("/metrics/ingest/batch", response_model=int)
-def ingest_metric_batch(batch: schemas.MetricBatchIn, db: Session = Depends(get_db), user_id: int = Depends(get_current_user_id)):
-    rows = [CloudMetric(**item.dict(), user_id=user_id) for item in batch.items]
-    db.bulk_save_objects(rows)
-    db.commit()
-    return len(rows)
+def ingest_metric_batch(batch: schemas.MetricBatchIn, on_conflict: str = ON_CONFLICT, db: Session = Depends(get_db), user_id: int = Depends(get_current_user_id)):
+    stats = write_metrics(db, (dict(item.dict(), user_id=user_id) for item in batch.items), label="ingest/batch", on_conflict=on_conflict)
+    return stats["rows"]
+
+@app.post("/metrics/ingest/stream")
+async def ingest_metric_stream(request: Request, on_conflict: str = ON_CONFLICT, db: Session = Depends(get_db), user_id: int = Depends(get_current_user_id)):
+    # NDJSON (or msgpack), optionally gzip-compressed, written chunk by chunk as the body arrives
+    chunks, accepted, rejected = [], 0, 0
+    try:
+        async for rows, bad, errors in stream_ingest.iter_chunks(
+            request.stream(), request.headers.get("content-type"), request.headers.get("content-encoding"), user_id
+        ):
+            stats = await run_in_threadpool(write_metrics, db, rows, len(rows) or None, "ingest/stream", on_conflict)
+            bad += stats["rejected"]
+            chunks.append({"chunk": len(chunks), "accepted": stats["rows"], "duplicates": stats["skipped"], "rejected": bad, "errors": errors})
+            accepted += stats["rows"]
+            rejected += bad
+    except stream_ingest.UnsupportedPayload as e:
+        raise HTTPException(status_code=415, detail=str(e))
+    except stream_ingest.PayloadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except stream_ingest.CorruptPayload as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except zlib.error as e:
+        raise HTTPException(status_code=400, detail=f"corrupt gzip body after {accepted + rejected} records: {e}")
+    return {"status": "success", "accepted": accepted, "rejected": rejected, "chunks": chunks}
 
 # ---------------------- User Metrics & Insights ----------------------
+async def _conditional(request: Request, response: Response, user_id: int, endpoint: str, params: dict):
+    """(data version, 304 response or None) for a conditional GET.
+
+    The ETag comes from the user's data version, so a matching If-None-Match is
+    answered without a query. No ETag while Redis (and so the version) is unavailable.
+    """
+    version = await response_cache.data_version(user_id)
+    if version is None:
+        return None, None
+    tag = response_cache.etag(user_id, version, endpoint, params)
+    headers = {"ETag": tag, "Cache-Control": "private, no-cache"}  # store, but revalidate every time
+    response.headers.update(headers)
+    sent = request.headers.get("if-none-match", "")
+    if sent.strip() == "*" or tag in (t.strip().removeprefix("W/") for t in sent.split(",")):
+        return version, Response(status_code=304, headers=headers)
+    return version, None
+
+def _latest(user_id: int, limit: int, since: Optional[datetime] = None):
+    # Newest samples; a since bound keeps the scan to recent partitions
+    query = select(CloudMetric).where(CloudMetric.user_id == user_id)
+    if since is not None:
+        query = query.where(CloudMetric.ts >= since)
+    return query.order_by(CloudMetric.ts.desc(), CloudMetric.id.desc()).limit(limit)
+
+async def _latest_rows(db: AsyncSession, user_id: int, limit: int, *where):
+    for since in partitions.probe_windows():
+        rows = (await db.execute(_latest(user_id, limit, since).where(*where))).scalars().all()
+        if len(rows) >= limit:
+            break
+    return rows
+
 @app.get("/users/me/metrics", response_model=List[schemas.MetricOut])
-def my_metrics(limit: int = Query(200, ge=1, le=5000), db: Session = Depends(get_db), user_id: int = Depends(get_current_user_id)):
-    return db.query(CloudMetric).filter(CloudMetric.user_id == user_id).order_by(CloudMetric.id.desc()).limit(limit).all()
+async def my_metrics(request: Request, response: Response, limit: int = Query(200, ge=1, le=5000), cursor: Optional[str] = None,
+                     db: AsyncSession = Depends(get_read_db), user_id: int = Depends(get_current_user_id)):
+    # Newest first; X-Next-Cursor carries the cursor of the next (older) page
+    _, not_modified = await _conditional(request, response, user_id, "metrics", {"limit": limit, "cursor": cursor})
+    if not_modified:
+        return not_modified
+    stmt = select(CloudMetric).where(CloudMetric.user_id == user_id)
+    if cursor:
+        try:
+            stmt = stmt.where(metric_export.before(cursor))
+        except metric_export.InvalidCursor as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    stmt = stmt.order_by(CloudMetric.ts.desc(), CloudMetric.id.desc()).limit(limit + 1)
+    rows = (await db.execute(stmt)).scalars().all()
+    if len(rows) > limit:
+        rows = rows[:limit]
+        response.headers["X-Next-Cursor"] = metric_export.encode_cursor(rows[-1].ts, rows[-1].id)
+    return rows
+
+@app.get("/users/me/metrics/export")
+def export_metrics(format: str = Query("ndjson", pattern="^(ndjson|csv)$"), provider: Optional[str] = None,
+                   since: Optional[datetime] = None, until: Optional[datetime] = None,
+                   user_id: int = Depends(get_current_user_id)):
+    # since/until: ISO datetimes, naive ones are UTC; the range is [since, until)
+    body = metric_export.stream_export(user_id, format, provider, since, until, engine=read_engine)
+    return StreamingResponse(body, media_type=metric_export.EXPORT_FORMATS[format], headers={
+        "Content-Disposition": f'attachment; filename="cloud9-metrics.{format}"',
+    })
 
 @app.get("/users/me/insights", response_model=schemas.InsightOut)
-def my_insights(db: Session = Depends(get_db), user_id: int = Depends(get_current_user_id)):
-    rows = db.query(CloudMetric).filter(CloudMetric.user_id == user_id).all()
-    if not rows:
-        return schemas.InsightOut(total_spend=0.0, idle_resources=0, predicted_savings=0.0, anomalies=0, avg_cpu=0.0, avg_memory=0.0, resources_observed=0)
-    total_cpu = sum(r.cpu_usage or 0 for r in rows)
-    total_mem = sum(r.memory_usage or 0 for r in rows)
-    n = len(rows)
-    idle = sum(1 for r in rows if (r.cpu_usage or 0) < 10 and (r.memory_usage or 0) < 10)
-    return schemas.InsightOut(
-        total_spend=round((total_cpu + total_mem) * 10, 2),
-        idle_resources=idle,
-        predicted_savings=round(idle * 100, 2),
-        anomalies=max(0, idle - 1),
-        avg_cpu=round(total_cpu / n, 2),
-        avg_memory=round(total_mem / n, 2),
-        resources_observed=n,
-    )
+async def my_insights(request: Request, response: Response, provider: Optional[str] = None, since: Optional[datetime] = None,
+                      until: Optional[datetime] = None, db: AsyncSession = Depends(get_read_db), user_id: int = Depends(get_current_user_id)):
+    # since/until: ISO datetimes, naive ones are UTC; the range is [since, until)
+    params = {"provider": provider, "since": since, "until": until}
+    version, not_modified = await _conditional(request, response, user_id, "insights", params)
+    if not_modified:
+        return not_modified
+
+    async def compute():
+        row = (await db.execute(rollups.totals_query(user_id, provider, since, until))).one()
+        n, idle, total_cpu, total_mem = rollups.totals_row(row)
+        if not n:
+            return schemas.InsightOut(total_spend=0.0, idle_resources=0, predicted_savings=0.0, anomalies=0, avg_cpu=0.0, avg_memory=0.0, resources_observed=0)
+        return schemas.InsightOut(
+            total_spend=round((total_cpu + total_mem) * rollups.SPEND_PER_UNIT, 2),
+            idle_resources=idle,
+            predicted_savings=round(idle * 100, 2),
+            anomalies=max(0, idle - 1),
+            avg_cpu=round(total_cpu / n, 2),
+            avg_memory=round(total_mem / n, 2),
+            resources_observed=n,
+        )
+    return await response_cache.cached(user_id, "insights", params, compute, version)
 
 @app.get("/users/me/spend-series", response_model=schemas.SpendSeries)
-def my_spend_series(days: int = Query(30, ge=1, le=365), db: Session = Depends(get_db), user_id: int = Depends(get_current_user_id)):
-    rows = db.query(CloudMetric).filter(CloudMetric.user_id == user_id).all()
-    cutoff = datetime.utcnow() - timedelta(days=days)
-    buckets = {}
-    for r in rows:
-        try:
-            ts = datetime.fromisoformat(r.timestamp.replace("Z", "")) if r.timestamp else datetime.utcnow()
-        except:
-            ts = datetime.utcnow()
-        if ts >= cutoff:
-            key = ts.strftime("%Y-%m-%d")
-            buckets[key] = buckets.get(key, 0.0) + ((r.cpu_usage or 0) + (r.memory_usage or 0)) * 10.0
-    pts = [schemas.SpendPoint(date=k, spend=round(v, 2)) for k, v in sorted(buckets.items())]
-    return schemas.SpendSeries(points=pts)
+async def my_spend_series(request: Request, response: Response, days: int = Query(30, ge=1, le=365),
+                          db: AsyncSession = Depends(get_read_db), user_id: int = Depends(get_current_user_id)):
+    # Whole UTC days, oldest one included
+    since = rollups.hour_of(datetime.now(timezone.utc) - timedelta(days=days)).replace(hour=0)
+    # Keyed by the window start too, so a new day starts a new entry
+    version, not_modified = await _conditional(request, response, user_id, "spend-series", {"since": since})
+    if not_modified:
+        return not_modified
+
+    async def compute():
+        rows = (await db.execute(
+            select(MetricRollupDaily.bucket, func.sum(MetricRollupDaily.spend_sum))
+            .where(MetricRollupDaily.user_id == user_id, MetricRollupDaily.bucket >= since)
+            .group_by(MetricRollupDaily.bucket).order_by(MetricRollupDaily.bucket)
+        )).all()
+        pts = [schemas.SpendPoint(date=f"{day.astimezone(timezone.utc):%Y-%m-%d}", spend=round(spend or 0.0, 2)) for day, spend in rows]
+        return schemas.SpendSeries(points=pts)
+    return await response_cache.cached(user_id, "spend-series", {"since": since}, compute, version)
 
 # ---------------------- New Endpoints to Match Frontend ----------------------
 @app.get("/instances")
-def list_instances(provider: str, db: Session = Depends(get_db), user_id: int = Depends(get_current_user_id)):
-    rows = db.query(CloudMetric).filter(CloudMetric.user_id == user_id, CloudMetric.provider == provider).order_by(CloudMetric.id.desc()).limit(50).all()
-    instances = [{"id": r.vm_id, "type": r.task_type or "unknown", "state": "running", "launch_time": r.timestamp} for r in rows]
-    return {"status": "success", "instances": instances}
+async def list_instances(request: Request, response: Response, provider: str,
+                         db: AsyncSession = Depends(get_read_db), user_id: int = Depends(get_current_user_id)):
+    version, not_modified = await _conditional(request, response, user_id, "instances", {"provider": provider})
+    if not_modified:
+        return not_modified
+
+    async def compute():
+        rows = await _latest_rows(db, user_id, 50, CloudMetric.provider == provider)
+        instances = [{"id": r.vm_id, "type": r.task_type or "unknown", "state": "running", "launch_time": r.timestamp} for r in rows]
+        return {"status": "success", "instances": instances}
+    return await response_cache.cached(user_id, "instances", {"provider": provider}, compute, version)
 
 @app.get("/storage")
 def list_storage(provider: str):
@@ -147,12 +247,39 @@ def security_trend():
     return {"status": "success", "trend": points}
 
 @app.get("/resources/idle")
-def resources_idle(db: Session = Depends(get_db), user_id: int = Depends(get_current_user_id)):
-    rows = db.query(CloudMetric).filter(CloudMetric.user_id == user_id).order_by(CloudMetric.id.desc()).limit(50).all()
-    idle = [{"id": r.vm_id, "type": r.task_type, "state": "running" if (r.cpu_usage or 0) > 5 else "idle",
-             "launch_time": r.timestamp, "estimated_cost": round(((r.cpu_usage or 0) + (r.memory_usage or 0)) * 0.1, 2)}
-            for r in rows]
-    return {"status": "success", "idle_resources": idle}
+async def resources_idle(request: Request, response: Response, db: AsyncSession = Depends(get_read_db),
+                         user_id: int = Depends(get_current_user_id)):
+    version, not_modified = await _conditional(request, response, user_id, "resources-idle", {})
+    if not_modified:
+        return not_modified
+
+    async def compute():
+        rows = await _latest_rows(db, user_id, 50)
+        idle = [{"id": r.vm_id, "type": r.task_type, "state": "running" if (r.cpu_usage or 0) > 5 else "idle",
+                 "launch_time": r.timestamp, "estimated_cost": round(((r.cpu_usage or 0) + (r.memory_usage or 0)) * 0.1, 2)}
+                for r in rows]
+        return {"status": "success", "idle_resources": idle}
+    return await response_cache.cached(user_id, "resources-idle", {}, compute, version)
+
+@app.get("/ops/ingestion", dependencies=[Depends(require_ops_token)])
+def ingestion_status():
+    # Cycle duration and backlog for sizing the Celery workers
+    return {"status": "success", **ingest_scheduler.cycle_stats()}
+
+@app.get("/ops/db-pool", dependencies=[Depends(require_ops_token)])
+def db_pool_status():
+    # Per-pool occupancy and checkout waits for this worker process
+    return {"status": "success", "pools": pool_stats()}
+
+@app.get("/ops/cache", dependencies=[Depends(require_ops_token)])
+def response_cache_status():
+    # Hit/miss counts of this worker process, per endpoint
+    return {"status": "success", **response_cache.stats()}
+
+@app.get("/ops/models", dependencies=[Depends(require_ops_token)])
+def model_registry_status():
+    # Loaded-model cache of this worker process
+    return {"status": "success", **model_registry.stats()}
 
 @app.post("/chat")
 async def chat_bot(req: Request):
@@ -164,29 +291,37 @@ async def chat_bot(req: Request):
 # ---------------------- AI & Optimizer (unchanged) ----------------------
 @app.get("/users/me/ai/idle-detection")
 def detect_idle(db: Session = Depends(get_db), user_id: int = Depends(get_current_user_id)):
-    rows = _load_eval_rows(db, user_id)
-    if not rows:
+    # Scores with the model trained after ingestion; see backend.idle_model
+    vm_ids, types, feats = idle_model.latest(db, user_id)
+    model = idle_model.get(db, user_id) if len(feats) else None
+    if model is None and 0 < len(feats) < idle_model.IDLE_MIN_TRAIN_ROWS:
+        model = idle_model.fit(feats)  # too few samples to keep a model for; fitting them is instant
+    if model is None:
+        if idle_model.training(user_id):
+            # First model is training in the background; the client retries
+            return JSONResponse({"status": "training", "idle_resources": []}, status_code=202)
         return {"idle_resources": []}
-    resources = [{"id": r.vm_id, "resource_type": r.task_type or "vm", "cpu_usage": r.cpu_usage or 0.0,
-                  "memory_usage": r.memory_usage or 0.0, "uptime": r.execution_time or 0.0,
-                  "network_in": r.network_traffic or 0.0, "disk_read": r.power_consumption or 0.0,
-                  "status": "Running"} for r in rows]
-    df = pd.DataFrame(resources)
-    from sklearn.ensemble import IsolationForest
-    model = IsolationForest(contamination=0.15, random_state=42)
-    df["anomaly"] = model.fit_predict(df[["cpu_usage", "memory_usage", "uptime", "network_in", "disk_read"]])
-    for i in range(len(resources)):
-        if df.loc[i, "anomaly"] == -1:
-            resources[i]["status"] = "Idle"
-    return {"status": "success", "idle_resources": [r for r in resources if r["status"] == "Idle"]}
+    idle = np.flatnonzero(model.decision_function(feats) < 0)
+    return {"status": "success", "idle_resources": [
+        {"id": vm_ids[i], "resource_type": types[i] or "vm", "cpu_usage": feats[i, 0], "memory_usage": feats[i, 1],
+         "uptime": feats[i, 2], "network_in": feats[i, 3], "disk_read": feats[i, 4], "status": "Idle"}
+        for i in idle.tolist()]}
 
 @app.post("/users/me/optimizer", response_model=schemas.OptimizerResponse)
-def optimize(db: Session = Depends(get_db), user_id: int = Depends(get_current_user_id)):
-    rows = _load_eval_rows(db, user_id)
-    if not rows:
-        return schemas.OptimizerResponse(recommendations=[])
+async def optimize(user_id: int = Depends(get_current_user_id)):
+    return await response_cache.cached(user_id, "optimizer", {}, lambda: run_in_threadpool(_optimize, user_id))
+
+def _optimize(user_id: int):
+    with SessionLocal() as db:
+        rows = _load_eval_rows(db, user_id)
+        if not rows:
+            return schemas.OptimizerResponse(recommendations=[])
+        model = optimizer_model.get(db, user_id)
+        if model is None:
+            # Training in the background; once it ends, with a model or without, the cached response is bumped
+            return schemas.OptimizerResponse(recommendations=[])
+        kmeans, scaler = model
     feats = np.array([[r.cpu_usage or 0.0, r.memory_usage or 0.0, r.execution_time or 0.0, r.network_traffic or 0.0, r.power_consumption or 0.0] for r in rows])
-    kmeans, scaler = _get_or_train_user_model(db, user_id)
     Xn = scaler.transform(feats)
     clusters = kmeans.predict(Xn)
     recs = []
@@ -197,77 +332,65 @@ def optimize(db: Session = Depends(get_db), user_id: int = Depends(get_current_u
     return schemas.OptimizerResponse(recommendations=recs)
 
 # ---------------------- ML Helpers ----------------------
-def _user_dir(user_id: int):
-    d = os.path.join("models", f"user_{user_id}")
-    os.makedirs(d, exist_ok=True)
-    return d
-
-def _artifacts_exist(user_id: int):
-    d = _user_dir(user_id)
-    return all(os.path.exists(os.path.join(d, f)) for f in ["kmeans.joblib", "scaler.joblib"])
-
-def _save_artifacts(user_id: int, kmeans, scaler):
-    d = _user_dir(user_id)
-    joblib.dump(kmeans, os.path.join(d, "kmeans.joblib"))
-    joblib.dump(scaler, os.path.join(d, "scaler.joblib"))
-
-def _load_artifacts(user_id: int):
-    d = _user_dir(user_id)
-    return joblib.load(os.path.join(d, "kmeans.joblib")), joblib.load(os.path.join(d, "scaler.joblib"))
-
-def _get_or_train_user_model(db: Session, user_id: int):
-    from sklearn.cluster import KMeans
-    from sklearn.preprocessing import StandardScaler
-    if _artifacts_exist(user_id):
-        return _load_artifacts(user_id)
-    rows = db.query(CloudMetric).filter(CloudMetric.user_id == user_id).all()
-    feats = np.array([[r.cpu_usage or 0.0, r.memory_usage or 0.0, r.execution_time or 0.0, r.network_traffic or 0.0, r.power_consumption or 0.0] for r in rows]) or np.zeros((3, 5))
-    scaler = StandardScaler().fit(feats)
-    kmeans = KMeans(n_clusters=min(3, max(1, len(feats))), random_state=42).fit(scaler.transform(feats))
-    _save_artifacts(user_id, kmeans, scaler)
-    return kmeans, scaler
-
-def _load_eval_rows(db: Session, user_id: int):
-    return db.query(CloudMetric).filter(CloudMetric.user_id == user_id).order_by(CloudMetric.id.desc()).limit(200).all()
+def _load_eval_rows(db: Session, user_id: int, limit: int = 200):
+    for since in partitions.probe_windows():
+        rows = db.execute(_latest(user_id, limit, since)).scalars().all()
+        if len(rows) >= limit:
+            break
+    return rows
 
 # ---------------------- Background Scheduler ----------------------
 scheduler: Optional[BackgroundScheduler] = None
 
 def _ingest_for_all_users():
-    with SessionLocal() as db:
-        user_ids = [uid for (uid,) in db.query(CloudMetric.user_id).distinct().all() if uid]
-        cred_user_ids = [
-    row[0]
-    for row in db.execute(
-        text("SELECT DISTINCT user_id FROM cloud_credentials WHERE user_id IS NOT NULL")
-    )
-]
-
-        for uid in set(user_ids) | set(cred_user_ids):
-            try:
-                added = 0
-                added += ingest_aws(db, uid)
-                added += ingest_gcp(db, uid)
-                added += ingest_azure(db, uid)
-                if added:
-                    _get_or_train_user_model(db, uid)
-            except Exception as e:
-                print(f"[ingest] user {uid} error: {e}")
+    # Plans the cycle and hands (user, provider) jobs to the Celery workers
+    try:
+        with SessionLocal() as db:
+            ingest_scheduler.dispatch_cycle(db)
+    except Exception as e:
+        print(f"[ingest] dispatch error: {e}")
+
+PERIODIC_JOBS = ("partitions", "rollups", "snapshots", "models", "ingest")
+
+def _add_periodic_jobs():
+    scheduler.add_job(partitions.maintain, "interval", days=1, id="partitions", max_instances=1, coalesce=True)
+    scheduler.add_job(rollups.maintain, "interval", hours=1, id="rollups", max_instances=1, coalesce=True)
+    scheduler.add_job(snapshots.maintain, "interval", minutes=snapshots.SNAPSHOT_INTERVAL_MINUTES, id="snapshots", max_instances=1, coalesce=True)
+    scheduler.add_job(model_registry.maintain, "interval", minutes=model_registry.MODEL_REFRESH_MINUTES, id="models", max_instances=1, coalesce=True)
+    scheduler.add_job(_ingest_for_all_users, "interval", minutes=ingest_scheduler.INGEST_INTERVAL_MINUTES, id="ingest", max_instances=1, coalesce=True)
+
+def _lead():
+    # Only the process holding the scheduler lock runs the periodic jobs; see backend.leader
+    try:
+        leading = leader.acquire(engine)
+    except Exception as e:
+        print(f"[leader] lock check failed: {e}")
+        leading = False
+    running = scheduler.get_job("ingest") is not None
+    if leading and not running:
+        _add_periodic_jobs()
+        print(f"⏱️ This process runs the scheduled jobs; ingestion dispatched every {ingest_scheduler.INGEST_INTERVAL_MINUTES} minutes.")
+    elif running and not leading:
+        for job_id in PERIODIC_JOBS:
+            scheduler.remove_job(job_id)
+        print("⏱️ Scheduled jobs handed over to another process.")
 
 @app.on_event("startup")
 def on_startup():
     Base.metadata.create_all(bind=engine)
+    partitions.maintain()  # current and upcoming partitions must exist before anything writes
     global scheduler
     scheduler = BackgroundScheduler(daemon=True, timezone="UTC")
-    scheduler.add_job(_ingest_for_all_users, "interval", minutes=10, id="ingest", max_instances=1, coalesce=True)
+    scheduler.add_job(_lead, "interval", seconds=leader.LEADER_RETRY_SECONDS, id="leader",
+                      next_run_time=datetime.now(timezone.utc), max_instances=1, coalesce=True)
     scheduler.start()
-    print("⏱️ Multi-cloud ingestion running every 10 minutes.")
 
 @app.on_event("shutdown")
 def on_shutdown():
     global scheduler
     if scheduler:
         scheduler.shutdown(wait=False)
+    leader.release()
     print("🛑 Scheduler shut down.")
 
 # ---------------------- Serve React Frontend ----------------------
@@ -275,11 +398,6 @@ BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 FRONTEND_DIR = os.path.join(BASE_DIR, "..", "frontend_build")
 FRONTEND_DIR = os.path.abspath(FRONTEND_DIR)
 if os.path.exists(FRONTEND_DIR):
-    app.mount("/", StaticFiles(directory=FRONTEND_DIR, html=True), name="frontend")
-
-    @app.get("/{full_path:path}")
-    async def serve_react_app(full_path: str):
-        index_file = os.path.join(FRONTEND_DIR, "index.html")
-        if os.path.exists(index_file):
-            return FileResponse(index_file)
-        return {"error": "Frontend build not found"}
+    # Precompressed build, index.html from memory for client-side routes; mounted
+    # last so the API routes above match first
+    app.mount("/", static_assets.FrontendApp(FRONTEND_DIR), name="frontend")
@@ -0,0 +1,85 @@
+# backend/metric_export.py
+# Reading cloud_metrics back out: opaque keyset cursors for paging
+# /users/me/metrics, and a streaming NDJSON/CSV export that reads through a
+# server-side cursor, so memory stays flat however much history is exported.
+import base64, csv, datetime, io, json, os
+from sqlalchemy import and_, or_, select
+from backend.database import engine as default_engine
+from backend.models import CloudMetric
+from backend.rollups import _utc
+
+EXPORT_CHUNK_ROWS = int(os.getenv("METRIC_EXPORT_CHUNK_ROWS", "5000"))
+EXPORT_COLUMNS = [
+    "id", "provider", "vm_id", "vm_name", "region", "instance_state", "ts",
+    "cpu_usage", "memory_usage", "network_traffic", "power_consumption", "execution_time", "task_type",
+]
+EXPORT_FORMATS = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(ts: datetime.datetime, row_id: int) -> str:
+    raw = f"{ts.astimezone(datetime.timezone.utc).isoformat()}|{row_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        ts, row_id = raw.rsplit("|", 1)
+        return datetime.datetime.fromisoformat(ts), int(row_id)
+    except (ValueError, UnicodeDecodeError):
+        raise InvalidCursor("malformed cursor")
+
+
+def before(cursor: str):
+    """Filter for rows after ``cursor`` in (ts, id) descending order."""
+    ts, row_id = decode_cursor(cursor)
+    # Spelled out rather than a row comparison so the (user_id, ts) index still applies
+    return and_(CloudMetric.ts <= ts, or_(CloudMetric.ts < ts, CloudMetric.id < row_id))
+
+
+def _value(v):
+    return v.isoformat() if isinstance(v, datetime.datetime) else v
+
+
+def _ndjson(rows) -> str:
+    return "".join(json.dumps(dict(zip(EXPORT_COLUMNS, map(_value, r)))) + "\n" for r in rows)
+
+
+def _csv(rows, header: bool) -> str:
+    buf = io.StringIO()
+    w = csv.writer(buf)
+    if header:
+        w.writerow(EXPORT_COLUMNS)
+    w.writerows([_value(v) for v in r] for r in rows)
+    return buf.getvalue()
+
+
+def stream_export(user_id: int, fmt: str, provider: str | None = None, since: datetime.datetime | None = None,
+                  until: datetime.datetime | None = None, engine=None, chunk_rows: int = EXPORT_CHUNK_ROWS):
+    """Yields the user's samples in [since, until), oldest first, as NDJSON or CSV text chunks.
+
+    Naive ``since``/``until`` are UTC, as for /users/me/insights.
+    """
+    engine = engine or default_engine
+    # Compared as is, a naive bound would be read in the session's time zone
+    since, until = (_utc(b) if b is not None else None for b in (since, until))
+    stmt = select(*(getattr(CloudMetric, c) for c in EXPORT_COLUMNS)).where(CloudMetric.user_id == user_id)
+    if provider:
+        stmt = stmt.where(CloudMetric.provider == provider)
+    if since is not None:
+        stmt = stmt.where(CloudMetric.ts >= since)
+    if until is not None:
+        stmt = stmt.where(CloudMetric.ts < until)
+    stmt = stmt.order_by(CloudMetric.ts, CloudMetric.id)
+
+    if fmt == "csv":
+        yield _csv([], header=True)
+    # Its own connection: the export outlives the request's session
+    with engine.connect() as conn:
+        result = conn.execution_options(stream_results=True, yield_per=chunk_rows).execute(stmt)
+        for rows in result.partitions():
+            yield _csv(rows, header=False) if fmt == "csv" else _ndjson(rows)
@@ -0,0 +1,249 @@
+# backend/metric_writer.py
+# Shared bulk write path for cloud_metrics. Rows are plain dicts keyed by column
+# name and are streamed to PostgreSQL with COPY in chunks, committing per chunk;
+# other databases get multi-row INSERT ... VALUES. Used by the ingestors and the
+# /metrics/ingest endpoints.
+#
+# Samples have a natural key (user_id, provider, vm_id, ts). With
+# on_conflict="nothing" (the default) a re-sent sample is skipped, with "update"
+# it overwrites the stored values. COPY cannot resolve conflicts itself, so in
+# those modes chunks are copied into a temp staging table and moved over with
+# INSERT ... SELECT ... ON CONFLICT. NULL never equals NULL in the unique key,
+# so staged samples without an owner are matched against stored ones explicitly.
+# Hourly/daily rollups of the hours a chunk
+# touched are refreshed in the same transaction (backend.rollups), and the
+# owners' cached dashboard responses are invalidated once it commits
+# (backend.response_cache).
+import datetime, io, os, threading, time
+from itertools import islice
+from sqlalchemy import insert, text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+from backend.models import CloudMetric, METRIC_SAMPLE_KEY, METRIC_SAMPLE_KEY_COLUMNS
+from backend.schemas import parse_timestamp
+from backend import rollups, response_cache
+
+METRIC_WRITE_CHUNK_SIZE = int(os.getenv("METRIC_WRITE_CHUNK_SIZE", "5000"))
+ON_CONFLICT_MODES = ("nothing", "update", None)
+
+METRIC_COLUMNS = [
+    "user_id", "provider", "vm_id", "vm_name", "region", "instance_state", "timestamp", "ts",
+    "cpu_usage", "memory_usage", "network_traffic", "power_consumption", "execution_time", "task_type",
+]
+VALUE_COLUMNS = [c for c in METRIC_COLUMNS if c not in METRIC_SAMPLE_KEY_COLUMNS]
+
+
+def write_metrics(db: Session, rows, chunk_size: int | None = None, label: str = "writer",
+                  on_conflict: str | None = "nothing") -> dict:
+    """Write ``rows`` (iterable of dicts) in chunks, committing after each chunk.
+
+    Returns {"rows", "skipped", "rejected", "chunks", "seconds", "rows_per_second"};
+    ``rows`` counts samples inserted or updated, ``skipped`` duplicates left alone
+    and ``rejected`` samples without a parsable timestamp, which are not written.
+    """
+    if on_conflict not in ON_CONFLICT_MODES:
+        raise ValueError(f"on_conflict must be one of {ON_CONFLICT_MODES}")
+    chunk_size = chunk_size or METRIC_WRITE_CHUNK_SIZE
+    bind = db.get_bind()
+    if on_conflict and not has_sample_key(bind):
+        on_conflict = None  # table not de-duplicated yet; see backend.dedupe_metrics
+    use_copy = bind.dialect.driver == "psycopg2"
+    rows = iter(rows)
+    written, seen, rejected, chunks = 0, 0, 0, 0
+    started = time.perf_counter()
+    while True:
+        chunk = [_row(r) for r in islice(rows, chunk_size)]
+        if not chunk:
+            break
+        # ts is NOT NULL (the partition key): one such row would fail the whole chunk
+        valid = [r for r in chunk if r["ts"] is not None]
+        rejected += len(chunk) - len(valid)
+        chunk = valid
+        if not chunk:
+            continue
+        try:
+            if use_copy:
+                written += _copy_chunk(db, chunk, on_conflict)
+            else:
+                written += _insert_chunk(db, chunk, on_conflict)
+            rollups.refresh(db, rollups.touched(chunk))
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        response_cache.bump(r["user_id"] for r in chunk)
+        seen += len(chunk)
+        chunks += 1
+
+    seconds = time.perf_counter() - started
+    stats = {
+        "rows": written,
+        "skipped": seen - written,
+        "rejected": rejected,
+        "chunks": chunks,
+        "seconds": round(seconds, 4),
+        "rows_per_second": round(seen / seconds, 1) if seconds > 0 else 0.0,
+    }
+    if seen or rejected:
+        print(f"[{label}] wrote {written} metric rows ({seen - written} duplicates, {rejected} without a timestamp) "
+              f"in {chunks} chunks ({stats['rows_per_second']} rows/s)")
+    return stats
+
+
+def upsert_metric(db: Session, row: dict, on_conflict: str | None = "nothing") -> int:
+    """Write one sample and return its id, whether it was new or already stored."""
+    values = _row(row)
+    if values["ts"] is None:
+        raise ValueError(f"sample has no parsable timestamp: {values['timestamp']!r}")
+    table = CloudMetric.__table__
+    if not on_conflict or db.get_bind().dialect.name != "postgresql" or not has_sample_key(db.get_bind()):
+        new_id = db.execute(insert(table).values(values).returning(table.c.id)).scalar()
+    else:
+        stmt = pg_insert(table).values(values)
+        if on_conflict == "update":
+            stmt = stmt.on_conflict_do_update(
+                constraint=METRIC_SAMPLE_KEY, set_={c: stmt.excluded[c] for c in VALUE_COLUMNS}
+            )
+        else:
+            stmt = stmt.on_conflict_do_nothing(constraint=METRIC_SAMPLE_KEY)
+        new_id = db.execute(stmt.returning(table.c.id)).scalar()
+        if new_id is None:
+            new_id = db.query(CloudMetric.id).filter(
+                *(getattr(CloudMetric, c) == values[c] for c in METRIC_SAMPLE_KEY_COLUMNS)
+            ).scalar()
+    rollups.refresh(db, rollups.touched([values]))
+    db.commit()
+    response_cache.bump([values["user_id"]])
+    return new_id
+
+
+_key_checked = {}
+_key_lock = threading.Lock()
+_KEY_RECHECK_SECONDS = 300
+
+
+def has_sample_key(bind) -> bool:
+    """Whether the natural-key constraint exists; absent ones are re-checked every few minutes."""
+    if bind.dialect.name != "postgresql":
+        return False
+    url = str(bind.url)
+    with _key_lock:
+        cached = _key_checked.get(url)
+        if cached is not None and (cached[0] or time.monotonic() - cached[1] < _KEY_RECHECK_SECONDS):
+            return cached[0]
+    with bind.connect() as conn:
+        found = conn.execute(
+            text("SELECT 1 FROM pg_constraint WHERE conname = :name"), {"name": METRIC_SAMPLE_KEY}
+        ).first() is not None
+    with _key_lock:
+        _key_checked[url] = (found, time.monotonic())
+    return found
+
+
+def _row(r: dict) -> dict:
+    row = {c: r.get(c) for c in METRIC_COLUMNS}
+    if row["ts"] is None and row["timestamp"]:
+        try:
+            row["ts"] = parse_timestamp(row["timestamp"])
+        except ValueError:
+            pass  # stays NULL; write_metrics rejects the row
+    return row
+
+
+def _insert_chunk(db: Session, chunk, on_conflict) -> int:
+    table = CloudMetric.__table__
+    rows = chunk
+    if not on_conflict:
+        db.execute(insert(table), rows)
+        return len(rows)
+    stmt = pg_insert(table)
+    if on_conflict == "update":
+        stmt = stmt.on_conflict_do_update(constraint=METRIC_SAMPLE_KEY, set_={c: stmt.excluded[c] for c in VALUE_COLUMNS})
+        rows = list(_last_per_key(rows))
+    else:
+        stmt = stmt.on_conflict_do_nothing(constraint=METRIC_SAMPLE_KEY)
+    return sum(db.execute(stmt.values(batch)).rowcount for batch in _batches(rows, 1000))
+
+
+def _last_per_key(rows):
+    # DO UPDATE may not touch the same row twice in one statement: last write wins
+    latest = {}
+    for r in rows:
+        latest[tuple(r[c] for c in METRIC_SAMPLE_KEY_COLUMNS)] = r
+    return latest.values()
+
+
+def _batches(rows, size):
+    for i in range(0, len(rows), size):
+        yield rows[i:i + size]
+
+
+def _copy_chunk(db: Session, chunk, on_conflict) -> int:
+    buf = io.StringIO()
+    for r in chunk:
+        buf.write("\t".join(_copy_value(r[c]) for c in METRIC_COLUMNS))
+        buf.write("\n")
+    buf.seek(0)
+    copied = copy_buffer(db, buf, on_conflict)
+    return len(chunk) if copied is None else copied
+
+
+def copy_buffer(db: Session, buf, on_conflict, options: str = "") -> int | None:
+    """COPY a file-like of METRIC_COLUMNS rows into cloud_metrics in the session's transaction.
+
+    ``options`` is the COPY option list, e.g. "(FORMAT csv)"; the default is text
+    format. Returns rows written when conflicts are resolved, None for a plain COPY.
+    """
+    columns = ", ".join(METRIC_COLUMNS)
+    table = CloudMetric.__tablename__
+    # Raw psycopg2 connection of the session's current transaction
+    dbapi_conn = db.connection().connection.driver_connection
+    with dbapi_conn.cursor() as cur:
+        if not on_conflict:
+            cur.copy_expert(f"COPY {table} ({columns}) FROM STDIN {options}", buf)
+            return None
+
+        # Column types only: no constraints, and no id default burning sequence values
+        cur.execute(
+            f"CREATE TEMP TABLE IF NOT EXISTS _metric_stage ON COMMIT DELETE ROWS "
+            f"AS SELECT {columns} FROM {table} WITH NO DATA"
+        )
+        cur.copy_expert(f"COPY _metric_stage ({columns}) FROM STDIN {options}", buf)
+        key = ", ".join(METRIC_SAMPLE_KEY_COLUMNS)
+        # One row per key (DISTINCT ON treats NULL owners as equal): the last for
+        # update, the first for nothing
+        staged = (f"(SELECT DISTINCT ON ({key}) {columns} FROM _metric_stage "
+                  f"ORDER BY {key}, ctid {'DESC' if on_conflict == 'update' else 'ASC'}) s")
+        same_null_owner = ("s.user_id IS NULL AND m.user_id IS NULL "
+                           "AND m.provider = s.provider AND m.vm_id = s.vm_id AND m.ts = s.ts")
+        written = 0
+        if on_conflict == "update":
+            cur.execute(
+                f"UPDATE {table} m SET {', '.join(f'{c} = s.{c}' for c in VALUE_COLUMNS)} "
+                f"FROM {staged} WHERE {same_null_owner}"
+            )
+            written = cur.rowcount
+            resolve = f"DO UPDATE SET {', '.join(f'{c} = EXCLUDED.{c}' for c in VALUE_COLUMNS)}"
+        else:
+            resolve = "DO NOTHING"
+        cur.execute(
+            f"INSERT INTO {table} ({columns}) SELECT {columns} FROM {staged} "
+            f"WHERE NOT EXISTS (SELECT 1 FROM {table} m WHERE {same_null_owner}) "
+            f"ON CONFLICT ON CONSTRAINT {METRIC_SAMPLE_KEY} {resolve}"
+        )
+        written += cur.rowcount
+        # ON COMMIT only clears it at the end of the transaction, and callers
+        # like csv_loader's replace mode copy many chunks in one
+        cur.execute("TRUNCATE _metric_stage")
+        return written
+
+
+def _copy_value(v) -> str:
+    # COPY text format: \N is NULL; backslash, tab and newlines are escaped
+    if v is None:
+        return "\\N"
+    if isinstance(v, (datetime.datetime, datetime.date)):
+        return v.isoformat()
+    if isinstance(v, (int, float)):
+        return repr(v)
+    return str(v).replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
@@ -0,0 +1,94 @@
+"""baseline: schema as created by Base.metadata.create_all
+
+Databases created before Alembic was introduced already have some of these
+tables; everything here is created only if missing, so the revision can be
+applied to both fresh and existing databases. The sample-key constraint is
+left to backend.dedupe_metrics, which has to clean existing data first.
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-18 00:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0001'
+down_revision: Union[str, None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    inspector = sa.inspect(op.get_bind())
+    tables = set(inspector.get_table_names())
+
+    if "users" not in tables:
+        op.create_table(
+            "users",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column("email", sa.String(), nullable=False),
+            sa.Column("provider", sa.String(), nullable=True),
+            sa.Column("provider_id", sa.String(), nullable=True, unique=True),
+            sa.Column("hashed_password", sa.String(), nullable=True),
+        )
+        op.create_index("ix_users_id", "users", ["id"])
+        op.create_index("ix_users_email", "users", ["email"], unique=True)
+
+    if "cloud_credentials" not in tables:
+        op.create_table(
+            "cloud_credentials",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column("provider", sa.String(), nullable=False),
+            sa.Column("access_key_enc", sa.Text(), nullable=True),
+            sa.Column("secret_key_enc", sa.Text(), nullable=True),
+            sa.Column("extra_json_enc", sa.Text(), nullable=True),
+            sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.id"), nullable=True),
+        )
+        op.create_index("ix_cloud_credentials_id", "cloud_credentials", ["id"])
+
+    if "cloud_metrics" not in tables:
+        op.create_table(
+            "cloud_metrics",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column("provider", sa.String(), nullable=True),
+            sa.Column("vm_id", sa.String(), nullable=True),
+            sa.Column("timestamp", sa.String(), nullable=True),
+            sa.Column("cpu_usage", sa.Float(), nullable=True),
+            sa.Column("memory_usage", sa.Float(), nullable=True),
+            sa.Column("network_traffic", sa.Float(), nullable=True),
+            sa.Column("power_consumption", sa.Float(), nullable=True),
+            sa.Column("execution_time", sa.Float(), nullable=True),
+            sa.Column("task_type", sa.String(), nullable=True),
+            sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.id"), nullable=True),
+            # A new table has nothing to de-duplicate
+            sa.UniqueConstraint("user_id", "provider", "vm_id", "timestamp", name="uq_cloud_metrics_sample"),
+        )
+        op.create_index("ix_cloud_metrics_id", "cloud_metrics", ["id"])
+        columns = set()
+    else:
+        columns = {c["name"] for c in inspector.get_columns("cloud_metrics")}
+    for name in ("vm_name", "region", "instance_state"):
+        if name not in columns:
+            op.add_column("cloud_metrics", sa.Column(name, sa.String(), nullable=True))
+
+    if "ingest_watermarks" not in tables:
+        op.create_table(
+            "ingest_watermarks",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.id", ondelete="CASCADE"), nullable=False),
+            sa.Column("provider", sa.String(), nullable=False),
+            sa.Column("resource_id", sa.String(), nullable=False),
+            sa.Column("watermark", sa.DateTime(), nullable=False),
+            sa.UniqueConstraint("user_id", "provider", "resource_id", name="uq_ingest_watermark"),
+        )
+        op.create_index("ix_ingest_watermarks_id", "ingest_watermarks", ["id"])
+
+
+def downgrade() -> None:
+    # The baseline is where history starts; there is nothing older to go back to
+    pass
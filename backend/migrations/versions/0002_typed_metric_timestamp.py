@@ -0,0 +1,120 @@
+"""typed ts column, composite indexes and a ts-based sample key on cloud_metrics
+
+Adds cloud_metrics.ts (timestamptz) next to the legacy string column and
+backfills it in id batches, one committed transaction per batch. Strings without
+an offset are read as UTC; unparsable ones stay NULL. The (user_id, ts) and
+(user_id, provider, ts) indexes are built CONCURRENTLY, and the natural sample
+key moves from the string timestamp to ts when it was already installed.
+Nothing but the helper function is needed when create_all already made the
+table partitioned.
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18 00:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy import text
+
+from backend import partitions
+
+# revision identifiers, used by Alembic.
+revision: str = '0002'
+down_revision: Union[str, None] = '0001'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+BATCH_SIZE = 50000
+
+PARSE_TS_FUNCTION = r"""
+CREATE OR REPLACE FUNCTION cloud9_parse_ts(value text) RETURNS timestamptz
+LANGUAGE plpgsql STABLE AS $$
+BEGIN
+    IF value IS NULL OR value = '' THEN
+        RETURN NULL;
+    ELSIF value ~ '(Z|z|[+-]\d\d(:?\d\d)?)$' THEN
+        RETURN value::timestamptz;
+    END IF;
+    RETURN value::timestamp AT TIME ZONE 'UTC';
+EXCEPTION WHEN others THEN
+    RETURN NULL;
+END;
+$$
+"""
+
+
+def _constraint_columns(bind, name):
+    row = bind.execute(text("""
+        SELECT array_agg(a.attname ORDER BY k.ord)
+        FROM pg_constraint c
+        CROSS JOIN LATERAL unnest(c.conkey) WITH ORDINALITY AS k(attnum, ord)
+        JOIN pg_attribute a ON a.attrelid = c.conrelid AND a.attnum = k.attnum
+        WHERE c.conname = :name
+    """), {"name": name}).scalar()
+    return list(row or [])
+
+
+def upgrade() -> None:
+    bind = op.get_bind()
+    op.execute(PARSE_TS_FUNCTION)
+    if partitions.is_partitioned(bind):
+        # Built by create_all when the API started before the first migrate: ts,
+        # its indexes and the sample key are already there, and indexes can't be
+        # built CONCURRENTLY on a partitioned table anyway
+        return
+    columns = {c["name"] for c in sa.inspect(bind).get_columns("cloud_metrics")}
+    if "ts" not in columns:
+        op.add_column("cloud_metrics", sa.Column("ts", sa.DateTime(timezone=True), nullable=True))
+
+    with op.get_context().autocommit_block():
+        lo, hi = bind.execute(text("SELECT min(id), max(id) FROM cloud_metrics WHERE ts IS NULL")).one()
+        if lo is not None:
+            for start in range(lo, hi + 1, BATCH_SIZE):
+                n = bind.execute(text(
+                    "UPDATE cloud_metrics SET ts = cloud9_parse_ts(timestamp) "
+                    "WHERE id >= :lo AND id < :hi AND ts IS NULL"
+                ), {"lo": start, "hi": start + BATCH_SIZE}).rowcount
+                print(f"[0002] backfilled ts for ids {start}..{start + BATCH_SIZE - 1} ({n} rows)")
+
+        bind.execute(text("CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_cloud_metrics_user_ts ON cloud_metrics (user_id, ts)"))
+        bind.execute(text(
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_cloud_metrics_user_provider_ts "
+            "ON cloud_metrics (user_id, provider, ts)"
+        ))
+
+        # Without the old key the table hasn't been de-duplicated yet;
+        # backend.dedupe_metrics installs the ts-based key later.
+        if _constraint_columns(bind, "uq_cloud_metrics_sample") == ["user_id", "provider", "vm_id", "timestamp"]:
+            bind.execute(text("DROP INDEX CONCURRENTLY IF EXISTS uq_cloud_metrics_sample_ts"))
+            try:
+                bind.execute(text(
+                    "CREATE UNIQUE INDEX CONCURRENTLY uq_cloud_metrics_sample_ts "
+                    "ON cloud_metrics (user_id, provider, vm_id, ts)"
+                ))
+                # One statement, so writers never see the table without a key
+                bind.execute(text(
+                    "ALTER TABLE cloud_metrics DROP CONSTRAINT uq_cloud_metrics_sample, "
+                    "ADD CONSTRAINT uq_cloud_metrics_sample UNIQUE USING INDEX uq_cloud_metrics_sample_ts"
+                ))
+            except Exception as e:
+                # Differently spelled strings for the same instant collide on ts
+                bind.execute(text("DROP INDEX CONCURRENTLY IF EXISTS uq_cloud_metrics_sample_ts"))
+                print(f"[0002] kept the string-based sample key ({e}); "
+                      f"run python -m backend.dedupe_metrics to move it to ts")
+
+
+def downgrade() -> None:
+    bind = op.get_bind()
+    if _constraint_columns(bind, "uq_cloud_metrics_sample") == ["user_id", "provider", "vm_id", "ts"]:
+        # Distinct instants are distinct strings, so the old key always fits
+        op.drop_constraint("uq_cloud_metrics_sample", "cloud_metrics")
+        op.create_unique_constraint(
+            "uq_cloud_metrics_sample", "cloud_metrics", ["user_id", "provider", "vm_id", "timestamp"]
+        )
+    op.execute("DROP INDEX IF EXISTS ix_cloud_metrics_user_provider_ts")
+    op.execute("DROP INDEX IF EXISTS ix_cloud_metrics_user_ts")
+    op.drop_column("cloud_metrics", "ts")
+    op.execute("DROP FUNCTION IF EXISTS cloud9_parse_ts(text)")
@@ -0,0 +1,140 @@
+"""range-partition cloud_metrics on ts
+
+A table can't be partitioned in place, so this builds a partitioned copy next to
+it: partitions covering the existing data plus METRICS_PARTITIONS_AHEAD periods,
+and a DEFAULT partition for anything outside them. Rows are copied in id batches,
+one committed transaction per batch, while the old table keeps serving; then the
+tail is copied under a write lock and the tables are swapped by renaming.
+
+The partition key has to be part of every unique constraint, so the primary key
+becomes (id, ts) and ts becomes NOT NULL. Rows whose timestamp never parsed have
+no ts and are not copied; they stay in cloud_metrics_unpartitioned, which is kept
+(without its foreign key to users) for inspection and can be dropped once the
+new table has been checked.
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18 00:00:00
+
+"""
+import datetime
+from typing import Sequence, Union
+
+from alembic import op
+from sqlalchemy import text
+
+from backend import partitions
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0003'
+down_revision: Union[str, None] = '0002'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+BATCH_SIZE = 50000
+NEW = "cloud_metrics_new"
+OLD = "cloud_metrics_unpartitioned"
+
+# (name on the new table while both exist, final name, definition)
+INDEXES = [
+    ("ix_cloud_metrics_new_id", "ix_cloud_metrics_id", "(id)"),
+    ("ix_cloud_metrics_new_user_ts", "ix_cloud_metrics_user_ts", "(user_id, ts)"),
+    ("ix_cloud_metrics_new_user_provider_ts", "ix_cloud_metrics_user_provider_ts", "(user_id, provider, ts)"),
+]
+
+
+def _copy(bind, lo, hi):
+    # The sample key is in place from the start, so the copy also drops duplicates
+    return bind.execute(text(
+        f"INSERT INTO {NEW} SELECT * FROM cloud_metrics "
+        f"WHERE id >= :lo AND id < :hi AND ts IS NOT NULL ON CONFLICT DO NOTHING"
+    ), {"lo": lo, "hi": hi}).rowcount
+
+
+def upgrade() -> None:
+    bind = op.get_bind()
+    if partitions.is_partitioned(bind):
+        return  # created partitioned by create_all
+
+    with op.get_context().autocommit_block():
+        bind.execute(text(f"DROP TABLE IF EXISTS {NEW}"))  # left over from an interrupted run
+        bind.execute(text(f"CREATE TABLE {NEW} (LIKE cloud_metrics INCLUDING DEFAULTS) PARTITION BY RANGE (ts)"))
+        bind.execute(text(f"ALTER TABLE {NEW} ALTER COLUMN ts SET NOT NULL"))
+        bind.execute(text(f"ALTER TABLE {NEW} ADD CONSTRAINT {NEW}_pkey PRIMARY KEY (id, ts)"))
+        bind.execute(text(f"ALTER TABLE {NEW} ADD CONSTRAINT {NEW}_user_id_fkey FOREIGN KEY (user_id) REFERENCES users (id)"))
+        bind.execute(text(
+            f"ALTER TABLE {NEW} ADD CONSTRAINT uq_{NEW}_sample UNIQUE (user_id, provider, vm_id, ts)"
+        ))
+        for tmp, _, cols in INDEXES:
+            bind.execute(text(f"CREATE INDEX {tmp} ON {NEW} {cols}"))
+
+        now = datetime.datetime.now(datetime.timezone.utc)
+        oldest, = bind.execute(text("SELECT min(ts) FROM cloud_metrics")).one()
+        lo = partitions.period_start(oldest or now)
+        horizon = partitions.period_start(now)
+        for _ in range(partitions.METRICS_PARTITIONS_AHEAD + 1):
+            horizon = partitions.next_period(horizon)
+        while lo < horizon:
+            hi = partitions.next_period(lo)
+            bind.execute(text(
+                f"CREATE TABLE {partitions.partition_name(lo)} PARTITION OF {NEW} "
+                f"FOR VALUES FROM ('{lo.isoformat()}') TO ('{hi.isoformat()}')"
+            ))
+            lo = hi
+        bind.execute(text(f"CREATE TABLE cloud_metrics_default PARTITION OF {NEW} DEFAULT"))
+
+        first, last = bind.execute(text("SELECT min(id), max(id) FROM cloud_metrics")).one()
+        copied = 0
+        if first is not None:
+            for start in range(first, last + 1, BATCH_SIZE):
+                copied += _copy(bind, start, start + BATCH_SIZE)
+                print(f"[0003] copied ids {start}..{start + BATCH_SIZE - 1} ({copied} rows)")
+
+    # Swap, in the migration's own transaction: writers wait on the lock for the
+    # tail copy and renames, readers are never blocked
+    bind.execute(text("LOCK TABLE cloud_metrics IN EXCLUSIVE MODE"))
+    tail = _copy(bind, (last or 0) + 1, 2 ** 31)
+    print(f"[0003] copied {tail} rows written during the copy")
+    skipped = bind.execute(text("SELECT count(*) FROM cloud_metrics WHERE ts IS NULL")).scalar()
+
+    bind.execute(text(f"ALTER TABLE cloud_metrics RENAME TO {OLD}"))
+    bind.execute(text(f"ALTER TABLE {OLD} RENAME CONSTRAINT cloud_metrics_pkey TO {OLD}_pkey"))
+    bind.execute(text(f"ALTER TABLE {OLD} DROP CONSTRAINT IF EXISTS uq_cloud_metrics_sample"))
+    # Its rows are a leftover copy; they must not keep users from being deleted
+    bind.execute(text(f"ALTER TABLE {OLD} DROP CONSTRAINT IF EXISTS cloud_metrics_user_id_fkey"))
+    for _, final, _ in INDEXES:
+        bind.execute(text(f"ALTER INDEX IF EXISTS {final} RENAME TO {final}_unpartitioned"))
+    # The id sequence must outlive the old table
+    bind.execute(text(f"ALTER SEQUENCE cloud_metrics_id_seq OWNED BY {NEW}.id"))
+    bind.execute(text(f"ALTER TABLE {OLD} ALTER COLUMN id DROP DEFAULT"))
+
+    bind.execute(text(f"ALTER TABLE {NEW} RENAME TO cloud_metrics"))
+    bind.execute(text(f"ALTER TABLE cloud_metrics RENAME CONSTRAINT {NEW}_pkey TO cloud_metrics_pkey"))
+    bind.execute(text(f"ALTER TABLE cloud_metrics RENAME CONSTRAINT {NEW}_user_id_fkey TO cloud_metrics_user_id_fkey"))
+    bind.execute(text(f"ALTER TABLE cloud_metrics RENAME CONSTRAINT uq_{NEW}_sample TO uq_cloud_metrics_sample"))
+    for tmp, final, _ in INDEXES:
+        bind.execute(text(f"ALTER INDEX {tmp} RENAME TO {final}"))
+    print(f"[0003] cloud_metrics is now partitioned; {OLD} kept with the original rows"
+          + (f" ({skipped} of them had no parsable timestamp and were not copied)" if skipped else ""))
+
+
+def downgrade() -> None:
+    bind = op.get_bind()
+    plain = "cloud_metrics_plain"
+    bind.execute(text("LOCK TABLE cloud_metrics IN EXCLUSIVE MODE"))
+    bind.execute(text(f"CREATE TABLE {plain} (LIKE cloud_metrics INCLUDING DEFAULTS)"))
+    bind.execute(text(f"ALTER TABLE {plain} ALTER COLUMN ts DROP NOT NULL"))
+    bind.execute(text(f"INSERT INTO {plain} SELECT * FROM cloud_metrics"))
+    if bind.execute(text("SELECT to_regclass(:t)"), {"t": OLD}).scalar():
+        # The rows upgrade couldn't copy
+        bind.execute(text(f"INSERT INTO {plain} SELECT * FROM {OLD} WHERE ts IS NULL"))
+        bind.execute(text(f"DROP TABLE {OLD}"))
+    bind.execute(text(f"ALTER SEQUENCE cloud_metrics_id_seq OWNED BY {plain}.id"))
+    bind.execute(text("DROP TABLE cloud_metrics"))  # takes every partition with it
+    bind.execute(text(f"ALTER TABLE {plain} RENAME TO cloud_metrics"))
+    bind.execute(text("ALTER TABLE cloud_metrics ADD CONSTRAINT cloud_metrics_pkey PRIMARY KEY (id)"))
+    bind.execute(text("ALTER TABLE cloud_metrics ADD CONSTRAINT cloud_metrics_user_id_fkey FOREIGN KEY (user_id) REFERENCES users (id)"))
+    bind.execute(text("ALTER TABLE cloud_metrics ADD CONSTRAINT uq_cloud_metrics_sample UNIQUE (user_id, provider, vm_id, ts)"))
+    for _, final, cols in INDEXES:
+        bind.execute(text(f"CREATE INDEX {final} ON cloud_metrics {cols}"))
@@ -0,0 +1,74 @@
+"""hourly and daily metric rollups
+
+Creates metric_rollups_hourly and metric_rollups_daily and fills them from the
+existing cloud_metrics rows, one month of raw data at a time with each batch
+committed on its own. From then on the metric writer keeps them current.
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-18 00:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy import text
+
+from backend import partitions, rollups
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0004'
+down_revision: Union[str, None] = '0003'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+TABLES = ("metric_rollups_hourly", "metric_rollups_daily")
+
+
+def _create(name):
+    columns = [
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.id", ondelete="CASCADE"), nullable=False),
+        sa.Column("provider", sa.String(), nullable=False),
+        sa.Column("vm_id", sa.String(), nullable=False),
+        sa.Column("bucket", sa.DateTime(timezone=True), nullable=False),
+        sa.Column("samples", sa.Integer(), nullable=False),
+        sa.Column("idle_samples", sa.Integer(), nullable=False),
+    ]
+    for metric in ("cpu", "memory", "network", "spend"):
+        columns += [
+            sa.Column(f"{metric}_sum", sa.Float(), nullable=False),
+            sa.Column(f"{metric}_min", sa.Float(), nullable=True),
+            sa.Column(f"{metric}_max", sa.Float(), nullable=True),
+        ]
+    op.create_table(name, *columns, sa.UniqueConstraint("user_id", "provider", "vm_id", "bucket", name=f"uq_{name}_key"))
+    op.create_index(f"ix_{name}_user_provider_bucket", name, ["user_id", "provider", "bucket"])
+    op.create_index(f"ix_{name}_user_bucket", name, ["user_id", "bucket"])
+
+
+def upgrade() -> None:
+    bind = op.get_bind()
+    existing = set(sa.inspect(bind).get_table_names())
+    for name in TABLES:
+        if name not in existing:
+            _create(name)
+
+    with op.get_context().autocommit_block():
+        lo, hi = bind.execute(text("SELECT min(ts), max(ts) FROM cloud_metrics")).one()
+        if lo is None:
+            return
+        start = partitions.period_start(lo, "month")
+        while start <= hi:
+            end = partitions.next_period(start, "month")
+            keys = rollups.hours_with_data(bind, start, end)
+            for i in range(0, len(keys), rollups.ROLLUP_REFRESH_BATCH):
+                rollups.refresh(bind, keys[i:i + rollups.ROLLUP_REFRESH_BATCH])
+            print(f"[0004] rolled up {start:%Y-%m} ({len(keys)} hourly buckets)")
+            start = end
+
+
+def downgrade() -> None:
+    for name in reversed(TABLES):
+        op.drop_table(name)
@@ -0,0 +1,47 @@
+"""model registry
+
+Creates model_versions, which records every trained per-user model (optimizer
+KMeans, idle-detection forest) with the data it was trained on. Artifacts that
+predate the registry are not imported; each user's models are retrained on
+first use.
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-18 00:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0005'
+down_revision: Union[str, None] = '0004'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    if "model_versions" in sa.inspect(op.get_bind()).get_table_names():
+        return
+    op.create_table(
+        "model_versions",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.id", ondelete="CASCADE"), nullable=False),
+        sa.Column("kind", sa.String(), nullable=False),
+        sa.Column("version", sa.Integer(), nullable=False),
+        sa.Column("path", sa.String(), nullable=False),
+        sa.Column("reason", sa.String(), nullable=False),
+        sa.Column("train_rows", sa.Integer(), nullable=False),
+        sa.Column("data_rows", sa.Integer(), nullable=False),
+        sa.Column("feature_stats", sa.JSON(), nullable=False),
+        sa.Column("train_seconds", sa.Float(), nullable=False),
+        sa.Column("trained_at", sa.DateTime(timezone=True), nullable=False),
+        sa.UniqueConstraint("user_id", "kind", "version", name="uq_model_versions_key"),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("model_versions")
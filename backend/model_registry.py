@@ -0,0 +1,378 @@
+# backend/model_registry.py
+# Versioned per-user models (optimizer KMeans, idle-detection forest).
+#
+# Every training run writes a new artifact file, which is never rewritten, and
+# then inserts its model_versions row; the highest version of a (user, kind) is
+# the live one. A request reads that version number (one indexed lookup) and
+# takes the model from an in-process LRU keyed by (kind, user, version), so a
+# retrain is picked up by every process on its next request and a request can
+# never load a half-written or replaced file. Requests never train: a user
+# without a model gets None while one background run per process trains it.
+# When that run produces no model (too little data, or an error) the next one
+# waits MODEL_RETRY_SECONDS.
+#
+# refresh() retrains when the user's sample count has grown by
+# MODEL_RETRAIN_ROW_GROWTH since the live version was trained, or when the
+# means of their last MODEL_DRIFT_WINDOW_HOURS of data (from the hourly
+# rollups) have moved more than MODEL_DRIFT_THRESHOLD training standard
+# deviations from what they were at training time. It runs after ingestion and
+# on a schedule.
+#
+#   python -m backend.model_registry [--user-id N] [--kind optimizer] [--force]
+import argparse, datetime, os, threading, time, uuid
+from collections import OrderedDict
+import joblib
+import numpy as np
+from sqlalchemy import delete, func, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from backend.database import SessionLocal
+from backend.models import CloudMetric, MetricRollupDaily, MetricRollupHourly, ModelVersion, User
+from backend import partitions, response_cache, snapshots
+
+MODEL_DIR = os.getenv("MODEL_DIR", "models")  # must be shared by the API and the Celery workers
+MODEL_CACHE_SIZE = int(os.getenv("MODEL_CACHE_SIZE", "128"))  # loaded models per process
+MODEL_KEEP_VERSIONS = int(os.getenv("MODEL_KEEP_VERSIONS", "3"))
+MODEL_TRAIN_MAX_ROWS = int(os.getenv("MODEL_TRAIN_MAX_ROWS", "100000"))
+MODEL_RETRAIN_ROW_GROWTH = float(os.getenv("MODEL_RETRAIN_ROW_GROWTH", "0.2"))
+MODEL_DRIFT_THRESHOLD = float(os.getenv("MODEL_DRIFT_THRESHOLD", "0.5"))
+MODEL_DRIFT_WINDOW_HOURS = int(os.getenv("MODEL_DRIFT_WINDOW_HOURS", "24"))
+MODEL_DRIFT_MIN_SAMPLES = 50
+MODEL_REFRESH_MINUTES = int(os.getenv("MODEL_REFRESH_MINUTES", "60"))
+MODEL_RETRY_SECONDS = int(os.getenv("MODEL_RETRY_SECONDS", "900"))  # after a first training run produced no model
+
+FEATURES = snapshots.FEATURES
+DRIFT_FEATURES = {"cpu_usage": "cpu", "memory_usage": "memory", "network_traffic": "network"}  # kept in the rollups
+KIND_MODULES = {"optimizer": "backend.optimizer_model", "idle": "backend.idle_model"}
+
+TRAINERS = {}  # kind -> train(db, user_id) -> (artifact, feature matrix) or None
+
+
+def register(kind: str, train):
+    TRAINERS[kind] = train
+
+
+def _trainers() -> dict:
+    # Trainers register on import; make sure every kind is loaded
+    import importlib
+    for module in KIND_MODULES.values():
+        importlib.import_module(module)
+    return TRAINERS
+
+
+class _LoadedModels:
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # (kind, user_id, version) -> model
+        self._lock = threading.Lock()
+        self.hits = self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            model = self._entries.get(key)
+            if model is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return model
+
+    def put(self, key, model):
+        kind, user_id, version = key
+        with self._lock:
+            # Superseded versions of the same model are of no further use
+            for old in [k for k in self._entries if k[:2] == (kind, user_id) and k[2] < version]:
+                del self._entries[old]
+            self._entries[key] = model
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"loaded": len(self._entries), "max_entries": self.max_entries, "hits": self.hits, "misses": self.misses}
+
+
+_loaded = _LoadedModels(MODEL_CACHE_SIZE)
+_training = set()  # (kind, user_id) with an initial training run under way
+_no_model_until = {}  # (kind, user_id) -> monotonic time the next initial run may start
+_training_lock = threading.Lock()
+
+
+def _first_day(db: Session, user_id: int, limit: int) -> datetime.date | None:
+    """Oldest day the newest ``limit`` samples can reach back to, from the daily rollups."""
+    days = db.execute(
+        select(MetricRollupDaily.bucket, func.sum(MetricRollupDaily.samples))
+        .where(MetricRollupDaily.user_id == user_id)
+        .group_by(MetricRollupDaily.bucket).order_by(MetricRollupDaily.bucket.desc())
+    ).all()
+    total, since = 0, None
+    for bucket, samples in days:
+        total += samples
+        since = bucket.astimezone(datetime.timezone.utc).date()
+        if total >= limit:
+            break
+    return since
+
+
+def training_matrix(db: Session, user_id: int, limit: int | None = None) -> np.ndarray:
+    """Newest ``limit`` (default MODEL_TRAIN_MAX_ROWS) feature rows, oldest first.
+
+    Read from the snapshot, brought up to date first so it covers the same
+    samples as the data_rows recorded with the model; from the database when
+    there is no snapshot or it can't be updated.
+    """
+    limit = limit or MODEL_TRAIN_MAX_ROWS
+    if snapshots.available():
+        try:
+            snapshots.export_user(user_id)
+            feats = snapshots.load_matrix(user_id, newest=limit, since=_first_day(db, user_id, limit))
+            if feats is not None:
+                return feats
+        except Exception as e:
+            print(f"[models] snapshot for user {user_id} unusable, reading the database: {e}")
+    rows = db.execute(
+        select(*(getattr(CloudMetric, c) for c in FEATURES))
+        .where(CloudMetric.user_id == user_id)
+        .order_by(CloudMetric.ts.desc(), CloudMetric.id.desc()).limit(limit)
+    ).all()
+    return np.array([[v or 0.0 for v in r] for r in reversed(rows)], dtype=np.float64).reshape(-1, len(FEATURES))
+
+
+def current(db: Session, kind: str, user_id: int):
+    return db.execute(
+        select(ModelVersion).where(ModelVersion.user_id == user_id, ModelVersion.kind == kind)
+        .order_by(ModelVersion.version.desc()).limit(1)
+    ).scalar_one_or_none()
+
+
+def get(db: Session, kind: str, user_id: int):
+    """The live model of ``kind`` for the user, or None while there is none yet (training is queued)."""
+    for _ in range(2):
+        row = db.execute(
+            select(ModelVersion.version, ModelVersion.path)
+            .where(ModelVersion.user_id == user_id, ModelVersion.kind == kind)
+            .order_by(ModelVersion.version.desc()).limit(1)
+        ).first()
+        if row is None:
+            train_in_background(kind, user_id)
+            return None
+        key = (kind, user_id, row.version)
+        model = _loaded.get(key)
+        if model is not None:
+            return model
+        try:
+            model = joblib.load(row.path)
+        except FileNotFoundError:
+            continue  # pruned after a newer version landed; read the live one again
+        _loaded.put(key, model)
+        return model
+    if row is not None:
+        # The live file is gone for good (e.g. MODEL_DIR not shared with the process that trained it)
+        _evict_missing(db, kind, user_id)
+        train_in_background(kind, user_id)
+    return None
+
+
+def _evict_missing(db: Session, kind: str, user_id: int):
+    """Drop the user's versions of ``kind`` whose artifact file no longer exists."""
+    rows = db.execute(
+        select(ModelVersion.id, ModelVersion.version, ModelVersion.path)
+        .where(ModelVersion.user_id == user_id, ModelVersion.kind == kind)
+    ).all()
+    gone = [r for r in rows if not os.path.exists(r.path)]
+    if not gone:
+        return
+    db.execute(delete(ModelVersion).where(ModelVersion.id.in_([r.id for r in gone])))
+    db.commit()
+    print(f"[models] {kind} for user {user_id}: artifact missing for v{', v'.join(str(r.version) for r in gone)}, retraining")
+
+
+def _data_rows(db: Session, user_id: int) -> int:
+    return db.scalar(select(func.coalesce(func.sum(MetricRollupDaily.samples), 0))
+                     .where(MetricRollupDaily.user_id == user_id))
+
+
+def _recent_means(db: Session, user_id: int) -> dict | None:
+    """Feature means over the user's newest MODEL_DRIFT_WINDOW_HOURS of data, from the hourly rollups."""
+    h = MetricRollupHourly
+    newest = db.scalar(select(func.max(h.bucket)).where(h.user_id == user_id))
+    if newest is None:
+        return None
+    since = newest - datetime.timedelta(hours=MODEL_DRIFT_WINDOW_HOURS)
+    row = db.execute(
+        select(func.sum(h.samples), *(func.sum(getattr(h, f"{m}_sum")) for m in DRIFT_FEATURES.values()))
+        .where(h.user_id == user_id, h.bucket > since)
+    ).one()
+    samples = row[0] or 0
+    if samples < MODEL_DRIFT_MIN_SAMPLES:
+        return None
+    return {feature: (total or 0.0) / samples for feature, total in zip(DRIFT_FEATURES, row[1:])}
+
+
+def _drift(stats: dict, recent: dict) -> float:
+    """Largest move of a recent mean since training, in training standard deviations."""
+    before = stats.get("recent") or {}
+    shift = 0.0
+    for feature, mean in recent.items():
+        if feature in before:
+            std = stats["features"][feature][1]
+            shift = max(shift, abs(mean - before[feature]) / max(std, 1e-9))
+    return shift
+
+
+def stale_reason(db: Session, kind: str, user_id: int) -> str | None:
+    """Why the user's live model of ``kind`` should be retrained, or None."""
+    row = current(db, kind, user_id)
+    if row is None:
+        return "initial"
+    rows = _data_rows(db, user_id)
+    if rows == row.data_rows:
+        return None  # no samples added or removed since training
+    if rows > row.data_rows and rows >= row.data_rows * (1 + MODEL_RETRAIN_ROW_GROWTH):
+        return "rows"
+    # The recent window is compared with the same window at training time, so a
+    # user whose recent data always differs from their history isn't retrained
+    # over and over
+    recent = _recent_means(db, user_id)
+    if recent and _drift(row.feature_stats, recent) > MODEL_DRIFT_THRESHOLD:
+        return "drift"
+    return None
+
+
+def _write_artifact(kind: str, user_id: int, artifact) -> str:
+    directory = os.path.join(MODEL_DIR, f"user_{user_id}")
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{kind}-{uuid.uuid4().hex[:12]}.joblib")
+    tmp = f"{path}.{os.getpid()}.tmp"
+    joblib.dump(artifact, tmp)
+    os.replace(tmp, path)
+    return path
+
+
+def _prune(db: Session, kind: str, user_id: int):
+    old = db.execute(
+        select(ModelVersion.id, ModelVersion.path)
+        .where(ModelVersion.user_id == user_id, ModelVersion.kind == kind)
+        .order_by(ModelVersion.version.desc()).offset(MODEL_KEEP_VERSIONS)
+    ).all()
+    if not old:
+        return
+    db.execute(delete(ModelVersion).where(ModelVersion.id.in_([r.id for r in old])))
+    db.commit()
+    for r in old:
+        try:
+            os.remove(r.path)
+        except FileNotFoundError:
+            pass
+
+
+def publish(kind: str, user_id: int, reason: str) -> int | None:
+    """Train and register a new version; returns its number, or None when there is nothing to train on."""
+    started = time.perf_counter()
+    with SessionLocal() as db:
+        data_rows, recent = _data_rows(db, user_id), _recent_means(db, user_id)
+        trained = _trainers()[kind](db, user_id)
+        if trained is None:
+            return None
+        artifact, feats = trained
+        # The file is complete before its row exists, so readers never see it half-written
+        path = _write_artifact(kind, user_id, artifact)
+        stats = {"features": {f: [float(feats[:, i].mean()), float(feats[:, i].std())] for i, f in enumerate(FEATURES)},
+                 "recent": recent}
+        for _ in range(3):
+            latest = db.scalar(select(func.max(ModelVersion.version))
+                               .where(ModelVersion.user_id == user_id, ModelVersion.kind == kind)) or 0
+            db.add(ModelVersion(user_id=user_id, kind=kind, version=latest + 1, path=path, reason=reason,
+                                train_rows=len(feats), data_rows=data_rows, feature_stats=stats,
+                                train_seconds=round(time.perf_counter() - started, 3),
+                                trained_at=datetime.datetime.now(datetime.timezone.utc)))
+            try:
+                db.commit()
+                break
+            except IntegrityError:
+                db.rollback()  # another process published the same version number first
+        else:
+            os.remove(path)
+            raise RuntimeError(f"could not register a {kind} model for user {user_id}")
+        _loaded.put((kind, user_id, latest + 1), artifact)
+        _prune(db, kind, user_id)
+    response_cache.bump([user_id])  # cached optimizer responses came from the old model
+    print(f"[models] {kind} v{latest + 1} for user {user_id} ({reason}, {len(feats):,} samples, "
+          f"{time.perf_counter() - started:.2f}s)")
+    return latest + 1
+
+
+def training(kind: str, user_id: int) -> bool:
+    with _training_lock:
+        return (kind, user_id) in _training
+
+
+def train_in_background(kind: str, user_id: int):
+    """Start the user's first training run of ``kind`` unless this process already has one going."""
+    key = (kind, user_id)
+    with _training_lock:
+        if key in _training or _no_model_until.get(key, 0) > time.monotonic():
+            return
+        _no_model_until.pop(key, None)
+        _training.add(key)
+
+    def run():
+        version = None
+        try:
+            version = refresh(user_id, [kind]).get(kind)  # re-checks, so a model another process published isn't retrained
+        finally:
+            with _training_lock:
+                _training.discard(key)
+                if version is None:
+                    _no_model_until[key] = time.monotonic() + MODEL_RETRY_SECONDS
+            if version is None:
+                response_cache.bump([user_id])  # responses cached while training was pending
+
+    threading.Thread(target=run, name=f"train-{kind}-{user_id}", daemon=True).start()
+
+
+def refresh(user_id: int, kinds=None, force: bool = False) -> dict:
+    """Retrain the user's stale models; returns kind -> new version. Errors are logged, not raised."""
+    out = {}
+    for kind in kinds or _trainers():
+        try:
+            with SessionLocal() as db:
+                reason = "manual" if force else stale_reason(db, kind, user_id)
+            if reason:
+                out[kind] = publish(kind, user_id, reason)
+        except Exception as e:
+            print(f"[models] {kind} refresh for user {user_id} failed: {e}")
+    return out
+
+
+def maintain():
+    try:
+        with SessionLocal() as db:
+            user_ids = db.scalars(select(User.id)).all()
+        for user_id in user_ids:
+            refresh(user_id)
+    except Exception as e:
+        print(f"[models] refresh pass error: {e}")
+
+
+def stats() -> dict:
+    with _training_lock:
+        pending = len(_training)
+    return {"cache": _loaded.stats(), "training": pending}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Retrain stale per-user models")
+    parser.add_argument("--user-id", type=int, help="default: every user")
+    parser.add_argument("--kind", choices=sorted(KIND_MODULES), help="default: every kind")
+    parser.add_argument("--force", action="store_true", help="retrain even if the live model is current")
+    args = parser.parse_args()
+    with SessionLocal() as db:
+        user_ids = [args.user_id] if args.user_id else db.scalars(select(User.id)).all()
+    for user_id in user_ids:
+        print(f"[models] user {user_id}: {refresh(user_id, [args.kind] if args.kind else None, args.force) or 'up to date'}")
+
+
+if __name__ == "__main__":
+    main()
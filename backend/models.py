@@ -1,6 +1,6 @@
 # app/models.py
-from sqlalchemy import Column, Integer, String, Float, ForeignKey, Text
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, Integer, String, Float, ForeignKey, Text, DateTime, UniqueConstraint, Index, JSON
+from sqlalchemy.orm import relationship, declared_attr
 from backend.database import Base
 
 class User(Base):
@@ -25,12 +25,28 @@ class CloudCredential(Base):
     user_id = Column(Integer, ForeignKey("users.id"))
     owner = relationship("User", back_populates="credentials")
 
+# Natural key of a metric sample; re-sent samples are de-duplicated against it
+METRIC_SAMPLE_KEY = "uq_cloud_metrics_sample"
+METRIC_SAMPLE_KEY_COLUMNS = ("user_id", "provider", "vm_id", "ts")
+
 class CloudMetric(Base):
     __tablename__ = "cloud_metrics"
-    id = Column(Integer, primary_key=True, index=True)
+    __table_args__ = (
+        UniqueConstraint(*METRIC_SAMPLE_KEY_COLUMNS, name=METRIC_SAMPLE_KEY),
+        # Every dashboard query is "this user's (provider's) newest rows"
+        Index("ix_cloud_metrics_user_ts", "user_id", "ts"),
+        Index("ix_cloud_metrics_user_provider_ts", "user_id", "provider", "ts"),
+        # Range partitions on ts, managed by backend.partitions
+        {"postgresql_partition_by": "RANGE (ts)"},
+    )
+    id = Column(Integer, primary_key=True, autoincrement=True, index=True)
     provider = Column(String, nullable=True)
     vm_id = Column(String, nullable=True)
-    timestamp = Column(String, nullable=True)
+    vm_name = Column(String, nullable=True)
+    region = Column(String, nullable=True)          # AWS region / GCP zone / Azure location
+    instance_state = Column(String, nullable=True)
+    timestamp = Column(String, nullable=True)      # as reported; kept for the API
+    ts = Column(DateTime(timezone=True), primary_key=True)  # parsed; the partition key, so part of the PK
     cpu_usage = Column(Float, nullable=True)
     memory_usage = Column(Float, nullable=True)
     network_traffic = Column(Float, nullable=True)
@@ -40,3 +56,69 @@ class CloudMetric(Base):
 
     user_id = Column(Integer, ForeignKey("users.id"))
     owner = relationship("User", back_populates="metrics")
+
+class IngestWatermark(Base):
+    __tablename__ = "ingest_watermarks"
+    __table_args__ = (UniqueConstraint("user_id", "provider", "resource_id", name="uq_ingest_watermark"),)
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    provider = Column(String, nullable=False)
+    resource_id = Column(String, nullable=False)
+    watermark = Column(DateTime, nullable=False)  # naive UTC; every sample before it is stored
+
+class _MetricRollup:
+    # One row per (user, provider, resource, bucket); kept in step with
+    # cloud_metrics by backend.rollups. Sums treat missing values as 0, like the
+    # dashboard always did; min/max ignore them.
+    id = Column(Integer, primary_key=True)
+    provider = Column(String, nullable=False)
+    vm_id = Column(String, nullable=False)  # "" for samples without one
+    bucket = Column(DateTime(timezone=True), nullable=False)  # bucket start, UTC
+    samples = Column(Integer, nullable=False)
+    idle_samples = Column(Integer, nullable=False)
+    cpu_sum = Column(Float, nullable=False)
+    cpu_min = Column(Float, nullable=True)
+    cpu_max = Column(Float, nullable=True)
+    memory_sum = Column(Float, nullable=False)
+    memory_min = Column(Float, nullable=True)
+    memory_max = Column(Float, nullable=True)
+    network_sum = Column(Float, nullable=False)
+    network_min = Column(Float, nullable=True)
+    network_max = Column(Float, nullable=True)
+    spend_sum = Column(Float, nullable=False)
+    spend_min = Column(Float, nullable=True)
+    spend_max = Column(Float, nullable=True)
+
+    @declared_attr
+    def user_id(cls):
+        return Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+
+    @declared_attr
+    def __table_args__(cls):
+        return (
+            UniqueConstraint("user_id", "provider", "vm_id", "bucket", name=f"uq_{cls.__tablename__}_key"),
+            Index(f"ix_{cls.__tablename__}_user_provider_bucket", "user_id", "provider", "bucket"),
+            Index(f"ix_{cls.__tablename__}_user_bucket", "user_id", "bucket"),
+        )
+
+class MetricRollupHourly(_MetricRollup, Base):
+    __tablename__ = "metric_rollups_hourly"
+
+class MetricRollupDaily(_MetricRollup, Base):
+    __tablename__ = "metric_rollups_daily"
+
+class ModelVersion(Base):
+    # One trained artifact per row; the highest version of a (user, kind) is live
+    __tablename__ = "model_versions"
+    __table_args__ = (UniqueConstraint("user_id", "kind", "version", name="uq_model_versions_key"),)
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    kind = Column(String, nullable=False)         # "optimizer" | "idle"
+    version = Column(Integer, nullable=False)
+    path = Column(String, nullable=False)         # artifact file, never rewritten
+    reason = Column(String, nullable=False)       # "initial" | "rows" | "drift" | "manual"
+    train_rows = Column(Integer, nullable=False)  # samples the model was fitted on
+    data_rows = Column(Integer, nullable=False)   # user's total samples at training time
+    feature_stats = Column(JSON, nullable=False)  # {"features": {name: [mean, std]}, "recent": {name: mean}}
+    train_seconds = Column(Float, nullable=False)
+    trained_at = Column(DateTime(timezone=True), nullable=False)
@@ -0,0 +1,28 @@
+# backend/optimizer_model.py
+# Per-user KMeans (with its StandardScaler) behind /users/me/optimizer,
+# versioned through backend.model_registry.
+from sqlalchemy.orm import Session
+from backend import model_registry
+
+KIND = "optimizer"
+N_CLUSTERS = 3
+
+
+def _train(db: Session, user_id: int):
+    from sklearn.cluster import KMeans
+    from sklearn.preprocessing import StandardScaler
+    feats = model_registry.training_matrix(db, user_id)
+    if len(feats) == 0:
+        return None
+    scaler = StandardScaler().fit(feats)
+    kmeans = KMeans(n_clusters=min(N_CLUSTERS, len(feats)), random_state=42).fit(scaler.transform(feats))
+    return {"kmeans": kmeans, "scaler": scaler}, feats
+
+
+model_registry.register(KIND, _train)
+
+
+def get(db: Session, user_id: int):
+    """(kmeans, scaler) of the user's live model, or None while it is being trained or without any data."""
+    model = model_registry.get(db, KIND, user_id)
+    return None if model is None else (model["kmeans"], model["scaler"])
@@ -0,0 +1,211 @@
+# backend/partitions.py
+# cloud_metrics is range-partitioned on ts (see migration 0003). This keeps
+# partitions created ahead of the data and drops the ones that have aged out of
+# the retention window, which is far cheaper than DELETE + vacuum, along with
+# the rollup buckets that summarized them. Runs at
+# startup and then daily from the API scheduler; safe to run from several
+# processes at once.
+#
+#   python -m backend.partitions
+import os, re, datetime
+from sqlalchemy import text
+from backend.database import engine as default_engine
+from backend import response_cache
+
+TABLE = "cloud_metrics"
+METRICS_PARTITION_INTERVAL = os.getenv("METRICS_PARTITION_INTERVAL", "month").lower()  # month | week
+METRICS_PARTITIONS_AHEAD = int(os.getenv("METRICS_PARTITIONS_AHEAD", "2"))
+METRICS_RETENTION_DAYS = int(os.getenv("METRICS_RETENTION_DAYS", "0"))  # 0 keeps everything
+# "Latest rows" queries probe this far back first, which touches only the newest
+# partitions, and scan the rest only when that window is short; 0 disables the probe
+METRICS_QUERY_LOOKBACK_DAYS = int(os.getenv("METRICS_QUERY_LOOKBACK_DAYS", "30"))
+PARTITION_LOCK_TIMEOUT = os.getenv("METRICS_PARTITION_LOCK_TIMEOUT", "5s")
+
+_LOCK_KEY = "cloud9:partitions"
+_BOUND = re.compile(r"FROM \('([^']+)'\) TO \('([^']+)'\)")
+
+if METRICS_PARTITION_INTERVAL not in ("month", "week"):
+    raise ValueError("METRICS_PARTITION_INTERVAL must be 'month' or 'week'")
+
+
+def period_start(ts: datetime.datetime, interval: str = METRICS_PARTITION_INTERVAL) -> datetime.datetime:
+    if ts.tzinfo is not None:
+        ts = ts.astimezone(datetime.timezone.utc)
+    day = datetime.datetime(ts.year, ts.month, ts.day, tzinfo=datetime.timezone.utc)
+    if interval == "week":
+        return day - datetime.timedelta(days=day.weekday())
+    return day.replace(day=1)
+
+
+def next_period(ts: datetime.datetime, interval: str = METRICS_PARTITION_INTERVAL) -> datetime.datetime:
+    start = period_start(ts, interval)
+    if interval == "week":
+        return start + datetime.timedelta(days=7)
+    return (start + datetime.timedelta(days=32)).replace(day=1)
+
+
+def partition_name(lo: datetime.datetime) -> str:
+    return f"{TABLE}_p{lo:%Y%m%d}"
+
+
+def lookback_cutoff(days: int | None = None) -> datetime.datetime | None:
+    days = days or METRICS_QUERY_LOOKBACK_DAYS
+    if days <= 0:
+        return None
+    return datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=days)
+
+
+def probe_windows() -> list:
+    """Lower ts bounds to try, in order, for a "newest N rows" query; None means no bound.
+
+    Stop at the first that yields N rows: tenants with recent data only touch the
+    newest partitions, and older data is still found when there is no recent data.
+    """
+    cutoff = lookback_cutoff()
+    return [cutoff, None] if cutoff else [None]
+
+
+def is_partitioned(conn) -> bool:
+    if conn.dialect.name != "postgresql":
+        return False
+    return conn.execute(
+        text("SELECT relkind = 'p' FROM pg_class WHERE oid = to_regclass(:t)"), {"t": TABLE}
+    ).scalar() is True
+
+
+def list_partitions(conn) -> list:
+    """[(name, lo, hi)] ordered by lo; the DEFAULT partition has lo = hi = None."""
+    conn.execute(text("SET LOCAL TIME ZONE 'UTC'"))  # bounds are rendered in the session zone
+    rows = conn.execute(text("""
+        SELECT c.relname, pg_get_expr(c.relpartbound, c.oid)
+        FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = to_regclass(:t)
+    """), {"t": TABLE}).all()
+    parts = []
+    for name, bound in rows:
+        m = _BOUND.search(bound or "")
+        if m:
+            parts.append((name, datetime.datetime.fromisoformat(m.group(1)), datetime.datetime.fromisoformat(m.group(2))))
+        else:
+            parts.append((name, None, None))
+    return sorted(parts, key=lambda p: p[1] or datetime.datetime.min.replace(tzinfo=datetime.timezone.utc))
+
+
+def create_partition(conn, lo: datetime.datetime, hi: datetime.datetime) -> str:
+    name = partition_name(lo)
+    has_default = conn.execute(text("""
+        SELECT 1 FROM pg_partitioned_table p WHERE p.partrelid = to_regclass(:t) AND p.partdefid <> 0
+    """), {"t": TABLE}).first() is not None
+    bounds = f"FOR VALUES FROM ('{lo.isoformat()}') TO ('{hi.isoformat()}')"
+    if not has_default:
+        conn.execute(text(f"CREATE TABLE {name} PARTITION OF {TABLE} {bounds}"))
+        return name
+    # Rows that landed in the default partition for this range have to move first,
+    # or PostgreSQL refuses the new partition
+    conn.execute(text(f"CREATE TABLE {name} (LIKE {TABLE} INCLUDING DEFAULTS)"))
+    moved = conn.execute(text(f"""
+        WITH moved AS (
+            DELETE FROM {TABLE}_default WHERE ts >= :lo AND ts < :hi RETURNING *
+        )
+        INSERT INTO {name} SELECT * FROM moved
+    """), {"lo": lo, "hi": hi}).rowcount
+    conn.execute(text(f"ALTER TABLE {TABLE} ATTACH PARTITION {name} {bounds}"))
+    if moved:
+        print(f"[partitions] moved {moved} rows from {TABLE}_default into {name}")
+    return name
+
+
+def ensure_partitions(engine=None, now: datetime.datetime | None = None) -> list:
+    """Create partitions from the newest existing one up to METRICS_PARTITIONS_AHEAD periods ahead."""
+    engine = engine or default_engine
+    now = now or datetime.datetime.now(datetime.timezone.utc)
+    target = period_start(now)
+    for _ in range(METRICS_PARTITIONS_AHEAD + 1):
+        target = next_period(target)
+    created = []
+    with engine.begin() as conn:
+        if not is_partitioned(conn):
+            return created
+        conn.execute(text("SELECT pg_advisory_xact_lock(hashtext(:k))"), {"k": _LOCK_KEY})
+        conn.execute(text("SET LOCAL lock_timeout = :t"), {"t": PARTITION_LOCK_TIMEOUT})
+        existing = list_partitions(conn)
+        if not any(lo is None for _, lo, _ in existing):
+            # A table made by create_all starts bare; late or far-future samples land here
+            conn.execute(text(f"CREATE TABLE {TABLE}_default PARTITION OF {TABLE} DEFAULT"))
+            created.append(f"{TABLE}_default")
+        uppers = [hi for _, _, hi in existing if hi is not None]
+        lo = max(uppers) if uppers else period_start(now)
+        while lo < target:
+            # After an interval change the first new partition just runs up to the next boundary
+            hi = next_period(lo)
+            created.append(create_partition(conn, lo, hi))
+            lo = hi
+    if created:
+        print(f"[partitions] created {', '.join(created)}")
+    return created
+
+
+def drop_expired_partitions(engine=None, now: datetime.datetime | None = None) -> list:
+    """Drop partitions whose whole range is older than METRICS_RETENTION_DAYS."""
+    if METRICS_RETENTION_DAYS <= 0:
+        return []
+    engine = engine or default_engine
+    now = now or datetime.datetime.now(datetime.timezone.utc)
+    cutoff = now - datetime.timedelta(days=METRICS_RETENTION_DAYS)
+    dropped = []
+    with engine.connect() as conn:
+        if not is_partitioned(conn):
+            return dropped
+        expired = [name for name, _, hi in list_partitions(conn) if hi is not None and hi <= cutoff]
+        conn.rollback()
+    for name in expired:
+        try:
+            # One short transaction per partition; a busy table is retried next run
+            with engine.begin() as conn:
+                conn.execute(text("SET LOCAL lock_timeout = :t"), {"t": PARTITION_LOCK_TIMEOUT})
+                conn.execute(text(f"DROP TABLE IF EXISTS {name}"))
+            dropped.append(name)
+        except Exception as e:
+            print(f"[partitions] could not drop {name}: {e}")
+    # Cached metrics, insights and spend series still include the expired data
+    response_cache.bump(_drop_expired_rollups(engine, cutoff))
+    if dropped:
+        print(f"[partitions] dropped {', '.join(dropped)} (older than {METRICS_RETENTION_DAYS} days)")
+    return dropped
+
+
+def _drop_expired_rollups(engine, cutoff: datetime.datetime) -> list:
+    # Rollups of dropped data would keep counting in totals, row counts and model
+    # drift baselines. Everything below the oldest remaining partition (and the
+    # cutoff) goes, including strays in the DEFAULT partition; partition bounds
+    # are day-aligned, so whole daily buckets are removed. Runs on every pass, so
+    # a failed cleanup is retried. Returns the users whose data was removed.
+    try:
+        with engine.begin() as conn:
+            conn.execute(text("SET LOCAL lock_timeout = :t"), {"t": PARTITION_LOCK_TIMEOUT})
+            lows = [lo for _, lo, _ in list_partitions(conn) if lo is not None]
+            if not lows:
+                return []
+            horizon = min(min(lows), cutoff.replace(hour=0, minute=0, second=0, microsecond=0))
+            users = conn.execute(text("SELECT DISTINCT user_id FROM metric_rollups_daily WHERE bucket < :h"),
+                                 {"h": horizon}).scalars().all()
+            for table in (f"{TABLE}_default", "metric_rollups_hourly", "metric_rollups_daily"):
+                if conn.execute(text("SELECT to_regclass(:t)"), {"t": table}).scalar():
+                    column = "ts" if table.startswith(TABLE) else "bucket"
+                    conn.execute(text(f"DELETE FROM {table} WHERE {column} < :h"), {"h": horizon})
+        return users
+    except Exception as e:
+        print(f"[partitions] could not drop expired rollups, retried next run: {e}")
+        return []
+
+
+def maintain():
+    try:
+        ensure_partitions()
+        drop_expired_partitions()
+    except Exception as e:
+        print(f"[partitions] maintenance error: {e}")
+
+
+if __name__ == "__main__":
+    maintain()
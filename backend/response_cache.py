@@ -0,0 +1,219 @@
+# backend/response_cache.py
+# Per-user cache of dashboard responses, in the Redis instance Celery uses.
+#
+# Keys are (user, data version, endpoint, params). The version is a per-user
+# counter that the metric writers bump after every commit, so an ingest makes
+# all of that user's cached responses unreachable at once without scanning for
+# them; orphaned entries simply expire. A response is stored under the version
+# read *before* it was computed, so a concurrent ingest can never leave stale
+# data under the new version. The same version feeds the dashboard ETags.
+#
+# When Redis is unreachable the cache falls back to a per-process LRU for a
+# while. Versions bumped in other processes (Celery workers) are not visible
+# there, so those entries get the shorter RESPONSE_CACHE_LOCAL_TTL_SECONDS.
+import hashlib, json, os, threading, time
+from collections import OrderedDict, defaultdict
+from fastapi.encoders import jsonable_encoder
+from backend.worker import CELERY_BROKER_URL
+
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "true").lower() == "true"
+RESPONSE_CACHE_URL = os.getenv("RESPONSE_CACHE_URL", CELERY_BROKER_URL)
+RESPONSE_CACHE_TTL_SECONDS = int(os.getenv("RESPONSE_CACHE_TTL_SECONDS", "600"))
+RESPONSE_CACHE_LOCAL_TTL_SECONDS = int(os.getenv("RESPONSE_CACHE_LOCAL_TTL_SECONDS", "60"))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "2048"))  # local LRU only
+REDIS_TIMEOUT_SECONDS = 0.25
+REDIS_RETRY_SECONDS = 30  # after a Redis error, use the local LRU this long
+
+_KEY = "cloud9:cache"
+
+
+class _LocalLRU:
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self._versions = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value, ttl: int):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def version(self, user_id) -> int:
+        with self._lock:
+            return self._versions[user_id]
+
+    def bump(self, user_id):
+        with self._lock:
+            self._versions[user_id] += 1
+
+
+_local = _LocalLRU(RESPONSE_CACHE_MAX_ENTRIES)
+_clients = {}
+_down_until = 0.0
+_stats_lock = threading.Lock()
+_counts = defaultdict(lambda: {"hits": 0, "misses": 0})
+_redis_errors = 0
+
+
+def _redis(kind: str):
+    """Shared sync or asyncio Redis client, or None while Redis is considered down."""
+    if time.monotonic() < _down_until:
+        return None
+    client = _clients.get(kind)
+    if client is None:
+        if kind == "async":
+            from redis import asyncio as redis
+        else:
+            import redis
+        client = _clients[kind] = redis.Redis.from_url(
+            RESPONSE_CACHE_URL, decode_responses=True,
+            socket_timeout=REDIS_TIMEOUT_SECONDS, socket_connect_timeout=REDIS_TIMEOUT_SECONDS,
+        )
+    return client
+
+
+def _redis_failed(e: Exception):
+    global _down_until, _redis_errors
+    with _stats_lock:
+        _redis_errors += 1
+        if time.monotonic() >= _down_until:
+            print(f"[cache] Redis unavailable, using the in-process cache for {REDIS_RETRY_SECONDS}s: {e}")
+        _down_until = time.monotonic() + REDIS_RETRY_SECONDS
+
+
+def _count(endpoint: str, outcome: str):
+    with _stats_lock:
+        _counts[endpoint][outcome] += 1
+
+
+def _version_key(user_id: int) -> str:
+    return f"{_KEY}:ver:{user_id}"
+
+
+def _key(user_id: int, version, endpoint: str, params: dict) -> str:
+    digest = hashlib.sha1(json.dumps(jsonable_encoder(params), sort_keys=True).encode()).hexdigest()[:16]
+    return f"{_KEY}:{user_id}:{version}:{endpoint}:{digest}"
+
+
+async def _version(r, user_id: int) -> str:
+    key = _version_key(user_id)
+    version = await r.get(key)
+    if version is None:
+        # Start a missing counter (new user, flushed Redis) at the clock, so it
+        # never repeats a value handed out before
+        await r.set(key, time.time_ns(), nx=True)
+        version = await r.get(key)
+    return version
+
+
+async def data_version(user_id: int) -> str | None:
+    """The user's data version, or None while Redis is unavailable (no shared version to trust)."""
+    r = _redis("async")
+    if r is None:
+        return None
+    try:
+        return await _version(r, user_id)
+    except Exception as e:
+        _redis_failed(e)
+        return None
+
+
+def etag(user_id: int, version: str, endpoint: str, params: dict) -> str:
+    """Strong ETag for a response computed at ``version``.
+
+    It also rolls over every RESPONSE_CACHE_TTL_SECONDS, which bounds how long a
+    bump lost while Redis was down can keep a stale response validated.
+    """
+    window = int(time.time() // RESPONSE_CACHE_TTL_SECONDS)
+    return '"' + hashlib.sha1(f"{_key(user_id, version, endpoint, params)}:{window}".encode()).hexdigest()[:32] + '"'
+
+
+async def cached(user_id: int, endpoint: str, params: dict, compute, version: str | None = None):
+    """JSON-ready response for (user, endpoint, params), from cache or ``await compute()``.
+
+    ``version`` is a data_version() the caller already read for this request.
+    """
+    if not RESPONSE_CACHE_ENABLED:
+        return await compute()
+    r = _redis("async")
+    key = None
+    if r is not None:
+        try:
+            version = version or await _version(r, user_id)
+            key = _key(user_id, version, endpoint, params)
+            raw = await r.get(key)
+            if raw is not None:
+                _count(endpoint, "hits")
+                return json.loads(raw)
+        except Exception as e:
+            _redis_failed(e)
+            r = None
+    if r is None:
+        key = _key(user_id, f"local{_local.version(user_id)}", endpoint, params)
+        hit = _local.get(key)
+        if hit is not None:
+            _count(endpoint, "hits")
+            return hit
+
+    _count(endpoint, "misses")
+    value = jsonable_encoder(await compute())
+    if r is not None:
+        try:
+            await r.set(key, json.dumps(value), ex=RESPONSE_CACHE_TTL_SECONDS)
+        except Exception as e:
+            _redis_failed(e)
+    else:
+        _local.set(key, value, min(RESPONSE_CACHE_TTL_SECONDS, RESPONSE_CACHE_LOCAL_TTL_SECONDS))
+    return value
+
+
+def bump(user_ids):
+    """Invalidate cached responses and ETags of ``user_ids``; call after their rows are committed."""
+    user_ids = sorted({u for u in user_ids if u is not None})
+    if not user_ids:
+        return
+    for user_id in user_ids:
+        _local.bump(user_id)
+    r = _redis("sync")
+    if r is None:
+        return  # Redis entries age out after RESPONSE_CACHE_TTL_SECONDS
+    try:
+        pipe = r.pipeline(transaction=False)
+        for user_id in user_ids:
+            pipe.set(_version_key(user_id), time.time_ns(), nx=True)
+            pipe.incr(_version_key(user_id))
+        pipe.execute()
+    except Exception as e:
+        _redis_failed(e)
+
+
+def stats() -> dict:
+    with _stats_lock:
+        endpoints = {name: dict(c) for name, c in _counts.items()}
+        errors = _redis_errors
+    hits = sum(c["hits"] for c in endpoints.values())
+    misses = sum(c["misses"] for c in endpoints.values())
+    for c in endpoints.values():
+        c["hit_ratio"] = round(c["hits"] / (c["hits"] + c["misses"]), 3) if c["hits"] + c["misses"] else 0.0
+    return {
+        "enabled": RESPONSE_CACHE_ENABLED,
+        "backend": "local" if time.monotonic() < _down_until else "redis",
+        "hits": hits, "misses": misses,
+        "hit_ratio": round(hits / (hits + misses), 3) if hits + misses else 0.0,
+        "redis_errors": errors,
+        "endpoints": endpoints,
+    }
@@ -0,0 +1,195 @@
+# backend/rollups.py
+# Hourly and daily rollups of cloud_metrics for the dashboard endpoints.
+#
+# Rollups are recomputed from the raw rows rather than adjusted by deltas, so
+# duplicates, on_conflict="update" overwrites and replays can't skew them. The
+# unit of work is a (user, provider, hour): the metric writer refreshes the
+# hours a chunk touched inside the chunk's own transaction, then the days those
+# hours belong to are re-summed from the hourly table. A periodic compaction
+# recomputes the recent window as a safety net for rows written around the
+# writer (manual SQL, restores).
+#
+#   python -m backend.rollups [--since 2024-01-01] [--until ...] [--user-id N]
+import argparse, datetime, os
+from sqlalchemy import and_, func, select, text
+from backend.database import engine as default_engine
+from backend.models import CloudMetric, MetricRollupHourly, MetricRollupDaily
+from backend import response_cache
+
+HOURLY = MetricRollupHourly.__tablename__
+DAILY = MetricRollupDaily.__tablename__
+ROLLUP_COMPACT_HOURS = int(os.getenv("ROLLUP_COMPACT_HOURS", "48"))
+ROLLUP_REFRESH_BATCH = 2000  # (user, provider, hour) keys per statement
+
+# Dashboard formulas, applied per sample
+IDLE_CPU_PCT = 10
+IDLE_MEMORY_PCT = 10
+SPEND_PER_UNIT = 10.0  # (cpu% + memory%) * this
+
+_SOURCES = {
+    "cpu": "m.cpu_usage",
+    "memory": "m.memory_usage",
+    "network": "m.network_traffic",
+    "spend": f"(coalesce(m.cpu_usage, 0) + coalesce(m.memory_usage, 0)) * {SPEND_PER_UNIT}",
+}
+_VALUE_COLUMNS = ["samples", "idle_samples"] + [f"{m}_{agg}" for m in _SOURCES for agg in ("sum", "min", "max")]
+_UPDATE = ", ".join(f"{c} = EXCLUDED.{c}" for c in _VALUE_COLUMNS)
+_COLUMNS = "user_id, provider, vm_id, bucket, " + ", ".join(_VALUE_COLUMNS)
+_KEYS = ("unnest(CAST(:uids AS integer[]), CAST(:providers AS text[]), CAST(:buckets AS timestamptz[])) "
+         "AS k(user_id, provider, bucket)")
+
+REFRESH_HOURLY = text(f"""
+    INSERT INTO {HOURLY} ({_COLUMNS})
+    SELECT m.user_id, m.provider, coalesce(m.vm_id, ''), k.bucket, count(*),
+           count(*) FILTER (WHERE coalesce(m.cpu_usage, 0) < {IDLE_CPU_PCT} AND coalesce(m.memory_usage, 0) < {IDLE_MEMORY_PCT}),
+           {", ".join(f"coalesce(sum({src}), 0), min({src}), max({src})" for src in _SOURCES.values())}
+    FROM {_KEYS}
+    JOIN cloud_metrics m ON m.user_id = k.user_id AND m.provider = k.provider
+         AND m.ts >= k.bucket AND m.ts < k.bucket + interval '1 hour'
+    GROUP BY m.user_id, m.provider, coalesce(m.vm_id, ''), k.bucket
+    ON CONFLICT (user_id, provider, vm_id, bucket) DO UPDATE SET {_UPDATE}
+""")
+
+REFRESH_DAILY = text(f"""
+    INSERT INTO {DAILY} ({_COLUMNS})
+    SELECT h.user_id, h.provider, h.vm_id, k.bucket, sum(h.samples), sum(h.idle_samples),
+           {", ".join(f"sum(h.{m}_sum), min(h.{m}_min), max(h.{m}_max)" for m in _SOURCES)}
+    FROM {_KEYS}
+    JOIN {HOURLY} h ON h.user_id = k.user_id AND h.provider = k.provider
+         AND h.bucket >= k.bucket AND h.bucket < k.bucket + interval '1 day'
+    GROUP BY h.user_id, h.provider, h.vm_id, k.bucket
+    ON CONFLICT (user_id, provider, vm_id, bucket) DO UPDATE SET {_UPDATE}
+""")
+
+
+def _utc(ts: datetime.datetime) -> datetime.datetime:
+    return ts.astimezone(datetime.timezone.utc) if ts.tzinfo else ts.replace(tzinfo=datetime.timezone.utc)
+
+
+def hour_of(ts: datetime.datetime) -> datetime.datetime:
+    return _utc(ts).replace(minute=0, second=0, microsecond=0)
+
+
+def touched(rows) -> set:
+    """(user_id, provider, hour) keys for rows that carry a parsed ts."""
+    return {(r["user_id"], r["provider"], hour_of(r["ts"])) for r in rows
+            if r.get("ts") is not None and r.get("user_id") is not None and r.get("provider") is not None}
+
+
+def _params(keys):
+    uids, providers, buckets = zip(*keys)
+    return {"uids": list(uids), "providers": list(providers), "buckets": list(buckets)}
+
+
+def refresh(conn, keys) -> None:
+    """Recompute the given hours and their days. Call inside the writing transaction."""
+    dialect = conn.dialect if hasattr(conn, "dialect") else conn.get_bind().dialect  # Connection or Session
+    if not keys or dialect.name != "postgresql":
+        return
+    keys = sorted(keys)
+    # Writers for the same user take turns, so each recompute sees the other's rows;
+    # ascending order keeps two multi-user chunks from deadlocking
+    for uid in sorted({k[0] for k in keys}):
+        conn.execute(text("SELECT pg_advisory_xact_lock(hashtext('cloud9:rollups'), :uid)"), {"uid": uid})
+    for i in range(0, len(keys), ROLLUP_REFRESH_BATCH):
+        conn.execute(REFRESH_HOURLY, _params(keys[i:i + ROLLUP_REFRESH_BATCH]))
+    days = sorted({(u, p, h.replace(hour=0)) for u, p, h in keys})
+    for i in range(0, len(days), ROLLUP_REFRESH_BATCH):
+        conn.execute(REFRESH_DAILY, _params(days[i:i + ROLLUP_REFRESH_BATCH]))
+
+
+def hours_with_data(conn, since: datetime.datetime, until: datetime.datetime, user_id: int | None = None) -> list:
+    """Sorted (user_id, provider, hour) keys that have raw rows in [since, until)."""
+    keys = conn.execute(text("""
+        SELECT DISTINCT user_id, provider, date_trunc('hour', ts AT TIME ZONE 'UTC') AT TIME ZONE 'UTC'
+        FROM cloud_metrics
+        WHERE ts >= :since AND ts < :until AND user_id IS NOT NULL AND provider IS NOT NULL
+          AND (CAST(:uid AS integer) IS NULL OR user_id = :uid)
+    """), {"since": since, "until": until, "uid": user_id}).all()
+    return sorted({(u, p, hour_of(h)) for u, p, h in keys})
+
+
+def compact(engine=None, since: datetime.datetime | None = None, until: datetime.datetime | None = None,
+            user_id: int | None = None) -> int:
+    """Recompute every hour that has raw rows in [since, until); returns hours refreshed."""
+    engine = engine or default_engine
+    until = until or datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(hours=1)
+    since = since or until - datetime.timedelta(hours=ROLLUP_COMPACT_HOURS)
+    with engine.connect() as conn:
+        keys = hours_with_data(conn, since, until, user_id)
+    for i in range(0, len(keys), ROLLUP_REFRESH_BATCH):
+        with engine.begin() as conn:
+            refresh(conn, keys[i:i + ROLLUP_REFRESH_BATCH])
+        # Responses cached from the old rollups may differ from the recomputed ones
+        response_cache.bump(k[0] for k in keys[i:i + ROLLUP_REFRESH_BATCH])
+    if keys:
+        print(f"[rollups] recomputed {len(keys)} hourly buckets from {since:%Y-%m-%d %H:%M} to {until:%Y-%m-%d %H:%M}")
+    return len(keys)
+
+
+def totals_query(user_id: int, provider: str | None = None, since: datetime.datetime | None = None,
+                 until: datetime.datetime | None = None):
+    """One aggregate statement yielding (samples, idle_samples, cpu_sum, memory_sum).
+
+    Reads the coarsest table that is still exact for the bounds: daily rollups
+    for whole days, hourly ones for whole hours, raw rows otherwise.
+    """
+    since, until = (_utc(b) if b is not None else None for b in (since, until))
+    bounds = [b for b in (since, until) if b is not None]
+    if all(b == hour_of(b).replace(hour=0) for b in bounds):
+        source = MetricRollupDaily
+    elif all(b == hour_of(b) for b in bounds):
+        source = MetricRollupHourly
+    else:
+        source = None
+
+    if source is not None:
+        stmt = select(func.coalesce(func.sum(source.samples), 0), func.coalesce(func.sum(source.idle_samples), 0),
+                      func.coalesce(func.sum(source.cpu_sum), 0.0), func.coalesce(func.sum(source.memory_sum), 0.0))
+        ts = source.bucket
+    else:
+        m = CloudMetric
+        idle = and_(func.coalesce(m.cpu_usage, 0) < IDLE_CPU_PCT, func.coalesce(m.memory_usage, 0) < IDLE_MEMORY_PCT)
+        stmt = select(func.count(), func.count().filter(idle),
+                      func.coalesce(func.sum(m.cpu_usage), 0.0), func.coalesce(func.sum(m.memory_usage), 0.0))
+        source, ts = m, m.ts
+    stmt = stmt.where(source.user_id == user_id)
+    if provider:
+        stmt = stmt.where(source.provider == provider)
+    if since is not None:
+        stmt = stmt.where(ts >= since)
+    if until is not None:
+        stmt = stmt.where(ts < until)
+    return stmt
+
+
+def totals_row(row) -> tuple:
+    n, idle_n, cpu, mem = row
+    return int(n), int(idle_n), float(cpu), float(mem)
+
+
+def totals(db, user_id: int, provider: str | None = None, since: datetime.datetime | None = None,
+           until: datetime.datetime | None = None) -> tuple:
+    return totals_row(db.execute(totals_query(user_id, provider, since, until)).one())
+
+
+def maintain():
+    try:
+        compact()
+    except Exception as e:
+        print(f"[rollups] compaction error: {e}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rebuild metric rollups from cloud_metrics")
+    parser.add_argument("--since", type=datetime.datetime.fromisoformat, help="default: ROLLUP_COMPACT_HOURS ago")
+    parser.add_argument("--until", type=datetime.datetime.fromisoformat, help="default: now")
+    parser.add_argument("--user-id", type=int)
+    args = parser.parse_args()
+    since = _utc(args.since) if args.since else None
+    until = _utc(args.until) if args.until else None
+    compact(since=since, until=until, user_id=args.user_id)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,15 @@
 # schemas.py
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, field_validator
 from typing import Optional, List
+from datetime import datetime, timezone
+
+
+def parse_timestamp(value: str) -> datetime:
+    """ISO-8601 string -> aware UTC datetime; strings without an offset are UTC."""
+    ts = datetime.fromisoformat(value.strip().replace("z", "Z").replace("Z", "+00:00"))
+    if ts.tzinfo is None:
+        return ts.replace(tzinfo=timezone.utc)
+    return ts.astimezone(timezone.utc)
 
 # -------- AUTH SCHEMAS --------
 class UserCreate(BaseModel):
@@ -63,6 +72,12 @@ class MetricIn(BaseModel):
     execution_time: Optional[float] = 0.0
     task_type: Optional[str] = "general"
 
+    @field_validator("timestamp")
+    @classmethod
+    def timestamp_is_iso(cls, v: str) -> str:
+        parse_timestamp(v)  # raises ValueError -> 422
+        return v
+
 class MetricBatchIn(BaseModel):
     items: List[MetricIn]
 
@@ -0,0 +1,239 @@
+# backend/snapshots.py
+# Columnar per-tenant snapshots of cloud_metrics for training and bulk analysis.
+#
+# Layout (hive-style, readable by any Parquet/Arrow tool):
+#   METRIC_SNAPSHOT_DIR/user_<id>/provider=<p>/date=<YYYY-MM-DD>/part-0.parquet
+#
+# The unit is one (provider, day) file. An export pass compares each day's sample
+# count from the daily rollups against the count recorded when the file was
+# written and rewrites only days that changed, so late backfills and
+# de-duplication are picked up without rescanning history. The newest days are
+# always rewritten since they are still filling. Files are replaced atomically.
+# Days that left the rollups (partition retention) are deleted, and so are the
+# snapshots of tenants that have no rollups at all any more (deleted users).
+#
+#   python -m backend.snapshots [--user-id N]
+import argparse, datetime, json, os, shutil
+import numpy as np
+from sqlalchemy import func, select
+from backend.database import engine as default_engine
+from backend.models import CloudMetric, MetricRollupDaily
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.dataset as ds
+    import pyarrow.fs as pafs
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pc = ds = pafs = pq = None
+
+METRIC_SNAPSHOT_DIR = os.getenv("METRIC_SNAPSHOT_DIR", "snapshots")
+SNAPSHOT_INTERVAL_MINUTES = int(os.getenv("SNAPSHOT_INTERVAL_MINUTES", "60"))
+SNAPSHOT_REFRESH_DAYS = 2  # today and yesterday are rewritten on every pass
+STATE_FILE = "_state.json"
+
+COLUMNS = [
+    "id", "vm_id", "ts", "cpu_usage", "memory_usage", "network_traffic",
+    "power_consumption", "execution_time", "task_type", "region", "instance_state",
+]
+FEATURES = ["cpu_usage", "memory_usage", "execution_time", "network_traffic", "power_consumption"]
+
+
+def available() -> bool:
+    return pa is not None
+
+
+def _schema():
+    return pa.schema([
+        ("id", pa.int64()), ("vm_id", pa.string()), ("ts", pa.timestamp("us", tz="UTC")),
+        ("cpu_usage", pa.float64()), ("memory_usage", pa.float64()), ("network_traffic", pa.float64()),
+        ("power_consumption", pa.float64()), ("execution_time", pa.float64()),
+        ("task_type", pa.string()), ("region", pa.string()), ("instance_state", pa.string()),
+    ])
+
+
+def user_dir(user_id: int) -> str:
+    return os.path.join(METRIC_SNAPSHOT_DIR, f"user_{user_id}")
+
+
+def _read_state(user_id: int) -> dict:
+    try:
+        with open(os.path.join(user_dir(user_id), STATE_FILE)) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def _write_state(user_id: int, state: dict):
+    path = os.path.join(user_dir(user_id), STATE_FILE)
+    tmp = os.path.join(user_dir(user_id), f".{STATE_FILE}.tmp")
+    with open(tmp, "w") as f:
+        json.dump(state, f)
+    os.replace(tmp, path)
+
+
+def _write_day(conn, user_id: int, provider: str, day: datetime.date) -> int:
+    lo = datetime.datetime.combine(day, datetime.time(), tzinfo=datetime.timezone.utc)
+    stmt = (
+        select(*(getattr(CloudMetric, c) for c in COLUMNS))
+        .where(CloudMetric.user_id == user_id, CloudMetric.provider == provider,
+               CloudMetric.ts >= lo, CloudMetric.ts < lo + datetime.timedelta(days=1))
+        .order_by(CloudMetric.ts, CloudMetric.id)
+    )
+    rows = conn.execute(stmt).all()
+    columns = list(zip(*rows)) if rows else [[] for _ in COLUMNS]
+    table = pa.Table.from_arrays([pa.array(col, type=f.type) for col, f in zip(columns, _schema())], schema=_schema())
+    part_dir = os.path.join(user_dir(user_id), f"provider={provider}", f"date={day.isoformat()}")
+    os.makedirs(part_dir, exist_ok=True)
+    tmp = os.path.join(part_dir, ".part-0.parquet.tmp")  # dot files are skipped by readers
+    pq.write_table(table, tmp, compression="zstd")
+    os.replace(tmp, os.path.join(part_dir, "part-0.parquet"))  # readers see the old file or the new one
+    return len(rows)
+
+
+def _prune_days(user_id: int, keep: set, state: dict) -> int:
+    """Delete day files whose "provider/date" is not in ``keep``; returns how many."""
+    removed = 0
+    root = user_dir(user_id)
+    for provider_dir in os.listdir(root) if os.path.isdir(root) else []:
+        if not provider_dir.startswith("provider="):
+            continue
+        for date_dir in os.listdir(os.path.join(root, provider_dir)):
+            key = f"{provider_dir[len('provider='):]}/{date_dir[len('date='):]}"
+            if date_dir.startswith("date=") and key not in keep:
+                shutil.rmtree(os.path.join(root, provider_dir, date_dir), ignore_errors=True)
+                state.pop(key, None)
+                removed += 1
+    return removed
+
+
+def export_user(user_id: int, engine=None) -> int:
+    """Bring one tenant's snapshot up to date; returns the number of day files written."""
+    if not available():
+        return 0
+    engine = engine or default_engine
+    state = _read_state(user_id)
+    fresh_from = datetime.datetime.now(datetime.timezone.utc).date() - datetime.timedelta(days=SNAPSHOT_REFRESH_DAYS - 1)
+    written = 0
+    with engine.connect() as conn:
+        days = conn.execute(
+            select(MetricRollupDaily.provider, MetricRollupDaily.bucket, func.sum(MetricRollupDaily.samples))
+            .where(MetricRollupDaily.user_id == user_id)
+            .group_by(MetricRollupDaily.provider, MetricRollupDaily.bucket)
+        ).all()
+        keep = set()
+        for provider, bucket, samples in days:
+            day = bucket.astimezone(datetime.timezone.utc).date()
+            key = f"{provider}/{day.isoformat()}"
+            keep.add(key)
+            if state.get(key) == samples and day < fresh_from:
+                continue
+            _write_day(conn, user_id, provider, day)
+            state[key] = samples
+            written += 1
+        conn.rollback()
+    # Expired days must not outlive the database rows they were written from
+    removed = _prune_days(user_id, keep, state)
+    if written or removed:
+        _write_state(user_id, state)
+    return written
+
+
+def export_all(engine=None) -> int:
+    if not available():
+        print("[snapshots] pyarrow is not installed; skipping export")
+        return 0
+    engine = engine or default_engine
+    with engine.connect() as conn:
+        users = conn.execute(select(MetricRollupDaily.user_id).distinct()).scalars().all()
+    written = 0
+    for user_id in users:
+        try:
+            written += export_user(user_id, engine)
+        except Exception as e:
+            print(f"[snapshots] user {user_id}: {e}")
+    # Tenants without any rollups left were deleted or had all their data expire
+    live = {f"user_{user_id}" for user_id in users}
+    gone = [d for d in os.listdir(METRIC_SNAPSHOT_DIR) if d.startswith("user_") and d not in live] \
+        if os.path.isdir(METRIC_SNAPSHOT_DIR) else []
+    for d in gone:
+        shutil.rmtree(os.path.join(METRIC_SNAPSHOT_DIR, d), ignore_errors=True)
+    if written or gone:
+        print(f"[snapshots] wrote {written} day files for {len(users)} tenants, removed {len(gone)} stale tenants")
+    return written
+
+
+def dataset(user_id: int):
+    """The tenant's snapshot as a pyarrow Dataset, or None when there is nothing yet."""
+    if not available() or not os.path.isdir(user_dir(user_id)):
+        return None
+    partitioning = ds.partitioning(pa.schema([("provider", pa.string()), ("date", pa.string())]), flavor="hive")
+    # Memory-mapped reads: pages come straight from the OS cache, no read() copies
+    return ds.dataset(os.path.abspath(user_dir(user_id)), format="parquet", partitioning=partitioning,
+                      filesystem=pafs.LocalFileSystem(use_mmap=True))
+
+
+def load_table(user_id: int, columns=None, provider: str | None = None,
+               since: datetime.date | None = None, until: datetime.date | None = None):
+    """Arrow table of the tenant's samples; provider/date filters prune whole files."""
+    data = dataset(user_id)
+    if data is None:
+        return None
+    expr = None
+    for cond in (
+        ds.field("provider") == provider if provider else None,
+        ds.field("date") >= since.isoformat() if since else None,
+        ds.field("date") < until.isoformat() if until else None,
+    ):
+        if cond is not None:
+            expr = cond if expr is None else expr & cond
+    # date partitions are ISO strings, which compare in date order
+    return data.to_table(columns=columns, filter=expr)
+
+
+def load_frame(user_id: int, columns=None, **filters):
+    """pandas DataFrame view of load_table; columns are handed over without an extra copy."""
+    table = load_table(user_id, columns, **filters)
+    if table is None:
+        return None
+    return table.to_pandas(split_blocks=True, self_destruct=True)
+
+
+def load_matrix(user_id: int, columns=FEATURES, newest: int | None = None,
+                since: datetime.date | None = None) -> np.ndarray | None:
+    """(n, len(columns)) float matrix with missing values as 0, for model training.
+
+    With ``newest``, only the newest that many samples, oldest first.
+    """
+    table = load_table(user_id, columns if newest is None else [*columns, "ts", "id"], since=since)
+    if table is None or table.num_rows == 0:
+        return None
+    if newest is not None:
+        order = pc.sort_indices(table, sort_keys=[("ts", "ascending"), ("id", "ascending")])
+        table = table.take(order[-newest:])
+    out = np.empty((table.num_rows, len(columns)), dtype=np.float64, order="F")
+    for i, name in enumerate(columns):
+        out[:, i] = table.column(name).fill_null(0.0).to_numpy()
+    return out
+
+
+def maintain():
+    try:
+        export_all()
+    except Exception as e:
+        print(f"[snapshots] export error: {e}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export per-tenant Parquet snapshots of cloud_metrics")
+    parser.add_argument("--user-id", type=int)
+    args = parser.parse_args()
+    if args.user_id:
+        print(f"[snapshots] wrote {export_user(args.user_id)} day files")
+    else:
+        export_all()
+
+
+if __name__ == "__main__":
+    main()
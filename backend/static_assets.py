@@ -0,0 +1,174 @@
+# backend/static_assets.py
+# Serves the React production build (frontend_build/).
+#
+# Compressible files are precompressed next to the originals (.gz, plus .br
+# when the brotli package is installed), at image build time or at startup;
+# variants that are already newer than their source are left alone. The build
+# is indexed once at startup, so a request is a dict lookup with no stat calls,
+# answered with the best variant the client's Accept-Encoding allows.
+# index.html, the SPA shell that also answers client-side routes, is held in
+# memory. Fingerprinted files (name.<hash>.ext, as CRA emits them) are cached
+# as immutable for a year; everything else must revalidate.
+#
+#   python -m backend.static_assets frontend_build
+import argparse, gzip, hashlib, mimetypes, os, re
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse, PlainTextResponse, Response
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+STATIC_PRECOMPRESS = os.getenv("STATIC_PRECOMPRESS", "true").lower() == "true"
+STATIC_COMPRESS_MIN_BYTES = int(os.getenv("STATIC_COMPRESS_MIN_BYTES", "1024"))
+COMPRESSIBLE = {".html", ".js", ".mjs", ".css", ".json", ".map", ".svg", ".txt", ".xml", ".ico", ".webmanifest"}
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))  # server preference order
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"
+_FINGERPRINT = re.compile(r"\.[0-9a-f]{8,}\.")
+
+
+def _compressors():
+    out = [(".gz", lambda data: gzip.compress(data, 9, mtime=0))]
+    if brotli is not None:
+        out.append((".br", lambda data: brotli.compress(data, quality=11)))
+    return out
+
+
+def precompress(directory: str) -> int:
+    """Write missing or outdated .gz/.br variants; returns the number of files written."""
+    written = 0
+    for root, _, files in os.walk(directory):
+        for name in files:
+            path = os.path.join(root, name)
+            if name.startswith(".") or os.path.splitext(name)[1].lower() not in COMPRESSIBLE:
+                continue
+            source = os.stat(path)
+            if source.st_size < STATIC_COMPRESS_MIN_BYTES:
+                continue
+            data = None
+            for suffix, compress in _compressors():
+                target = path + suffix
+                if os.path.exists(target) and os.stat(target).st_mtime >= source.st_mtime:
+                    continue
+                if data is None:
+                    with open(path, "rb") as f:
+                        data = f.read()
+                blob = compress(data)
+                if len(blob) >= len(data):
+                    if os.path.exists(target):
+                        os.remove(target)  # stale variant of a file that no longer compresses
+                    continue
+                # Per-process temp name: every uvicorn worker runs this at startup
+                tmp = os.path.join(root, f".{name}{suffix}.{os.getpid()}.tmp")
+                with open(tmp, "wb") as f:
+                    f.write(blob)
+                os.replace(tmp, target)
+                written += 1
+    return written
+
+
+def _etag(st: os.stat_result) -> str:
+    return '"' + hashlib.md5(f"{st.st_mtime}-{st.st_size}".encode(), usedforsecurity=False).hexdigest() + '"'
+
+
+def _index(directory: str) -> dict:
+    """URL path -> {"media_type", "cache_control", "variants": {encoding: (path, stat, etag)}}."""
+    assets = {}
+    for root, _, files in os.walk(directory):
+        names = set(files)
+        for name in files:
+            if name.startswith(".") or any(name.endswith(s) and name[:-len(s)] in names for _, s in ENCODINGS):
+                continue
+            path = os.path.join(root, name)
+            st = os.stat(path)
+            variants = {"identity": (path, st, _etag(st))}
+            for encoding, suffix in ENCODINGS:
+                if name + suffix in names:
+                    vst = os.stat(path + suffix)
+                    if vst.st_mtime >= st.st_mtime:  # never serve a variant of an older build
+                        variants[encoding] = (path + suffix, vst, _etag(vst))
+            url = "/" + os.path.relpath(path, directory).replace(os.sep, "/")
+            assets[url] = {
+                "media_type": mimetypes.guess_type(name)[0] or "application/octet-stream",
+                "cache_control": IMMUTABLE if _FINGERPRINT.search(name) else REVALIDATE,
+                "variants": variants,
+            }
+    return assets
+
+
+def _negotiate(header: str, available) -> str:
+    """Preferred encoding in ``available`` that Accept-Encoding allows, else "identity"."""
+    accepted, refused = set(), set()
+    for part in header.split(","):
+        name, _, params = part.partition(";")
+        q = params.replace(" ", "").lower()
+        try:
+            zero = q.startswith("q=") and float(q[2:]) == 0
+        except ValueError:
+            zero = True
+        (refused if zero else accepted).add(name.strip().lower())
+    for encoding, _ in ENCODINGS:
+        if encoding in available and encoding not in refused and (encoding in accepted or "*" in accepted):
+            return encoding
+    return "identity"
+
+
+class FrontendApp:
+    """ASGI app for a built frontend directory. Mount it last, at "/"."""
+
+    def __init__(self, directory: str):
+        self.directory = os.path.abspath(directory)
+        if STATIC_PRECOMPRESS:
+            written = precompress(self.directory)
+            if written:
+                print(f"[static] precompressed {written} files in {self.directory}")
+        self.assets = _index(self.directory)
+        self.shell = self.assets.get("/index.html")
+        self.shell_bodies = {}
+        if self.shell:
+            for encoding, (path, _, _) in self.shell["variants"].items():
+                with open(path, "rb") as f:
+                    self.shell_bodies[encoding] = f.read()
+
+    async def __call__(self, scope, receive, send):
+        if scope["method"] not in ("GET", "HEAD"):
+            response = PlainTextResponse("Method Not Allowed", status_code=405, headers={"Allow": "GET, HEAD"})
+        else:
+            response = self.response(scope)
+        await response(scope, receive, send)
+
+    def response(self, scope) -> Response:
+        path = scope["path"]
+        asset = self.assets.get(path)
+        if asset is None:
+            if "." in path.rsplit("/", 1)[-1]:
+                return PlainTextResponse("Not Found", status_code=404)  # a missing file, not a route
+            asset = self.shell  # client-side route
+            if asset is None:
+                return PlainTextResponse("Frontend build not found", status_code=404)
+
+        headers = Headers(scope=scope)
+        encoding = _negotiate(headers.get("accept-encoding", ""), asset["variants"])
+        file_path, st, etag = asset["variants"][encoding]
+        out = {"cache-control": asset["cache_control"], "vary": "Accept-Encoding", "etag": etag}
+        if etag in (t.strip().removeprefix("W/") for t in headers.get("if-none-match", "").split(",")):
+            return Response(status_code=304, headers=out)
+        if encoding != "identity":
+            out["content-encoding"] = encoding
+        if asset is self.shell:
+            return Response(self.shell_bodies[encoding], media_type=asset["media_type"], headers=out)
+        return FileResponse(file_path, stat_result=st, media_type=asset["media_type"], headers=out)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Precompress a frontend build for backend.static_assets")
+    parser.add_argument("directory")
+    args = parser.parse_args()
+    print(f"[static] precompressed {precompress(args.directory)} files"
+          + ("" if brotli else " (gzip only: brotli is not installed)"))
+
+
+if __name__ == "__main__":
+    main()
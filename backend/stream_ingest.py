@@ -0,0 +1,180 @@
+# backend/stream_ingest.py
+# Incremental decoding of streamed metric uploads: the request body is
+# decompressed and split into records as it arrives, validated one record at a
+# time, and handed out in bounded chunks, so memory stays flat regardless of
+# payload size. NDJSON is always supported; msgpack needs the optional package.
+import os, zlib
+from pydantic import ValidationError
+from backend import schemas
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+STREAM_CHUNK_ROWS = int(os.getenv("STREAM_INGEST_CHUNK_ROWS", "5000"))
+STREAM_MAX_LINE_BYTES = int(os.getenv("STREAM_INGEST_MAX_LINE_BYTES", str(64 * 1024)))
+MAX_ERRORS_PER_CHUNK = 5
+DECODE_PIECE_BYTES = 64 * 1024  # most decompressed output held at once
+
+NDJSON_TYPES = {"application/x-ndjson", "application/ndjson", "application/jsonl", "application/json-seq", "text/plain"}
+MSGPACK_TYPES = {"application/msgpack", "application/x-msgpack"}
+
+
+class UnsupportedPayload(Exception):
+    pass
+
+
+class CorruptPayload(Exception):
+    pass
+
+
+class PayloadTooLarge(CorruptPayload):
+    pass
+
+
+class _Gunzip:
+    # Handles concatenated gzip members, which is what appending agents produce
+    def __init__(self):
+        self._d = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+    def feed(self, data: bytes):
+        """Yields what ``data`` decompresses to, DECODE_PIECE_BYTES at most at a time."""
+        while True:
+            out = self._d.decompress(data, DECODE_PIECE_BYTES)
+            if out:
+                yield out
+            data = self._d.unconsumed_tail
+            if self._d.eof:
+                data = self._d.unused_data
+                if not data:
+                    return
+                self._d = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            elif not data and len(out) < DECODE_PIECE_BYTES:
+                return  # input used up and no output left buffered
+
+    def flush(self) -> bytes:
+        return self._d.flush()
+
+
+async def _decoded(body, encoding: str):
+    gunzip = None
+    first = True
+    async for data in body:
+        if first:
+            # Some agents gzip without setting Content-Encoding; sniff the magic bytes
+            if "gzip" in encoding or data[:2] == b"\x1f\x8b":
+                gunzip = _Gunzip()
+            first = False
+        if gunzip:
+            for piece in gunzip.feed(data):
+                yield piece
+        elif data:
+            yield data
+    if gunzip:
+        tail = gunzip.flush()
+        if tail:
+            yield tail
+
+
+async def _ndjson_records(stream):
+    """Yields (line_no, bytes | Exception) for every non-empty line.
+
+    At most STREAM_MAX_LINE_BYTES of a line are ever buffered: the length is
+    checked before each piece is kept, and the rest of a runaway line is dropped
+    up to its newline.
+    """
+    pending, pending_len = [], 0
+    line_no = 0
+    oversized = False
+    async for data in stream:
+        start = 0
+        while True:
+            end = data.find(b"\n", start)
+            piece = data[start:] if end < 0 else data[start:end]
+            if not oversized and pending_len + len(piece) > STREAM_MAX_LINE_BYTES:
+                pending, pending_len, oversized = [], 0, True
+            if end < 0:
+                if not oversized and piece:
+                    pending.append(piece)
+                    pending_len += len(piece)
+                break
+            line_no += 1
+            if oversized:
+                yield line_no, ValueError(f"line exceeds {STREAM_MAX_LINE_BYTES} bytes")
+            else:
+                line = b"".join(pending) + piece if pending else piece
+                if line.strip():
+                    yield line_no, line
+            pending, pending_len, oversized = [], 0, False
+            start = end + 1
+    if oversized:
+        yield line_no + 1, ValueError(f"line exceeds {STREAM_MAX_LINE_BYTES} bytes")
+    elif pending:
+        line = b"".join(pending)
+        if line.strip():
+            yield line_no + 1, line
+
+
+async def _msgpack_records(stream):
+    max_buffer = STREAM_MAX_LINE_BYTES * 16
+    unpacker = msgpack.Unpacker(raw=False, max_buffer_size=max_buffer)
+    n, fed, end = 0, 0, 0
+    try:
+        async for data in stream:
+            unpacker.feed(data)
+            fed += len(data)
+            for obj in unpacker:
+                n += 1
+                end = unpacker.tell()  # tell() moves on while a partial record is parsed
+                yield n, obj
+    except msgpack.BufferFull:
+        raise PayloadTooLarge(f"msgpack record larger than {max_buffer} bytes after record {n}")
+    except (msgpack.UnpackException, ValueError) as e:
+        # FormatError, StackError, ExtraData: the stream can't be resynchronized
+        raise CorruptPayload(f"corrupt msgpack body at record {n + 1}: {type(e).__name__} {e}".rstrip())
+    if end < fed:
+        raise CorruptPayload(f"msgpack body ends inside record {n + 1}")
+
+
+def _validate(record):
+    if isinstance(record, Exception):
+        raise record
+    if isinstance(record, (bytes, str)):
+        return schemas.MetricIn.model_validate_json(record)
+    return schemas.MetricIn.model_validate(record)
+
+
+def _describe(e: Exception) -> str:
+    if isinstance(e, ValidationError):
+        err = e.errors()[0]
+        loc = ".".join(str(p) for p in err.get("loc", ()))
+        return f"{loc}: {err['msg']}" if loc else err["msg"]
+    return str(e)
+
+
+async def iter_chunks(body, content_type: str, content_encoding: str, user_id: int, chunk_rows: int = STREAM_CHUNK_ROWS):
+    """Yields (rows, rejected, errors) per chunk of at most ``chunk_rows`` records."""
+    media = (content_type or "application/x-ndjson").split(";")[0].strip().lower()
+    if media in MSGPACK_TYPES:
+        if msgpack is None:
+            raise UnsupportedPayload("msgpack payloads need the msgpack package installed")
+        records = _msgpack_records(_decoded(body, (content_encoding or "").lower()))
+    elif media in NDJSON_TYPES:
+        records = _ndjson_records(_decoded(body, (content_encoding or "").lower()))
+    else:
+        raise UnsupportedPayload(f"unsupported content type {media!r}; send application/x-ndjson or application/msgpack")
+
+    rows, rejected, errors = [], 0, []
+    async for n, record in records:
+        try:
+            rows.append(dict(_validate(record).model_dump(), user_id=user_id))
+        except (ValidationError, ValueError, TypeError) as e:
+            rejected += 1
+            if len(errors) < MAX_ERRORS_PER_CHUNK:
+                errors.append({"record": n, "error": _describe(e)})
+        if len(rows) + rejected >= chunk_rows:
+            yield rows, rejected, errors
+            rows, rejected, errors = [], 0, []
+    if rows or rejected:
+        yield rows, rejected, errors
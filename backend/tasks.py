@@ -1,6 +1,51 @@
 # backend/tasks.py
+import random, time, uuid
+from celery.exceptions import SoftTimeLimitExceeded
+from celery.signals import task_revoked
+
 from backend.worker import celery
+from backend.database import SessionLocal
+from backend.cloud_ingestors import ingest_aws, ingest_gcp, ingest_azure
+from backend import ingest_scheduler, model_registry
+
+INGESTORS = {"aws": ingest_aws, "gcp": ingest_gcp, "azure": ingest_azure}
 
 @celery.task
 def sample_task(x, y):
-    return x + y
\ No newline at end of file
+    return x + y
+
+@celery.task(bind=True, max_retries=None, acks_late=True)
+def ingest_provider(self, user_id: int, provider: str, cycle_id: str):
+    token = self.request.id or uuid.uuid4().hex
+    if not ingest_scheduler.acquire_slot(provider, token):
+        # Provider is at its concurrency cap; requeue with jitter instead of blocking a worker
+        raise self.retry(countdown=ingest_scheduler.SLOT_RETRY_SECONDS + random.random() * 5)
+
+    ingest_scheduler.mark_running(user_id, provider, cycle_id)
+    started = time.monotonic()
+    ok, added = False, 0
+    try:
+        with SessionLocal() as db:
+            added = INGESTORS[provider](db, user_id)
+        ok = True
+    except SoftTimeLimitExceeded:
+        print(f"[ingest] {provider} for user {user_id} exceeded its time budget")
+    except Exception as e:
+        print(f"[ingest] {provider} for user {user_id} error: {e}")
+    finally:
+        ingest_scheduler.release_slot(provider, token)
+        ingest_scheduler.record_job(user_id, provider, cycle_id, time.monotonic() - started, ok)
+    if added:
+        model_registry.refresh(user_id)  # after the provider slot is released
+    return added
+
+@task_revoked.connect
+def _ingest_revoked(sender=None, request=None, **kwargs):
+    # Expired in the queue (or revoked): the task body never runs, so its
+    # pending marker and the cycle's backlog have to be settled here
+    if request is None or getattr(sender, "name", sender) != ingest_provider.name:
+        return
+    try:
+        ingest_scheduler.record_expired(*request.args)
+    except Exception as e:
+        print(f"[ingest] could not record revoked job {request.args}: {e}")
@@ -17,6 +17,9 @@ celery.conf.update(
     accept_content=["json"],
     timezone="UTC",
     enable_utc=True,
+    # Ingestion jobs are long and uneven; one at a time per process keeps
+    # the queue order fair instead of letting a busy worker hoard jobs.
+    worker_prefetch_multiplier=1,
 )
 
 @celery.task